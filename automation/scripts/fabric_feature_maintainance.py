@@ -11,6 +11,7 @@ parser.add_argument("--client_id", required=False, default=os.environ.get('CLIEN
 parser.add_argument("--client_secret", required=False, default=os.environ.get('CLIENT_SECRET'), help="Client secret of the Azure AD application registered for accessing Fabric APIs. Defaults to the CLIENT_SECRET environment variable.")
 parser.add_argument("--branch_name", required=False, default=default_branch_name, help="The name of the Git feature branch to operate on. Used for workspace setup, automation, and CI/CD logic. Defaults to a predefined variable `branch_name`.")
 parser.add_argument("--action", required=False, default="create", help="Action to perform: `create` to set up a new feature branch and workspace, `update` to synchronize repos and workspaces, `delete` to clean up. Default is `create`.")
+parser.add_argument("--trace_file", required=False, default=os.environ.get('FABRIC_TRACE_FILE'), help="Write a Chrome trace (JSON) of the run to this file, e.g. to attach it as a pipeline artifact. Open it in https://ui.perfetto.dev. Defaults to the FABRIC_TRACE_FILE environment variable.")
 
 args = parser.parse_args()
 tenant_id = args.tenant_id
@@ -19,6 +20,8 @@ client_secret = args.client_secret
 branch_name = args.branch_name
 action = args.action
 
+misc.enable_tracing(args.trace_file, f"fabric_feature_maintainance {action} {branch_name}")
+
 feature_json = misc.load_json(os.path.join(os.path.dirname(__file__), f'../resources/environments/feature.json'))
 layers = feature_json.get("layers")
 permissions = feature_json.get("permissions")
@@ -56,7 +59,7 @@ def filter_layers_by_branch(layers, branch_name_trimmed):
 layers = filter_layers_by_branch(layers, branch_name_trimmed)
 
 fabcli.run_command("config set encryption_fallback_enabled true")
-fabcli.run_command(f"auth login -u {client_id} -p {client_secret} --tenant {tenant_id}")
+fabcli.login(tenant_id, client_id, client_secret)
 
 if action == "create":
     misc.print_header(f"Setting up feature development workspaces")
@@ -66,18 +69,16 @@ if action == "create":
             workspace_name = feature_name.format(feature_name=feature_name_short, layer_name=layer)
             workspace_name_escaped = workspace_name.replace("/", "\\/")
 
-            if fabcli.run_command(f"exists {workspace_name_escaped}.Workspace").replace("*", "").strip().lower() == "false":
+            if not fabcli.workspace_exists(workspace_name):
                 misc.print_info(f"Creating workspace '{workspace_name}'...", bold=True, end="")
                 fabcli.run_command(f"create '{workspace_name_escaped}.Workspace' -P capacityname={capacity_name}")
-                workspace_id = fabcli.run_command(f"get '{workspace_name_escaped}.Workspace' -q id -f").strip()
+                workspace_id = fabcli.get_workspace_id(workspace_name)
                 misc.print_success(" ✔", bold=True)
 
                 if permissions:
                     misc.print_info(f"  • Assigning workspace permissions...", end="")
-                    for permission, definitions in permissions.items():
-                        for definition in definitions:
-                            fabcli.run_command(f"acl set '{workspace_name_escaped}.Workspace' -I {definition.get("id")} -R {permission.lower()} -f")
-                    misc.print_success(" ✔")
+                    role_assignments = misc.get_workspace_role_assignments(permissions)
+                    misc.print_role_assignment_result(fabcli.reconcile_workspace_roleassignments(workspace_id, role_assignments))
 
                 if layer_definition.get("spark_settings"):
                     misc.print_info(f"  • Set workspace spark settings... ", end="")
@@ -105,7 +106,7 @@ if action == "create":
                         connection_name = git_settings.get("myGitCredentials").get("connection_name").format(identity_id=identity_id, identity_username=identity_username)
                         
                         if fabcli.connection_exists(connection_name):
-                            connection_id = fabcli.run_command(f"get .connections/{connection_name}.Connection -q id -f")
+                            connection_id = fabcli.get_connection(connection_name).get("id")
                             git_settings["myGitCredentials"].pop("connection_name", None) # Remove connection name
                             git_settings["myGitCredentials"]["connectionId"] = connection_id # Add connection id required by Fabric REST API
                         
@@ -135,7 +136,7 @@ if action == "create":
                 misc.print_info(f"{workspace_name} already exist. Feature workspace creation skipped!", bold=True)
                 if layer_definition.get("git_synchronize_on_commit", False) and not layer_definition.get("git_disconnect_after_initialize", False):
                     misc.print_info(f"  • Synchronizing workspace {workspace_name_escaped} with latest changes from Git...", end="")
-                    workspace_id = fabcli.run_command(f"get '{workspace_name_escaped}.Workspace' -q id -f").strip()
+                    workspace_id = fabcli.get_workspace_id(workspace_name)
                     
                     git_status = fabcli.get_git_status(workspace_id)
 
@@ -158,7 +159,7 @@ elif action == "update": # Support workspace synchronization on commit for exist
             workspace_name_escaped = workspace_name.replace("/", "\\/")
             if layer_definition.get("git_synchronize_on_commit", False) and not layer_definition.get("git_disconnect_after_initialize", False):
                 misc.print_info(f"Synchronizing workspace {workspace_name_escaped} with latest changes from Git repo...", bold=True, end="")
-                workspace_id = fabcli.run_command(f"get '{workspace_name_escaped}.Workspace' -q id -f").strip()
+                workspace_id = fabcli.get_workspace_id(workspace_name)
 
                 git_status = fabcli.get_git_status(workspace_id)
                 if git_status and git_status.get("workspaceHead") == git_status.get("remoteCommitHash"):
@@ -180,7 +181,7 @@ elif action == "delete":
         workspace_name = feature_name.format(feature_name=feature_name_short, layer_name=layer)
         workspace_name_escaped = workspace_name.replace("/", "\\/")
         misc.print_info(f"Deleting workspace '{workspace_name}'... ", bold=True, end="")
-        if fabcli.run_command(f"exists {workspace_name_escaped}.Workspace").replace("*", "").strip().lower() == "true":
+        if fabcli.workspace_exists(workspace_name):
             fabcli.run_command(f"rm '{workspace_name_escaped}.Workspace' -f")
             misc.print_success(" ✔")
         else:
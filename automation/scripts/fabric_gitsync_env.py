@@ -10,6 +10,7 @@ parser.add_argument("--tenant_id", required=False, default=os.environ.get('TENAN
 parser.add_argument("--client_id", required=False, default=os.environ.get('CLIENT_ID'), help="Client ID of the Azure AD application registered for accessing Fabric APIs. Defaults to the CLIENT_ID environment variable.")
 parser.add_argument("--client_secret", required=False, default=os.environ.get('CLIENT_SECRET'), help="Client secret of the Azure AD application registered for accessing Fabric APIs. Defaults to the CLIENT_SECRET environment variable.")
 parser.add_argument("--environment", required=False, default=default_environment, help="The environment to operate on. Defaults to a predefined variable `environment`.")
+parser.add_argument("--trace_file", required=False, default=os.environ.get('FABRIC_TRACE_FILE'), help="Write a Chrome trace (JSON) of the run to this file, e.g. to attach it as a pipeline artifact. Open it in https://ui.perfetto.dev. Defaults to the FABRIC_TRACE_FILE environment variable.")
 
 args = parser.parse_args()
 tenant_id = args.tenant_id
@@ -17,6 +18,8 @@ client_id = args.client_id
 client_secret = args.client_secret
 environment = args.environment
 
+misc.enable_tracing(args.trace_file, f"fabric_gitsync_env {environment}")
+
 # Load JSON environment files (main and environment specific) and merge
 main_json = misc.load_json(os.path.join(os.path.dirname(__file__), f'../resources/environments/infrastructure.json'))
 env_json = misc.load_json(os.path.join(os.path.dirname(__file__), f'../resources/environments/infrastructure.{environment}.json'))
@@ -27,17 +30,18 @@ if env_definition:
     layers = env_definition.get("layers")
 
     fabcli.run_command("config set encryption_fallback_enabled true")
-    fabcli.run_command(f"auth login -u {client_id} -p {client_secret} --tenant {tenant_id}")
+    fabcli.login(tenant_id, client_id, client_secret)
 
-    # Perform workspace synchronization for all layers
+    # Start workspace synchronization for all layers, then wait for the updates together
     misc.print_header(f"Synchronizing environment workspaces")
+    operations = fabcli.OperationTracker()
     for layer, layer_definition in layers.items():
             workspace_name = solution_name.format(layer=layer, environment=environment)
             workspace_name_escaped = workspace_name.replace("/", "\\/")
 
             if layer_definition.get("git_synchronize_on_commit", True) and not layer_definition.get("git_disconnect_after_initialize", False):
                 misc.print_info(f"Synchronizing workspace {workspace_name_escaped} with latest changes from Git repo...", bold=True, end="")
-                workspace_id = fabcli.run_command(f"get '{workspace_name_escaped}.Workspace' -q id -f").strip()
+                workspace_id = fabcli.get_workspace_id(workspace_name)
 
                 git_status = fabcli.get_git_status(workspace_id)
                 if git_status is None:
@@ -50,7 +54,23 @@ if env_definition:
                     misc.print_warning(" ⚠ No changes detected.")
                     continue
                 else:
-                    fabcli.update_workspace_from_git(workspace_id, git_status.get("remoteCommitHash"))
-                    misc.print_success(" ✔")
+                    response = fabcli.update_workspace_from_git(workspace_id, git_status.get("remoteCommitHash"), wait=False)
+                    if isinstance(response, fabcli.LongRunningOperation):
+                        operations.add(workspace_name_escaped, response)
+                        misc.print_info(" ⧗ Started")
+                    else:
+                        misc.print_success(" ✔")
+
+    if operations.pending():
+        misc.print_info(f"Waiting for {len(operations.pending())} workspace update(s) to complete...", bold=True)
+
+        def print_result(workspace_name_escaped, operation):
+            if operation.succeeded:
+                misc.print_success(f"  • {workspace_name_escaped} ✔")
+            else:
+                misc.print_error(f"  • {workspace_name_escaped} ✖ {operation.status}")
+
+        with misc.trace_span("wait", "phase", operations=len(operations.pending())):
+            operations.wait(on_complete=print_result)
 
     misc.print_success(f"Environment workspaces synchronized!",bold = True)
@@ -9,12 +9,60 @@ default_environment = "tst"
 #---------------------------------------------------------
 # Main script
 #---------------------------------------------------------
-import os, sys, argparse, json
+import os, sys, argparse, json, functools
+from importlib.metadata import version
 from pathlib import Path
-from fabric_cicd import FabricWorkspace, publish_all_items, unpublish_all_orphan_items, change_log_level
+from fabric_cicd import FabricWorkspace, publish_all_items, unpublish_all_orphan_items, change_log_level, append_feature_flag
 import modules.fabric_cli_functions as fabcli
 import modules.misc_functions as misc
-from azure.identity import ClientSecretCredential
+import modules.auth_functions as authfunc
+
+# ReleaseWorkspace overrides private methods of FabricWorkspace, written against this version (pinned in requirements.txt)
+FABRIC_CICD_VERSION = "1.3.0"
+
+class ReleaseWorkspace(FabricWorkspace):
+    """
+    FabricWorkspace which also replaces the logical ids of items released to other workspaces (layers).
+    The logical ids of its own items and those of other layers are replaced in one pass per file.
+
+    Layers are released concurrently, each with its own instance. fabric_cicd keeps its state per
+    FabricWorkspace instance (publishing the items of one instance from its own worker threads, with
+    locks around the shared caches), apart from the feature flags set once before the release.
+    Items are published by those worker threads, so they write into the output of the layer's task.
+    """
+    def __init__(self, *args, logical_ids: dict = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.logical_ids = logical_ids or {}
+        self.task_output = misc.get_task_output()
+
+    def _publish_item(self, item_name: str, item_type: str, *args, **kwargs):
+        with misc.task_output(self.task_output), misc.trace_span(f"publish {item_type} {item_name}", "item", item_type=item_type, item_name=item_name):
+            return super()._publish_item(item_name, item_type, *args, **kwargs)
+
+    def _unpublish_item(self, item_name: str, item_type: str):
+        with misc.task_output(self.task_output), misc.trace_span(f"unpublish {item_type} {item_name}", "item", item_type=item_type, item_name=item_name):
+            return super()._unpublish_item(item_name, item_type)
+
+    def _replace_logical_ids(self, raw_file: str) -> str:
+        # Same contract as in fabric_cicd: the file with all resolvable logical ids replaced by guids
+        replacements = dict(self.logical_ids)
+        pending_logical_ids = []
+        for items in self.repository_items.values():
+            for item_details in items.values():
+                if item_details.logical_id == misc.DEFAULT_LOGICAL_ID:
+                    continue
+                if item_details.guid:
+                    replacements[item_details.logical_id] = item_details.guid
+                else:
+                    pending_logical_ids.append(item_details.logical_id)
+
+        raw_file = misc.replace_all(raw_file, replacements, misc.GUID_PATTERN)
+
+        # References to items not yet deployed are reported by fabric_cicd
+        if any(logical_id in raw_file for logical_id in pending_logical_ids):
+            return super()._replace_logical_ids(raw_file)
+        return raw_file
+
 
 # Ensure stdout and stderr are line-buffered
 sys.stdout.reconfigure(line_buffering=True, write_through=True)
@@ -28,6 +76,10 @@ parser.add_argument("--item_types", required=False, default=default_item_types_i
 parser.add_argument("--repo_path", required=False, default=default_solution_path, help="Path the the solution repository where items are stored.")
 parser.add_argument("--is_debug", required=False, default=False, type=lambda x: x.lower() in ['true', '1', 'yes'], help="Enable debug logging.")
 parser.add_argument("--unpublish_items", required=False, default=True, type=lambda x: x.lower() in ['true', '1', 'yes'], help="Whether to unpublish orphan items that are no longer in the repository. Default is True.")
+parser.add_argument("--force", required=False, default=False, type=lambda x: x.lower() in ['true', '1', 'yes'], help="Publish all items in scope, also those unchanged since the last release according to the deployment manifest.")
+parser.add_argument("--manifest_dir", required=False, default=os.environ.get('FABRIC_RELEASE_MANIFEST_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../.release/manifests')), help="Directory of the deployment manifests, one per environment and workspace. Persist it between releases (e.g. as a pipeline artifact or cache) to only publish changed items. Defaults to the FABRIC_RELEASE_MANIFEST_DIR environment variable or .release/manifests in the repository root.")
+parser.add_argument("--max_workers", required=False, default=8, type=int, help="Maximum number of layers released concurrently. Default is 8.")
+parser.add_argument("--trace_file", required=False, default=os.environ.get('FABRIC_TRACE_FILE'), help="Write a Chrome trace (JSON) of the run to this file, e.g. to attach it as a pipeline artifact. Open it in https://ui.perfetto.dev. Defaults to the FABRIC_TRACE_FILE environment variable.")
 parser.add_argument("--tenant_id", required=False, default=os.environ.get('TENANT_ID'), help="Azure Active Directory (Microsoft Entra ID) tenant ID used for authenticating with Fabric APIs. Defaults to the TENANT_ID environment variable.")
 parser.add_argument("--client_id", required=False, default=os.environ.get('CLIENT_ID'), help="Client ID of the Azure AD application registered for accessing Fabric APIs. Defaults to the CLIENT_ID environment variable.")
 parser.add_argument("--client_secret", required=False, default=os.environ.get('CLIENT_SECRET'), help="Client secret of the Azure AD application registered for accessing Fabric APIs. Defaults to the CLIENT_SECRET environment variable.")
@@ -42,16 +94,33 @@ item_type_list = args.item_types.split(",")
 repo_path = args.repo_path
 is_debug = args.is_debug
 unpublish_items = args.unpublish_items
+max_workers = args.max_workers
+force = args.force
+manifest_dir = args.manifest_dir
+
+misc.enable_tracing(args.trace_file, f"fabric_release {environment}")
+
+if version("fabric-cicd") != FABRIC_CICD_VERSION:
+    misc.print_warning(f"fabric-cicd {version('fabric-cicd')} is installed, the release is written against {FABRIC_CICD_VERSION}. Check the ReleaseWorkspace overrides before upgrading.")
 
 # Uncomment to enable debug logging
 if is_debug:
     change_log_level("DEBUG")
 
+# fabric_cicd logs to the stderr of import time. Through stdout its messages are part of the output of each layer
+misc.route_logger_to_stdout("fabric_cicd")
+misc.route_logger_to_stdout("console_only")
+
+# Publishing only the changed items relies on the selective deployment of fabric_cicd
+if not force:
+    append_feature_flag("enable_experimental_features")
+    append_feature_flag("enable_items_to_include")
+
 # Authenticate
 fabcli.run_command("config set encryption_fallback_enabled true")
-fabcli.run_command(f"auth login -u {client_id} -p {client_secret} --tenant {tenant_id}")
+fabcli.login(tenant_id, client_id, client_secret)
 
-token_credential = ClientSecretCredential(client_id=client_id, client_secret=client_secret, tenant_id=tenant_id)
+token_credential = authfunc.BrokerTokenCredential(tenant_id, client_id, client_secret)
 
 # Load JSON environment files (main and environment specific) and merge
 main_json = misc.load_json(os.path.join(os.path.dirname(__file__), f'../resources/environments/infrastructure.json'))
@@ -62,100 +131,215 @@ if env_definition:
     misc.print_header(f"Releasing - {environment}")
     
     solution_name = env_definition.get("name")
-    layers = env_definition.get("layers")
-    
-    environment_parameters = {}
+    layers = {layer: layer_definition for layer, layer_definition in env_definition.get("layers").items() if layer.lower() in layers_to_deploy}
+
+    # A layer waits only for the layers defining the logical ids its items reference. As in a sequential
+    # release, references resolve to layers earlier in the configured order, which keeps the graph acyclic
+    layer_order = list(layers)
+    layer_dependencies = {}
+    for layer, dependencies in misc.get_layer_dependencies({layer: os.path.join(repo_path, layer.lower()) for layer in layers}).items():
+        layer_dependencies[layer] = [dependency for dependency in dependencies if layer_order.index(dependency) < layer_order.index(layer)]
+        for dependency in set(dependencies) - set(layer_dependencies[layer]):
+            misc.print_warning(f"Layer {layer} references items of {dependency}, which is released after it. These references are not replaced.")
+
+    # Logical ids (lower case) of each released layer mapped to the guids of the deployed items
+    logical_id_mappings = {}
+
+    def get_manifest_path(workspace_id):
+        return os.path.join(manifest_dir, environment, f"{workspace_id}.json")
+
+    def load_manifest(workspace_id):
+        # Items deployed by the last release: "name.type" mapped to the logical id, guid and content hash
+        manifest_path = get_manifest_path(workspace_id)
+        if force or not os.path.exists(manifest_path):
+            return {}
+        try:
+            manifest = misc.read_json_from_file(manifest_path)
+        except (OSError, ValueError):
+            return {}
+        return manifest.get("items", {}) if manifest.get("workspace_id") == workspace_id else {}
+
+    # Lakehouse SQL endpoint connections used for binding, resolved once per release
+    lakehouse_connections = {}
 
-    for layer, layer_definition in layers.items():
-        if layer.lower() in layers_to_deploy:        
-            workspace_name = solution_name.format(layer=layer, environment=environment)
-            workspace_name_escaped = workspace_name.replace("/", "\\/")
+    def get_lakehouse_connection(lakehouse_ws_layer, lakehouse_name):
+        key = (lakehouse_ws_layer, lakehouse_name)
+        if key not in lakehouse_connections:
+            connection_name_template = misc.get_lakehouse_connection_template(env_definition, lakehouse_ws_layer, lakehouse_name)
+            connection_identifier = connection_name_template.format(environment=environment) if connection_name_template else None
+            lakehouse_connections[key] = misc.parse_fabric_connection(fabcli.get_connection(connection_identifier)) if connection_identifier else {}
+        return lakehouse_connections[key]
 
-            workspace_id = fabcli.run_command(f"get '{workspace_name_escaped}.Workspace' -q id -f").strip()
+    def release_layer(layer, layer_definition):
+        workspace_name = solution_name.format(layer=layer, environment=environment)
 
-            misc.print_subheader(f"Running release to workspace {workspace_name}!")
+        workspace_id = fabcli.get_workspace_id(workspace_name)
 
-            target_workspace = FabricWorkspace(
-                workspace_id=workspace_id,
-                environment=environment,
-                repository_directory=os.path.join(repo_path, layer.lower()),
-                item_type_in_scope=item_type_list,
-                token_credential=token_credential,
-            )
+        misc.print_subheader(f"Running release to workspace {workspace_name}!")
 
-            environment_parameters = {**target_workspace.environment_parameter, **environment_parameters}
-            target_workspace.environment_parameter = environment_parameters
+        ### Support deployment to multiple layers in the same environment.
+        ### References to items of other layers are replaced through the guid mappings of those layers,
+        ### merged into one lookup. Logical ids handled by the parameter file are left to it.
+        logical_ids = {}
+        for dependency in layer_dependencies.get(layer, []):
+            logical_ids.update(logical_id_mappings.get(dependency, {}))
 
-            publish_all_items(target_workspace)
+        target_workspace = ReleaseWorkspace(
+            workspace_id=workspace_id,
+            environment=environment,
+            repository_directory=os.path.join(repo_path, layer.lower()),
+            item_type_in_scope=item_type_list,
+            token_credential=token_credential,
+            logical_ids=logical_ids,
+        )
 
-            ### Support deployment to multiple layers in the same environment.
-            ### This is done by adding the guid mappings to the environment parameter dictionary.
-            if environment_parameters:
-                for item_name in target_workspace.repository_items.values():
-                    for item_details in item_name.values():
-                        environment_parameters["find_replace"].append({
-                            "find_value": item_details.logical_id,
-                            "replace_value": {environment: item_details.guid}
-                        })
+        environment_parameters = target_workspace.environment_parameter or {}
+        for parameter_dict in environment_parameters.get("find_replace", []):
+            logical_ids.pop(str(parameter_dict.get("find_value", "")).lower(), None)
 
-            if unpublish_items:
+        # Items whose definition and parameters are unchanged since the last release, and which are still deployed, are skipped
+        manifest_items = load_manifest(workspace_id)
+        workspace_inventory = fabcli.get_workspace_inventory(workspace_id)
+        repository_items = {
+            f"{item['name']}.{item['type']}": {
+                **item,
+                "content_hash": misc.get_content_hash(item["path"], environment, os.path.relpath(item["path"], target_workspace.repository_directory), environment_parameters, logical_ids)
+            }
+            for item in misc.get_repository_items(target_workspace.repository_directory, item_type_list)
+        }
+
+        # References to items of this layer are replaced by their guids as well, so the guids of the referenced items are part of the hash
+        own_logical_ids = {
+            item["logical_id"].lower(): key
+            for key, item in repository_items.items()
+            if item["logical_id"] and item["logical_id"] != misc.DEFAULT_LOGICAL_ID
+        }
+        for item in repository_items.values():
+            item["references"] = sorted(misc.get_referenced_guids(item["path"]) & own_logical_ids.keys())
+
+        def get_item_hash(item, guids):
+            return misc.get_salted_hash(item["content_hash"], {logical_id: guids.get(own_logical_ids[logical_id]) for logical_id in item["references"]})
+
+        def get_current_guid(key, item):
+            guid = manifest_items.get(key, {}).get("guid")
+            if guid and workspace_inventory.get_by_id(guid):
+                return guid
+            return (workspace_inventory.get(item["type"], item["name"]) or {}).get("id")
+
+        current_guids = {key: get_current_guid(key, item) for key, item in repository_items.items()}
+        changed_items = [
+            key for key, item in repository_items.items()
+            if manifest_items.get(key, {}).get("hash") != get_item_hash(item, current_guids) or not workspace_inventory.get_by_id(manifest_items[key].get("guid"))
+        ]
+
+        # Items created by this release get a new guid, which has to be replaced in the items referencing them
+        created_logical_ids = {logical_id for logical_id, key in own_logical_ids.items() if key in changed_items and not current_guids[key]}
+        changed_items += [
+            key for key, item in repository_items.items()
+            if key not in changed_items and created_logical_ids.intersection(item["references"])
+        ]
+
+        with misc.trace_span("publish", "phase", layer=layer, items=len(repository_items), changed=len(changed_items)):
+            if len(changed_items) == len(repository_items):
+                publish_all_items(target_workspace)
+            elif changed_items:
+                misc.print_info(f"Publishing {len(changed_items)} changed of {len(repository_items)} items: {', '.join(sorted(changed_items))}")
+                publish_all_items(target_workspace, items_to_include=changed_items)
+            else:
+                misc.print_info(f"All {len(repository_items)} items are unchanged since the last release. Skipping publish.")
+
+        deployed_guids = {}
+        for key, item in repository_items.items():
+            published_item = target_workspace.repository_items.get(item["type"], {}).get(item["name"]) if key in changed_items else None
+            guid = published_item.guid if published_item else manifest_items.get(key, {}).get("guid")
+            if guid and guid != misc.DEFAULT_GUID:
+                deployed_guids[key] = guid
+
+        # Hashed with the guids deployed now, which the next release compares against
+        deployed_items = {
+            key: {"logical_id": repository_items[key]["logical_id"], "guid": guid, "hash": get_item_hash(repository_items[key], deployed_guids)}
+            for key, guid in deployed_guids.items()
+        }
+
+        os.makedirs(os.path.dirname(get_manifest_path(workspace_id)), exist_ok=True)
+        misc.save_json_to_file({"workspace_id": workspace_id, "environment": environment, "layer": layer, "items": deployed_items}, get_manifest_path(workspace_id))
+
+        logical_id_mappings[layer] = {
+            item["logical_id"].lower(): item["guid"]
+            for item in deployed_items.values()
+            if item["logical_id"] and item["logical_id"] != misc.DEFAULT_LOGICAL_ID
+        }
+
+        if unpublish_items:
+            with misc.trace_span("unpublish", "phase", layer=layer):
                 unpublish_all_orphan_items(target_workspace)
 
-            # Bind Semantic Models to SQL Endpoints (if configured)
-            try:
-                bindings_yml = os.path.join(os.path.dirname(__file__), f"../resources/parameters/sqlendpoint_model_binding.yml")
-                bindings = misc.get_semantic_model_bindings(bindings_yml, layer)
-
-                if bindings:
-                    misc.print_subheader("Binding semantic models to SQL endpoints")
-
-                    for binding in bindings:
-                        lakehouse_name = binding.get("lakehouse_name")
-                        lakehouse_ws_layer = binding.get("lakehouse_ws_layer")
-                        semantic_models = binding.get("semantic_models", [])
-
-                        # Resolve lakehouse connection and SQL endpoint information
-                        connection_name_template = misc.get_lakehouse_connection_template(env_definition, lakehouse_ws_layer, lakehouse_name)
-                        connection_identifier = connection_name_template.format(environment=environment) if connection_name_template else None
-
-                        connection_id = None
-                        database_name = None
-                        sqlendpoint = None
-                        if connection_identifier:
-                            conn_obj = fabcli.get_connection(connection_identifier)
-                            if conn_obj:
-                                conn_details = misc.parse_fabric_connection(conn_obj)
-                                connection_id = conn_details.get("connection_id")
-                                sqlendpoint = conn_details.get("sqlendpoint")
-                                database_name = conn_details.get("database_name")
-
-                        # Check if connection information was resolved successfully
-                        if not (connection_id and sqlendpoint and database_name):
-                            misc.print_warning(f"Connection information for {lakehouse_name} is incomplete. Skipping all models for this lakehouse.")
+        # Bind Semantic Models to SQL Endpoints (if configured)
+        try:
+            bindings_yml = os.path.join(os.path.dirname(__file__), f"../resources/parameters/sqlendpoint_model_binding.yml")
+            bindings = misc.get_semantic_model_bindings(bindings_yml, layer)
+
+            if bindings:
+                misc.print_subheader("Binding semantic models to SQL endpoints")
+
+                for binding in bindings:
+                    lakehouse_name = binding.get("lakehouse_name")
+                    lakehouse_ws_layer = binding.get("lakehouse_ws_layer")
+                    semantic_models = binding.get("semantic_models", [])
+
+                    # Resolve lakehouse connection and SQL endpoint information
+                    conn_details = get_lakehouse_connection(lakehouse_ws_layer, lakehouse_name)
+                    connection_id = conn_details.get("connection_id")
+                    sqlendpoint = conn_details.get("sqlendpoint")
+                    database_name = conn_details.get("database_name")
+
+                    # Check if connection information was resolved successfully
+                    if not (connection_id and sqlendpoint and database_name):
+                        misc.print_warning(f"Connection information for {lakehouse_name} is incomplete. Skipping all models for this lakehouse.")
+                        continue
+
+                    # Now bind all semantic models to this lakehouse
+                    semantic_model_ids = {}
+                    for semantic_model_name in semantic_models:
+                        # Guid recorded on publish, or for models out of scope the workspace items listed before publish
+                        semantic_model = deployed_items.get(f"{semantic_model_name}.SemanticModel") or {}
+                        semantic_model_id = semantic_model.get("guid") or (workspace_inventory.get("SemanticModel", semantic_model_name) or {}).get("id")
+                        if not semantic_model_id:
+                            misc.print_warning(f"Semantic model '{semantic_model_name}' not found in workspace {workspace_name}. Skip binding.")
                             continue
+                        semantic_model_ids[semantic_model_name] = semantic_model_id
 
-                        # Now bind all semantic models to this lakehouse
-                        for semantic_model_name in semantic_models:
-                            semantic_model_id = fabcli.run_command(f"get '/{workspace_name}.Workspace/{semantic_model_name}.SemanticModel' -q id -f").strip()
-                            if not semantic_model_id:
-                                misc.print_warning(f"Semantic model '{semantic_model_name}' not found in workspace {workspace_name}. Skip binding.")
-                                continue
-
-                            resp = fabcli.bind_semanticmodel_sqlendpoint(
-                                workspace_id=workspace_id,
-                                item_id=semantic_model_id,
-                                connection_id=connection_id,
-                                sqlendpoint=sqlendpoint,
-                                database_name=database_name,
-                            )
-                            status = (resp or {}).get("status_code")
-                            if status == 200:
-                                misc.print_success(f"Binding '{semantic_model_name}' to SQL endpoint for lakehouse '{lakehouse_name}' successfully done.")
-                            else:
-                                misc.print_warning(f"Binding call returned non-success (status code {status}) for '{semantic_model_name}': {resp}")
-                else:
-                    misc.print_info("No semantic model bindings configured for this layer.")
-            except Exception as e:
-                misc.print_warning(f"Semantic model binding step encountered an error: {e}")
+                    with misc.trace_span("bind", "phase", layer=layer, lakehouse=lakehouse_name, semantic_models=len(semantic_model_ids)):
+                        results = fabcli.bind_semanticmodels_sqlendpoint(
+                            workspace_id=workspace_id,
+                            semantic_models=semantic_model_ids,
+                            connection_id=connection_id,
+                            sqlendpoint=sqlendpoint,
+                            database_name=database_name,
+                        )
+                    for semantic_model_name, result in results.items():
+                        resp = result.get("response")
+                        if result.get("status") == "bound":
+                            misc.print_success(f"Binding '{semantic_model_name}' to SQL endpoint for lakehouse '{lakehouse_name}' successfully done.")
+                        elif result.get("status") == "unchanged":
+                            misc.print_info(f"Semantic model '{semantic_model_name}' is already bound to SQL endpoint for lakehouse '{lakehouse_name}'.")
+                        else:
+                            misc.print_warning(f"Binding call returned non-success (status code {(resp or {}).get('status_code')}) for '{semantic_model_name}': {resp}")
+            else:
+                misc.print_info("No semantic model bindings configured for this layer.")
+        except Exception as e:
+            misc.print_warning(f"Semantic model binding step encountered an error: {e}")
+
+    tasks = {
+        layer: (functools.partial(release_layer, layer, layer_definition), layer_dependencies.get(layer, []))
+        for layer, layer_definition in layers.items()
+    }
+    results = misc.run_task_graph(tasks, max_workers)
+
+    skipped_layers = [name for name, result in results.items() if result.get("status") == "skipped"]
+    failed_layers = [name for name, result in results.items() if result.get("status") == "failed"]
+    if failed_layers:
+        misc.print_error(f"\nRelease failed for: {', '.join(failed_layers)}" + (f". Skipped: {', '.join(skipped_layers)}" if skipped_layers else ""), True)
+        sys.exit(1)
 else:
     misc.print_error(f"No environment definition found for environment {environment}! Release of {environment} has been skipped.", True)
\ No newline at end of file
@@ -7,9 +7,11 @@ default_environment = "dev"
 #---------------------------------------------------------
 # Main script
 #---------------------------------------------------------
-import os, sys, io, argparse, time, json
+import os, sys, io, argparse, time, json, copy, functools
 import modules.fabric_cli_functions as fabcli
 import modules.misc_functions as misc
+import modules.plan_functions as planfunc
+import modules.auth_functions as authfunc
 
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 sys.stdout.reconfigure(line_buffering=True)
@@ -22,6 +24,11 @@ parser.add_argument("--tenant_id", required=False, default=os.environ.get('TENAN
 parser.add_argument("--client_id", required=False, default=os.environ.get('CLIENT_ID'), help="Client ID of the Azure AD application registered for accessing Fabric APIs. Defaults to the CLIENT_ID environment variable.")
 parser.add_argument("--client_secret", required=False, default=os.environ.get('CLIENT_SECRET'), help="Client secret of the Azure AD application registered for accessing Fabric APIs. Defaults to the CLIENT_SECRET environment variable.")
 parser.add_argument("--github_pat", required=False, default=os.environ.get('GITHUB_PAT'), help="Github Personal Access Token. Used when source control provider is GitHub. Defaults to the FAB_GITHUB_PAT environment variable.")
+parser.add_argument("--max_workers", required=False, default=8, type=int, help="Maximum number of setup or teardown tasks run concurrently. Default is 8.")
+parser.add_argument("--plan", required=False, default=False, nargs="?", const=True, type=lambda x: x.lower() in ['true', '1', 'yes'], help="Compare the environment definition with the actual environment and write the changes to the plan file, without making any changes.")
+parser.add_argument("--apply", required=False, default=False, nargs="?", const=True, type=lambda x: x.lower() in ['true', '1', 'yes'], help="Apply only the changes of a plan. Uses the plan file when it is given, otherwise the environment is planned first.")
+parser.add_argument("--plan_file", required=False, default=None, help="JSON plan file written by --plan and read by --apply. Defaults to setup_plan.<environment>.json in the working directory.")
+parser.add_argument("--trace_file", required=False, default=os.environ.get('FABRIC_TRACE_FILE'), help="Write a Chrome trace (JSON) of the run to this file, e.g. to attach it as a pipeline artifact. Open it in https://ui.perfetto.dev. Defaults to the FABRIC_TRACE_FILE environment variable.")
 
 args = parser.parse_args()
 environment = args.environment
@@ -29,19 +36,222 @@ tenant_id = args.tenant_id
 client_id = args.client_id
 client_secret = args.client_secret
 github_pat = args.github_pat
+max_workers = args.max_workers
+plan_mode = args.plan
+apply_mode = args.apply
+plan_file = args.plan_file
 action = args.action.lower()
 
+# Plans only cover creating the environment. A requested dry run must never fall through to the teardown
+if action != "create" and (plan_mode or apply_mode or plan_file):
+    parser.error(f"--plan, --apply and --plan_file are only supported with --action create, not '{args.action}'.")
+
+misc.enable_tracing(args.trace_file, f"fabric_setup {action} {environment}")
+
 # Authenticate
 fabcli.run_command("config set encryption_fallback_enabled true")
 fabcli.run_command("config set folder_listing_enabled true")
-fabcli.run_command(f"auth login -u {client_id} -p {client_secret} --tenant {tenant_id}")
+fabcli.login(tenant_id, client_id, client_secret)
 
 # Load JSON environment files (main and environment specific) and merge
 main_json = misc.load_json(os.path.join(os.path.dirname(__file__), f'../resources/environments/infrastructure.json'))
 env_json = misc.load_json(os.path.join(os.path.dirname(__file__), f'../resources/environments/infrastructure.{environment}.json'))
 env_definition = misc.merge_json(main_json, env_json)
 
-if action == "create":
+
+def create_git_provider_connection(git_settings):
+    connection_name = git_settings.get("myGitCredentials").get("connection_name")
+    repo_url = planfunc.get_git_repo_url(git_settings)
+    if git_settings.get('gitProviderDetails').get('gitProviderType').lower() == "github":
+        fabcli.create_github_connection(connection_name, repo_url, github_pat)
+    else:
+        fabcli.create_azuredevops_connection(connection_name, repo_url, tenant_id, client_id, client_secret)
+    return fabcli.get_connection(connection_name)
+
+
+def connect_workspace_git(workspace_id, directory_name, connection_id):
+    # Each workspace connects with its own copy, as workspaces set their own directory
+    workspace_git_settings = copy.deepcopy(env_definition.get("generic").get("git_settings"))
+    if workspace_git_settings.get("myGitCredentials").get("connection_name"):
+        workspace_git_settings["myGitCredentials"].pop("connection_name", None) # Remove connection name
+        workspace_git_settings["myGitCredentials"]["connectionId"] = connection_id # Add connection id instead
+    workspace_git_settings["gitProviderDetails"]["directoryName"] = directory_name
+
+    connect_response = fabcli.connect_workspace_to_git(workspace_id, workspace_git_settings)
+    if connect_response:
+        init_response = fabcli.initialize_git_connection(workspace_id)
+        if init_response and init_response.get("requiredAction") != "None" and init_response.get("remoteCommitHash"):
+            fabcli.update_workspace_from_git(workspace_id, init_response.get("remoteCommitHash"))
+    return connect_response
+
+
+def get_sql_connection_target(item_type, item_name, item_metadata):
+    # Server and database of the SQL connection to a Lakehouse, SQLDatabase or Warehouse
+    properties = item_metadata.get("properties")
+    server = (
+        properties.get("serverFqdn") if item_type == "SQLDatabase" else
+        properties.get("sqlEndpointProperties", {}).get("connectionString") if item_type == "Lakehouse" else
+        properties.get("connectionString")
+    )
+    database = item_name if item_type in ("Lakehouse", "Warehouse") else properties.get("databaseName")
+    return server, database
+
+
+def resolve_workspace_identity(workspace_identity, layer=None):
+    # Service principal id of a workspace identity, by the (templated) name of its workspace. None while it does not exist
+    workspace_name = workspace_identity.format(layer=layer, environment=environment)
+    workspace_id = fabcli.get_workspace_id(workspace_name)
+    identity = fabcli.get_workspace_inventory(workspace_id).get("ManagedIdentity", workspace_name) if workspace_id else None
+    return identity.get("id") if identity else None
+
+
+def get_prune_permissions(layer_definition=None):
+    # Whether role assignments not in the definition are removed. Set in "generic" and overridden per layer, off by default
+    default = env_definition.get("generic", {}).get("prune_permissions", False)
+    return (layer_definition or {}).get("prune_permissions", default)
+
+
+def get_protected_principals():
+    # The principal running the setup never prunes its own role assignments
+    access_token = authfunc.get_access_token(tenant_id, client_id, client_secret, "https://api.fabric.microsoft.com")
+    return [authfunc.get_token_object_id(access_token)]
+
+
+def assign_connection_permissions(connection_id, permissions, layer=None, prune=False):
+    print(f"  • Assigning connection permissions...", end="")
+    role_assignments = misc.get_connection_role_assignments(permissions, lambda workspace_identity: resolve_workspace_identity(workspace_identity, layer))
+    misc.print_role_assignment_result(fabcli.reconcile_connection_roleassignments(connection_id, role_assignments, prune=prune, keep=get_protected_principals() if prune else None))
+
+
+if action == "create" and (plan_mode or apply_mode):
+    if plan_file and apply_mode and not plan_mode and os.path.exists(plan_file):
+        misc.print_header(f"Loading plan for {environment} environment")
+        plan = planfunc.load_plan(plan_file)
+        if plan.get("environment") != environment:
+            misc.print_error(f"Plan file '{plan_file}' was created for the {plan.get('environment')} environment, not {environment}.")
+            sys.exit(1)
+    else:
+        misc.print_header(f"Planning {environment} environment")
+        with misc.trace_span("plan", "phase") as span:
+            plan = planfunc.build_plan(env_definition, environment)
+            span["changes"] = len(plan["changes"])
+
+    planfunc.print_plan(plan)
+
+    if plan_mode:
+        plan_file = plan_file or planfunc.get_default_plan_file(environment)
+        planfunc.save_plan(plan, plan_file)
+        misc.print_info(f"Plan written to {plan_file}")
+
+    if plan.get("errors"):
+        misc.print_error(f"The plan has errors{', no changes were applied' if apply_mode else ''}. Resolve them and plan again.")
+        sys.exit(1)
+
+    if apply_mode and plan["changes"]:
+        misc.print_header(f"Applying plan to {environment} environment")
+        changes = {change["address"]: change for change in plan["changes"]}
+
+        def get_principal_id(attributes):
+            if attributes.get("principal_id"):
+                return attributes["principal_id"]
+            identity_workspace = attributes["identity_workspace"].replace("/", "\\/")
+            return fabcli.run_command(f"get '{identity_workspace}.Workspace' -q workspaceIdentity.servicePrincipalId -f").strip()
+
+        def get_workspace_id(workspace_name):
+            workspace_id = fabcli.get_workspace_id(workspace_name)
+            if not workspace_id:
+                raise RuntimeError(f"Workspace '{workspace_name}' could not be resolved")
+            return workspace_id
+
+        def apply_change(change):
+            attributes = change["attributes"]
+            resource_type = change["type"]
+            workspace_name_escaped = (attributes.get("workspace") or attributes.get("name")).replace("/", "\\/")
+            misc.print_info(f"{'Creating' if change['action'] == 'create' else 'Updating'} {change['address']}...", bold=True, end="")
+
+            if resource_type == "workspace":
+                fabcli.run_command(f"create '{workspace_name_escaped}.Workspace' -P capacityname={attributes['capacity_name']}")
+
+            elif resource_type == "workspace_role":
+                workspace_id = get_workspace_id(attributes["workspace"])
+                if change["action"] == "update":
+                    response = fabcli.update_workspace_roleassignment(workspace_id, attributes["role_assignment_id"], attributes["role"])
+                else:
+                    response = fabcli.add_workspace_roleassignment(workspace_id, get_principal_id(attributes), attributes["principal_type"], attributes["role"])
+                if not 200 <= (response.get("status_code") or 0) < 300:
+                    raise RuntimeError(f"Role assignment failed with status {response.get('status_code')}")
+
+            elif resource_type == "workspace_identity":
+                fabcli.run_command(f"create '{workspace_name_escaped}.Workspace/.managedidentities/{workspace_name_escaped}.ManagedIdentity'")
+
+            elif resource_type == "item":
+                item_folder = f"{attributes['item_folder']}/" if attributes.get("item_folder") else ""
+                item_path = f"/{workspace_name_escaped}.Workspace/{item_folder}{attributes['item_name']}.{attributes['item_type']}"
+                fabcli.run_command(f"create '{item_path}'")
+                item_metadata = fabcli.get_item(item_path, retry_count=2)
+                if not item_metadata:
+                    raise RuntimeError(f"Item '{attributes['item_name']}' was not created")
+                if attributes["item_type"] == "Lakehouse" and not fabcli.is_sql_endpoint_ready(item_metadata):
+                    fabcli.watch_sql_endpoint(get_workspace_id(attributes["workspace"]), item_metadata.get("id"))
+
+            elif resource_type == "private_endpoint":
+                resource_kind = misc.get_private_endpoint_resource_type(attributes["target_id"])
+                fabcli.run_command(
+                    f"create '{workspace_name_escaped}.Workspace/.managedprivateendpoints/{attributes['name']}.ManagedPrivateEndpoint'"
+                    f" -P targetPrivateLinkResourceId={attributes['target_id']},targetSubresourceType={resource_kind},"
+                    f"autoApproveEnabled={'true' if attributes['auto_approve'] else 'false'}"
+                )
+
+            elif resource_type == "git":
+                git_connection = fabcli.get_connection(attributes["connection"])
+                if not git_connection or not connect_workspace_git(get_workspace_id(attributes["workspace"]), attributes["directory_name"], git_connection.get("id")):
+                    raise RuntimeError("Git connection failed. Please verify connection and tenant settings.")
+
+            elif resource_type == "connection" and attributes["kind"] == "fabric":
+                if not fabcli.create_fabric_connection(attributes["name"], attributes["connection_type"], attributes["credential_type"], tenant_id, client_id, client_secret):
+                    raise RuntimeError(f"Connection '{attributes['name']}' was not created")
+
+            elif resource_type == "connection" and attributes["kind"] == "git":
+                if not create_git_provider_connection(env_definition.get("generic").get("git_settings")):
+                    raise RuntimeError(f"Connection '{attributes['name']}' was not created")
+
+            elif resource_type == "connection" and attributes["kind"] == "sql":
+                item_folder = f"{attributes['item_folder']}/" if attributes.get("item_folder") else ""
+                item_metadata = fabcli.get_item(f"/{workspace_name_escaped}.Workspace/{item_folder}{attributes['item_name']}.{attributes['item_type']}", retry_count=2)
+                if attributes["item_type"] == "Lakehouse" and item_metadata and not fabcli.is_sql_endpoint_ready(item_metadata):
+                    item_metadata = fabcli.wait_for_sql_endpoint(get_workspace_id(attributes["workspace"]), item_metadata.get("id")) or item_metadata
+                if not item_metadata:
+                    raise RuntimeError(f"Item '{attributes['item_name']}' could not be retrieved")
+                server, database = get_sql_connection_target(attributes["item_type"], attributes["item_name"], item_metadata)
+                fabcli.create_sql_connection(attributes["name"], server, database, tenant_id, client_id, client_secret)
+
+            elif resource_type == "connection_role":
+                connection_id = attributes.get("connection_id") or (fabcli.get_connection(attributes["connection"]) or {}).get("id")
+                if not connection_id:
+                    raise RuntimeError(f"Connection '{attributes['connection']}' could not be resolved")
+                if change["action"] == "update":
+                    response = fabcli.update_connection_roleassignment(connection_id, attributes["role_assignment_id"], attributes["role"])
+                else:
+                    response = fabcli.add_connection_roleassignment(connection_id, get_principal_id(attributes), attributes["principal_type"], attributes["role"])
+                if not 200 <= ((response or {}).get("status_code") or 0) < 300:
+                    raise RuntimeError(f"Role assignment failed with status {(response or {}).get('status_code')}")
+
+            misc.print_success(" ✔")
+
+        tasks = {
+            address: (functools.partial(apply_change, change), [dependency for dependency in change["depends_on"] if dependency in changes])
+            for address, change in changes.items()
+        }
+        results = misc.run_task_graph(tasks, max_workers)
+
+        skipped_tasks = [name for name, result in results.items() if result.get("status") == "skipped"]
+        failed_tasks = [name for name, result in results.items() if result.get("status") == "failed"]
+        if failed_tasks:
+            misc.print_error(f"\nFailed: {', '.join(failed_tasks)}" + (f". Skipped: {', '.join(skipped_tasks)}" if skipped_tasks else ""))
+
+    print("")
+
+elif action == "create":
     generic_connection_header_printed = False
     connection_permissions = env_definition.get("generic", {}).get("permissions")
 
@@ -70,18 +280,7 @@ if action == "create":
                 fabric_connection = fabcli.get_connection(connection.get('name'))
 
             if connection_permissions and fabric_connection:
-                print(f"  • Assigning connection permissions...", end="")
-                
-                for permission, definitions in connection_permissions.items():
-                    for definition in definitions:
-                        role = "Owner" if permission == "Admin" else "User"
-                        fabcli.add_connection_roleassignment(
-                            fabric_connection.get("id"),
-                            definition.get("id"),
-                            definition.get("type"),
-                            role
-                            )
-                misc.print_success(" ✔")
+                assign_connection_permissions(fabric_connection.get("id"), connection_permissions, prune=get_prune_permissions())
 
 
     git_settings = env_definition.get("generic").get("git_settings")
@@ -99,29 +298,11 @@ if action == "create":
             git_connection = fabcli.get_connection(connection_identifier)
             misc.print_warning(f" ⚠ Already exists")
         else:           
-            if git_settings.get('gitProviderDetails').get('gitProviderType').lower() == "github":
-                repo_url = f"https://github.com/{git_settings.get('gitProviderDetails').get('ownerName')}/{git_settings.get('gitProviderDetails').get('repositoryName')}"
-                fabcli.create_github_connection(git_settings.get("myGitCredentials").get("connection_name"), repo_url, github_pat)
-                git_connection = fabcli.get_connection(connection_identifier)
-            else:
-                repo_url = f"https://dev.azure.com/{git_settings.get('gitProviderDetails').get('organizationName')}/{git_settings.get('gitProviderDetails').get('projectName')}/_git/{git_settings.get('gitProviderDetails').get('repositoryName')}"
-                fabcli.create_azuredevops_connection(git_settings.get("myGitCredentials").get("connection_name"), repo_url, tenant_id, client_id, client_secret)
-                git_connection = fabcli.get_connection(connection_identifier)
-            
+            git_connection = create_git_provider_connection(git_settings)
             misc.print_success(" ✔")
 
         if connection_permissions and git_connection:
-            print(f"  • Assigning connection permissions...", end="")
-            for permission, definitions in connection_permissions.items():
-                for definition in definitions:
-                    role = "Owner" if permission == "Admin" else "User"
-                    fabcli.add_connection_roleassignment(
-                        git_connection.get("id"),
-                        definition.get("id"),
-                        definition.get("type"),
-                        role
-                        )
-            misc.print_success(" ✔")
+            assign_connection_permissions(git_connection.get("id"), connection_permissions, prune=get_prune_permissions())
 
     if env_definition:
         misc.print_header(f"Setting up {environment} environment")
@@ -129,105 +310,112 @@ if action == "create":
         solution_name = env_definition.get("name")
         layers = env_definition.get("layers")
         default_capacity_name = env_definition.get("generic").get("capacity_name")
-        workspace_identity_acl = {}
+        workspace_layers = {solution_name.format(layer=layer, environment=environment): layer for layer in layers}
 
-        has_item_connections = False
-        for layer, layer_definition in layers.items():
-            print("")
-            workspace_name = solution_name.format(layer=layer, environment=environment)
+        def get_layer_permissions(layer_definition):
+            return misc.merge_permissions(
+                layer_definition.get("permissions"),
+                env_definition.get("generic", {}).get("permissions")
+            )
+
+        def get_workspace_identities(layer, layer_definition):
+            # Workspace identities granted access to the layer's workspace, by workspace identity name
+            return [
+                definition.get("name").format(layer=layer, environment=environment)
+                for definitions in (get_layer_permissions(layer_definition) or {}).values()
+                for definition in definitions
+                if definition.get("type").lower() == "workspaceidentity"
+            ]
+
+        def has_item_connections(layer_definition):
+            return any(
+                item.get("connection_name") and item_type in {"Lakehouse", "SQLDatabase", "Warehouse"}
+                for item_type, items in (layer_definition.get("items") or {}).items()
+                for item in items
+            )
+
+        def create_workspace(layer, layer_definition):
+            workspace_name = layer_definition["workspace_name"]
             workspace_name_escaped = workspace_name.replace("/", "\\/")
             capacity_name = layer_definition.get("capacity_name", default_capacity_name)
             
             misc.print_info(f"Creating workspace '{workspace_name}'...", bold=True, end="")
 
-            if fabcli.run_command(f"exists {workspace_name_escaped}.Workspace").replace("*", "").strip().lower() == "false":
+            if not fabcli.workspace_exists(workspace_name):
                 fabcli.run_command(f"create '{workspace_name_escaped}.Workspace' -P capacityname={capacity_name}")
                 misc.print_success(" ✔", bold=True)
             else:
                 misc.print_warning(f" ⚠ Already exists", bold=True)
 
-            workspace_id = fabcli.run_command(f"get '{workspace_name_escaped}.Workspace' -q id -f").strip()
+            workspace_id = fabcli.get_workspace_id(workspace_name)
+            if not workspace_id:
+                raise RuntimeError(f"Workspace '{workspace_name}' could not be resolved")
+            workspace_inventory = fabcli.get_workspace_inventory(workspace_id)
                 
             # Update layer_definition
             layer_definition["workspace_id"] = workspace_id
-            layer_definition["workspace_name"] = workspace_name
             
-            permissions = misc.merge_permissions(
-                layer_definition.get("permissions"),
-                env_definition.get("generic", {}).get("permissions")
-            )
+            permissions = get_layer_permissions(layer_definition)
             
-            if permissions:
-                #misc.print_info(f"  • Assigning workspace permissions...", end="")
-                for permission, definitions in permissions.items():
-                    for definition in definitions:
-                        if definition.get("type").lower() == "workspaceidentity":
-                            identity_name = definition.get("name").format(layer=layer, environment=environment)
-                            workspace_identity_acl[workspace_name_escaped] = identity_name
-                        else:
-                            misc.print_info(f"  • Assigning workspace permission for identity {definition.get('id')}...", end="")   
-                            fabcli.run_command(f"acl set {workspace_name_escaped}.Workspace -I {definition.get('id')} -R {permission.lower()} -f")
-                            misc.print_success(" ✔")
+            # Workspace identities are assigned by their own tasks, once the identity exists. When pruning,
+            # the identities which already exist are part of the desired assignments, so they are not removed
+            prune = get_prune_permissions(layer_definition)
+            role_assignments = misc.get_workspace_role_assignments(permissions, lambda workspace_identity: resolve_workspace_identity(workspace_identity, layer) if prune else None)
+            if role_assignments or prune:
+                misc.print_info(f"  • Assigning workspace permissions...", end="")
+                misc.print_role_assignment_result(fabcli.reconcile_workspace_roleassignments(workspace_id, role_assignments, prune=prune, keep=get_protected_principals() if prune else None))
                 
             if (layer_definition.get("create_workspace_identity", False)):
                 misc.print_info(f"  • Creating workspace identity...", end="")
-                if fabcli.run_command(f"exists {workspace_name_escaped}.Workspace/.managedidentities/{workspace_name_escaped}.ManagedIdentity").replace("*", "").strip().lower() == "false":
+                if not workspace_inventory.exists("ManagedIdentity", workspace_name):
                     fabcli.run_command(f"create {workspace_name_escaped}.Workspace/.managedidentities/{workspace_name_escaped}.ManagedIdentity")
+                    # With its service principal id, so connection roles of this run can resolve the identity
+                    workspace_inventory.add(fabcli.get_workspace_identity(workspace_id, workspace_name) or {"type": "ManagedIdentity", "displayName": workspace_name})
                     misc.print_success(" ✔")
                 else:
                     misc.print_warning(f" ⚠ Already exists", bold=True)      
 
+        def create_items(layer, layer_definition):
+            workspace_name = layer_definition["workspace_name"]
+            workspace_name_escaped = workspace_name.replace("/", "\\/")
+            workspace_inventory = fabcli.get_workspace_inventory(layer_definition["workspace_id"])
+
             if layer_definition.get("items"):
                 print_item_header = True
                 for item_type, items in layer_definition.get("items").items():
                     for item in items:
-                        if item.get("connection_name") and item_type in {"Lakehouse", "SQLDatabase", "Warehouse"}:
-                            has_item_connections = True
-
                         if not item.get("skip_item_creation", False):
                             if print_item_header:
-                                print(f"  • Creating workspace items:") 
+                                misc.print_info(f"Creating workspace items in '{workspace_name}':", bold=True) 
                                 print_item_header = False
 
                             item_folder = f'{item.get("item_folder")}/' if item.get("item_folder") else ""
                             misc.print_info(f"    ◦ {item_type}: {item_folder}{item.get("item_name")}...", end="")
 
-                            if not fabcli.item_exists(f'{workspace_name_escaped}.Workspace/{item_folder}{item.get("item_name")}.{item_type}'):    
+                            if not workspace_inventory.exists(item_type, item.get("item_name")):
                                 fabcli.run_command(f"create '{workspace_name_escaped}.Workspace/{item_folder}{item.get("item_name")}.{item_type}'")
                                 item["item_metadata"] = fabcli.get_item(f"/{workspace_name_escaped}.Workspace/{item_folder}{item.get('item_name')}.{item_type}", retry_count=2)
+                                workspace_inventory.add(item["item_metadata"])
                                 
-                                if item_type in {"Lakehouse"}: 
-                                    # Wait until SQL endpoint provisioning completes; treat missing metadata as still provisioning
-                                    start_time = time.time()
-                                    timeout_seconds = 60  # safety timeout
-                                    while True:
-                                        props = (item.get("item_metadata") or {}).get("properties") or {}
-                                        sql_props = props.get("sqlEndpointProperties") or {}
-                                        status = sql_props.get("provisioningStatus")
-                                        if status and status != "InProgress":
-                                            break
-                                        if time.time() - start_time > timeout_seconds:
-                                            misc.print_warning(" ⚠ Timed out waiting for Lakehouse SQL endpoint provisioning")
-                                            break
-                                        print(".", end="")
-                                        time.sleep(2)
-                                        item["item_metadata"] = fabcli.get_item(f"/{workspace_name_escaped}.Workspace/{item_folder}{item.get('item_name')}.{item_type}")
-
                                 if item["item_metadata"]:                           
                                     misc.print_success(" ✔")
                                 else:
                                     misc.print_error(" ✖ Failed!")
                             else:
-                                item["item_metadata"] = fabcli.get_item(f"/{workspace_name_escaped}.Workspace/{item.get('item_name')}.{item_type}")
+                                item["item_metadata"] = fabcli.get_item(f"/{workspace_name_escaped}.Workspace/{item_folder}{item.get('item_name')}.{item_type}")
                                 misc.print_warning(f" ⚠ Already exists")
+
+                            if item_type == "Lakehouse" and item["item_metadata"] and not fabcli.is_sql_endpoint_ready(item["item_metadata"]):
+                                # SQL endpoint provisioning completes in the background; item connections wait for it
+                                item["sql_endpoint"] = fabcli.watch_sql_endpoint(layer_definition["workspace_id"], item["item_metadata"].get("id"))
   
             if layer_definition.get("private_endpoints"):
-                print("  • Creating private endpoints:")
+                misc.print_info(f"Creating private endpoints in '{workspace_name}':", bold=True)
                 for private_endpoint in layer_definition.get("private_endpoints"):
                     resource_type = misc.get_private_endpoint_resource_type(private_endpoint.get("id"))
                     print(f"    ◦ Provisioning {private_endpoint.get('name')}...", end="")
 
-                    if (fabcli.item_exists(f"{workspace_name_escaped}.Workspace/.managedprivateendpoints/{private_endpoint.get('name')}.ManagedPrivateEndpoint")):
+                    if workspace_inventory.exists("ManagedPrivateEndpoint", private_endpoint.get("name")):
                         misc.print_warning(" ⚠ Already exists")
                     else:
                         try:
@@ -235,103 +423,96 @@ if action == "create":
                                 f'create {workspace_name_escaped}.Workspace/.managedprivateendpoints/'
                                 f'{private_endpoint.get("name")}.ManagedPrivateEndpoint'
                                 f' -P targetPrivateLinkResourceId={private_endpoint.get("id")},targetSubresourceType={resource_type},'
-                                f'autoApproveEnabled=true' if private_endpoint.get("auto_approve") else 'autoApproveEnabled=false'
+                                f'{"autoApproveEnabled=true" if private_endpoint.get("auto_approve") else "autoApproveEnabled=false"}'
                             )
+                            workspace_inventory.add({"type": "ManagedPrivateEndpoint", "displayName": private_endpoint.get("name")})
                             misc.print_success(" ✔")
                         except:
                             misc.print_error("  ✖ Failed!")
 
-            git_settings = env_definition.get("generic").get("git_settings")
-        
-            if git_settings and git_connection:
-                                
-                if git_settings.get("myGitCredentials").get("connection_name"):
-                    git_settings["myGitCredentials"].pop("connection_name", None) # Remove connection name
-                    git_settings["myGitCredentials"]["connectionId"] = git_connection.get("id") # Add connection id instead
-
-                if git_settings and layer_definition.get("git_directoryName"):
-                    misc.print_info(f"  • Setting up Git integration...", end="")
-                    git_settings = env_definition.get("generic").get("git_settings")
-                    git_settings["gitProviderDetails"]["directoryName"] = layer_definition.get("git_directoryName")                    
-                
-                    if git_connection.get("id"):                   
-                        connect_response = fabcli.connect_workspace_to_git(workspace_id, git_settings)
-                        if connect_response:                            
-                            init_response = fabcli.initialize_git_connection(workspace_id)
-                            if init_response and init_response.get("requiredAction") != "None" and init_response.get("remoteCommitHash"):
-                                fabcli.update_workspace_from_git(workspace_id, init_response.get("remoteCommitHash"))
-                            
-                            misc.print_success(" ✔")
+        def setup_git_integration(layer, layer_definition):
+            misc.print_info(f"Setting up Git integration for '{layer_definition['workspace_name']}'...", bold=True, end="")
+
+            if connect_workspace_git(layer_definition["workspace_id"], layer_definition.get("git_directoryName"), git_connection.get("id")):
+                misc.print_success(" ✔")
+            else:
+                misc.print_error(f" ✖ Failed! Please verify connection and tenant settings.")
+
+        def assign_workspace_identity(layer, layer_definition, workspace_identity):
+            workspace_name = layer_definition["workspace_name"]
+            workspace_name_escaped = workspace_name.replace("/", "\\/")
+            misc.print_info(f"Assigning workspace identity {workspace_identity} to {workspace_name_escaped}...", bold=True, end="")
+            identity_id = resolve_workspace_identity(workspace_identity, layer)
+            if not identity_id:
+                misc.print_error(" ✖ Workspace identity not found!")
+                return
+
+            # The role of the identity as defined in the layer's permissions, other principals are assigned by create_workspace
+            role_assignments = misc.get_workspace_role_assignments(get_layer_permissions(layer_definition), lambda name: resolve_workspace_identity(name, layer))
+            role_assignments = {principal_id: role_assignment for principal_id, role_assignment in role_assignments.items() if principal_id == identity_id.lower()}
+            misc.print_role_assignment_result(fabcli.reconcile_workspace_roleassignments(fabcli.get_workspace_id(workspace_name), role_assignments))
+
+        def create_item_connections(layer, layer_definition):
+            workspace_name_escaped = layer_definition["workspace_name"].replace("/", "\\/")
+            permissions = get_layer_permissions(layer_definition)
+
+            for item_type, items in layer_definition.get("items").items():
+                for item in items:
+
+                    if item.get("connection_name") and item_type in {"Lakehouse", "SQLDatabase", "Warehouse"}:
+                        connection_name = item.get("connection_name").format(layer=layer, environment=environment)
+                        item_folder = f'{item.get("item_folder")}/' if item.get("item_folder") else ""
+                        item["item_metadata"] = fabcli.get_item(f"/{workspace_name_escaped}.Workspace/{item_folder}{item.get('item_name')}.{item_type}")
+                        if item_type == "Lakehouse" and item.get("sql_endpoint") and not fabcli.is_sql_endpoint_ready(item["item_metadata"]):
+                            item["item_metadata"] = item["sql_endpoint"].result() or item["item_metadata"]
+                            if not fabcli.is_sql_endpoint_ready(item["item_metadata"]):
+                                misc.print_warning(f"Timed out waiting for SQL endpoint provisioning of Lakehouse '{item.get('item_name')}'")
+
+                        misc.print_info(f"Creating item connection for {connection_name}...", bold=True, end="")
+
+                        if item["item_metadata"]:
+                            server, database = get_sql_connection_target(item_type, item.get("item_name"), item["item_metadata"])
+
+                            if not fabcli.connection_exists(connection_name):
+                                fabcli.create_sql_connection(connection_name, server, database, tenant_id, client_id, client_secret)
+                                misc.print_success(" ✔")
+                            else:
+                                misc.print_warning(" ⚠ Already exists")
+
+
+                            item["connection_metadata"] = fabcli.get_connection(connection_name)
+
+                            if permissions and item.get("connection_metadata"):
+                                assign_connection_permissions(item.get("connection_metadata").get("id"), permissions, layer, prune=get_prune_permissions(layer_definition))
                         else:
-                            misc.print_error(f" ✖ Failed! Please verify connection and tenant settings.")
-        
-        ### Assign workspace identities to workspaces
-        if workspace_identity_acl:
-            misc.print_header(f"Assigning workspace identities as members on workspaces")
-            for workspace_name, workspace_identity in workspace_identity_acl.items():
-                misc.print_info(f"  • Assigning workspace identity {workspace_identity} to {workspace_name}...", end="")   
-                try:             
-                    identity_id = fabcli.run_command(f"get {workspace_identity}.Workspace -q workspaceIdentity.servicePrincipalId -f").strip()
-                    fabcli.run_command(f"acl set {workspace_name}.Workspace -I {identity_id} -R admin -f") 
-                    misc.print_success(" ✔")
-                except Exception as e:
-                    misc.print_error(f" ✖ Failed! {str(e)}")
+                            misc.print_error(" ✖ Failed to retrieve item!")
 
-        if has_item_connections:
-            misc.print_header(f"Configuring item connections")
-            
+        # Layers are provisioned concurrently. Within a layer, items follow the workspace and Git and item
+        # connections follow the items. Workspace identity assignments wait for both workspaces involved.
+        tasks = {}
+        for layer, layer_definition in layers.items():
+            layer_definition["workspace_name"] = solution_name.format(layer=layer, environment=environment)
 
-            for layer, layer_definition in layers.items():
-                workspace_name = solution_name.format(layer=layer, environment=environment)
-                workspace_name_escaped = workspace_name.replace("/", "\\/")
-                
-                # Update layer_definition
-                layer_definition["workspace_name"] = workspace_name
-
-                if layer_definition.get("items"):
-                    for item_type, items in layer_definition.get("items").items():
-                        for item in items:
-
-                            if item.get("connection_name") and item_type in {"Lakehouse", "SQLDatabase", "Warehouse"}:
-                                connection_name = item.get("connection_name").format(layer=layer, environment=environment)
-                                item["item_metadata"] = fabcli.get_item(f"/{workspace_name_escaped}.Workspace/{item.get('item_name')}.{item_type}")
-                                #print(f"/{workspace_name_escaped}.Workspace/{item.get('item_name')}.{item_type}")
-                                misc.print_info(f"\nCreating item connection for {connection_name}...", bold=True, end="")
-
-                                if item["item_metadata"]:
-                                    server = (
-                                        item.get("item_metadata").get("properties").get("serverFqdn") if item_type == "SQLDatabase" else 
-                                        item.get("item_metadata").get("properties").get("connectionString")      
-                                    )
-
-                                    database = (
-                                        item.get("item_name") if item_type in ("Lakehouse","Warehouse") else
-                                        item.get("item_metadata").get("properties").get("databaseName") 
-                                    )
-
-                                    if not fabcli.connection_exists(connection_name):
-                                        fabcli.create_sql_connection(connection_name, server, database, tenant_id, client_id, client_secret)
-                                        misc.print_success(" ✔")
-                                    else:
-                                        misc.print_warning(" ⚠ Already exists")
-
-
-                                    item["connection_metadata"] = fabcli.get_item(f".connections/{connection_name}.Connection")
-
-                                    if permissions and fabcli.connection_exists(connection_name):
-                                        print(f"  • Assigning connection permissions...", end="")
-                                        for permission, definitions in permissions.items():
-                                            for definition in definitions:
-                                                role = "Owner" if permission == "Admin" else "User"
-                                                fabcli.add_connection_roleassignment(
-                                                    item.get("connection_metadata").get("id"), 
-                                                    definition.get("id"),
-                                                    definition.get("type"),
-                                                    role
-                                                    )
-                                        misc.print_success(" ✔")
-                                else:
-                                    misc.print_error(" ✖ Failed to retrieve item!")
+            tasks[f"{layer}:workspace"] = (functools.partial(create_workspace, layer, layer_definition), [])
+            tasks[f"{layer}:items"] = (functools.partial(create_items, layer, layer_definition), [f"{layer}:workspace"])
+
+            if git_settings and git_connection and git_connection.get("id") and layer_definition.get("git_directoryName"):
+                tasks[f"{layer}:git"] = (functools.partial(setup_git_integration, layer, layer_definition), [f"{layer}:items"])
+
+            for workspace_identity in get_workspace_identities(layer, layer_definition):
+                identity_layer = workspace_layers.get(workspace_identity)
+                dependencies = [f"{layer}:workspace"] + ([f"{identity_layer}:workspace"] if identity_layer else [])
+                tasks[f"{layer}:identity:{workspace_identity}"] = (functools.partial(assign_workspace_identity, layer, layer_definition, workspace_identity), dependencies)
+
+            if has_item_connections(layer_definition):
+                tasks[f"{layer}:connections"] = (functools.partial(create_item_connections, layer, layer_definition), [f"{layer}:items"])
+
+        results = misc.run_task_graph(tasks, max_workers)
+
+        skipped_tasks = [name for name, result in results.items() if result.get("status") == "skipped"]
+        failed_tasks = [name for name, result in results.items() if result.get("status") == "failed"]
+        if failed_tasks:
+            misc.print_error(f"\nFailed: {', '.join(failed_tasks)}" + (f". Skipped: {', '.join(skipped_tasks)}" if skipped_tasks else ""))
     else:
         misc.print_warning(f"No environment definition found for {environment}... Skipping setup!")
 
@@ -339,59 +520,80 @@ if action == "create":
 
 elif action == "delete": 
 
-    misc.print_header(f"Deleting generic solution connections")
+    misc.print_header(f"Deleting {environment} environment")
+    
+    solution_name = env_definition.get("name")
+    layers = env_definition.get("layers")
+    connection_catalog = fabcli.get_connection_catalog()
 
+    # Everything to delete is enumerated from one snapshot: the workspace and connection listings,
+    # plus the managed private endpoints of workspaces defining any
+    connection_names = []
     if (env_definition.get("generic").get("fabric_connections") and env_definition.get("generic").get("is_primary")):
-        for connection in env_definition.get("generic").get("fabric_connections"):
-            
-            if fabcli.connection_exists(connection.get("name")):
-                misc.print_info(f"Deleting connection '{connection.get('name')}'...", bold=True, end="")
-                fabcli.run_command(f"rm .connections/{connection.get('name')}.Connection -f")
-                misc.print_success(f" ✔")
+        connection_names += [connection.get("name") for connection in env_definition.get("generic").get("fabric_connections")]
 
     git_settings = env_definition.get("generic").get("git_settings")
-    git_connection = None
-        
     if git_settings:
         connection_identifier = git_settings.get("myGitCredentials").get("connection_name") if git_settings.get("myGitCredentials").get("connection_name") else git_settings.get("myGitCredentials").get("connectionId")
-        if fabcli.connection_exists(connection_identifier):
-            git_connection = fabcli.get_connection(connection_identifier)
-            misc.print_info(f"Deleting connection '{git_connection.get("displayName")}'...", bold=True, end="")
-            fabcli.run_command(f"rm .connections/{git_connection.get("displayName")}.Connection -f")
-            misc.print_success(f" ✔")
-
-    misc.print_header(f"Deleting {environment} environment")
-    
-    solution_name = env_definition.get("name")
-    layers = env_definition.get("layers")
-    default_capacityid = env_definition.get("generic").get("capacity_id")
+        git_connection = connection_catalog.get(connection_identifier)
+        if git_connection:
+            connection_names.append(git_connection.get("displayName"))
 
     for layer, layer_definition in layers.items():
-        workspace_name = solution_name.format(layer=layer, environment=environment)
-        workspace_name_escaped = workspace_name.replace("/", "\\/")
-        misc.print_info(f"Deleting workspace '{workspace_name}'...", bold=True, end="")
-        if fabcli.run_command(f"exists {workspace_name_escaped}.Workspace").replace("*", "").strip().lower() == "true":
+        for item_type, items in (layer_definition.get("items") or {}).items():
+            for item in items:
+                if item.get("connection_name") and item_type in {"Lakehouse", "SQLDatabase", "Warehouse"}:
+                    connection_names.append(item.get("connection_name").format(layer=layer, environment=environment))
 
-            if layer_definition.get("private_endpoints"):
-                for private_endpoint in layer_definition.get("private_endpoints"):
-                    if (fabcli.item_exists(f"{workspace_name_escaped}.Workspace/.managedprivateendpoints/{private_endpoint.get('name')}.ManagedPrivateEndpoint")):
-                        fabcli.run_command(f"rm {workspace_name_escaped}.Workspace/.managedprivateendpoints/{private_endpoint.get('name')}.ManagedPrivateEndpoint -f")
+    def delete_connection(connection_name):
+        misc.print_info(f"Deleting connection '{connection_name}'...", bold=True, end="")
+        fabcli.run_command(f"rm '.connections/{connection_name}.Connection' -f")
+        misc.print_success(" ✔")
 
-            fabcli.run_command(f"rm '{workspace_name_escaped}.Workspace' -f")
-            misc.print_success(" ✔")
+    def delete_private_endpoint(workspace_name, private_endpoint_name):
+        workspace_name_escaped = workspace_name.replace("/", "\\/")
+        misc.print_info(f"Deleting private endpoint '{private_endpoint_name}' in '{workspace_name}'...", bold=True, end="")
+        fabcli.run_command(f"rm '{workspace_name_escaped}.Workspace/.managedprivateendpoints/{private_endpoint_name}.ManagedPrivateEndpoint' -f")
+        misc.print_success(" ✔")
+
+    def delete_workspace(workspace_name):
+        workspace_name_escaped = workspace_name.replace("/", "\\/")
+        misc.print_info(f"Deleting workspace '{workspace_name}'...", bold=True, end="")
+        fabcli.run_command(f"rm '{workspace_name_escaped}.Workspace' -f")
+        misc.print_success(" ✔")
+
+    # Workspaces and connections are independent and deleted in parallel. Only managed private
+    # endpoints are ordered, as they have to be removed before their workspace
+    tasks = {}
+    for connection_name in dict.fromkeys(connection_names):
+        if connection_catalog.get(connection_name):
+            tasks[f"connection:{connection_name}"] = (functools.partial(delete_connection, connection_name), [])
         else:
-            misc.print_warning(f" ⚠ Does not exist. Skipping deletion!")
+            misc.print_warning(f"Connection '{connection_name}' does not exist. Skipping deletion!")
 
-        if layer_definition.get("items"):
-            for item_type, items in layer_definition.get("items").items():
-                for item in items:    
-                    if item.get("connection_name") and item_type in {"Lakehouse", "SQLDatabase", "Warehouse"}:
-                        connection_name = item.get("connection_name").format(layer=layer, environment=environment)
-                        misc.print_info(f"  • Deleting connection '{connection_name}'... ", bold=False, end="")
-                        if fabcli.run_command(f"exists .connections/{connection_name}.Connection").replace("*", "").strip().lower() == "true":
-                            fabcli.run_command(f"rm .connections/{connection_name}.Connection -f")
-                            misc.print_success(" ✔")
-                        else:
-                            misc.print_warning(f" ⚠ Does not exist. Skipping deletion!")
+    for layer, layer_definition in layers.items():
+        workspace_name = solution_name.format(layer=layer, environment=environment)
+        workspace_id = fabcli.get_workspace_index().get(workspace_name.lower())
+        if not workspace_id:
+            misc.print_warning(f"Workspace '{workspace_name}' does not exist. Skipping deletion!")
+            continue
+
+        private_endpoint_tasks = []
+        if layer_definition.get("private_endpoints"):
+            workspace_inventory = fabcli.get_workspace_inventory(workspace_id)
+            for private_endpoint in layer_definition.get("private_endpoints"):
+                if workspace_inventory.exists("ManagedPrivateEndpoint", private_endpoint.get("name")):
+                    task_name = f"{layer}:private_endpoint:{private_endpoint.get('name')}"
+                    tasks[task_name] = (functools.partial(delete_private_endpoint, workspace_name, private_endpoint.get("name")), [])
+                    private_endpoint_tasks.append(task_name)
+
+        tasks[f"{layer}:workspace"] = (functools.partial(delete_workspace, workspace_name), private_endpoint_tasks)
+
+    results = misc.run_task_graph(tasks, max_workers)
+
+    skipped_tasks = [name for name, result in results.items() if result.get("status") == "skipped"]
+    failed_tasks = [name for name, result in results.items() if result.get("status") == "failed"]
+    if failed_tasks:
+        misc.print_error(f"\nFailed: {', '.join(failed_tasks)}" + (f". Skipped: {', '.join(skipped_tasks)}" if skipped_tasks else ""))
 else:
     misc.print_error(f"Invalid action specified: {action}. Supported values are Create/Delete.")
\ No newline at end of file
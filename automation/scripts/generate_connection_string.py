@@ -26,7 +26,7 @@ output_file = args.output_file
 
 # Authenticate
 fabcli.run_command("config set encryption_fallback_enabled true")
-fabcli.run_command(f"auth login -u {client_id} -p {client_secret} --tenant {tenant_id}")
+fabcli.login(tenant_id, client_id, client_secret)
 
 # Load JSON environment files (main and environment specific) and merge
 main_json = misc.load_json(os.path.join(os.path.dirname(__file__), f'../resources/environments/infrastructure.json'))
@@ -1,13 +1,13 @@
 #---------------------------------------------------------
-# This script binds the SpaceParts semantic model to 
-# the appropriate Lakehouse connection in development
+# This script binds the semantic models of the model layer
+# to the appropriate Lakehouse connection in development
 # 
 #---------------------------------------------------------
 # Advanced settings
 # Only change if you know what you are doing
 #---------------------------------------------------------
 lakehouse_name          = "Curated"
-semantic_model_name     = "YOUR_MODEL_NAME_HERE"
+semantic_model_names    = []  # Semantic models to bind. Leave empty to bind all semantic models in the model layer workspace
 store_layer             = "Store"
 model_layer             = "Model"
 dev_environment         = "dev"  # Environment to use for credentials
@@ -27,7 +27,7 @@ credentials = authfunc.get_environment_credentials(None, os.path.join(os.path.di
 
 # Authenticate
 fabcli.run_command("config set encryption_fallback_enabled true")
-fabcli.run_command(f"auth login -u {credentials.get('client_id')} -p {credentials.get('client_secret')} --tenant {credentials.get('tenant_id')}")
+fabcli.login(credentials.get('tenant_id'), credentials.get('client_id'), credentials.get('client_secret'))
 
 # Load JSON environment files (main and development environment) and merge
 main_json = misc.load_json(os.path.join(os.path.dirname(__file__), f'../../resources/environments/infrastructure.json'))
@@ -35,14 +35,21 @@ env_json = misc.load_json(os.path.join(os.path.dirname(__file__), f'../../resour
 env_definition = misc.merge_json(main_json, env_json)
 
 if env_definition:    
-    misc.print_header(f"Bind Semantic model connection for xSpaceParts Semantic Model in {dev_environment} environment")
+    misc.print_header(f"Bind Semantic model connections in {dev_environment} environment")
     solution_name = env_definition.get("name")
     
     # Resolve lakehouse connection and SQL endpoint information
     workspace_name = solution_name.format(layer=model_layer, environment=dev_environment).replace("/", "\\/")
-    workspace_id = fabcli.run_command(f"get '{workspace_name}.Workspace' -q id -f").strip()
+    workspace_id = fabcli.get_workspace_id(workspace_name)
 
-    semantic_model_id = fabcli.get_item_id(f"/{workspace_name}.Workspace/{semantic_model_name}.SemanticModel", retry_count=2)
+    workspace_inventory = fabcli.get_workspace_inventory(workspace_id)
+    semantic_models = {
+        item.get("displayName"): item.get("id")
+        for item in workspace_inventory.items("SemanticModel")
+        if not semantic_model_names or item.get("displayName") in semantic_model_names
+    }
+    for semantic_model_name in set(semantic_model_names) - set(semantic_models):
+        misc.print_warning(f"Semantic model '{semantic_model_name}' not found in workspace {workspace_name}. Skip binding.")
 
     connection_name_template = misc.get_lakehouse_connection_template(env_definition, store_layer, lakehouse_name)
     connection_identifier = connection_name_template.format(environment=dev_environment) if connection_name_template else None
@@ -61,26 +68,23 @@ if env_definition:
     # Check if connection information was resolved successfully
     if not (connection_id and sqlendpoint and database_name):
         misc.print_warning(f"Connection information for {lakehouse_name} is incomplete. Skipping all models for this lakehouse.")
+        sys.exit(1)
 
-    # Takeover semantic model if needed
-    misc.print_info(f"Service Principal taking over semantic model '{semantic_model_name}' in workspace '{workspace_name}...", end="")
-    takeover_response = fabcli.takeover_semantic_model(workspace_id, semantic_model_id)
-    if (takeover_response or {}).get("status_code") == 200:
-        misc.print_success(" ✔ Done")
-    else:
-        misc.print_error(f" ✖ Failed!")
-
-    misc.print_info(f"Binding semantic model '{semantic_model_name}' in workspace '{workspace_name}' to connection {connection_identifier}...", end="")
-    
-    resp = fabcli.bind_semanticmodel_sqlendpoint(
+    # Take over and bind the semantic models not yet bound to the connection
+    misc.print_info(f"Binding {len(semantic_models)} semantic model(s) in workspace '{workspace_name}' to connection {connection_identifier}...", bold=True)
+    results = fabcli.bind_semanticmodels_sqlendpoint(
         workspace_id=workspace_id,
-        item_id=semantic_model_id,
+        semantic_models=semantic_models,
         connection_id=connection_id,
         sqlendpoint=sqlendpoint,
-        database_name=database_name
+        database_name=database_name,
+        takeover=True
     )
 
-    if (takeover_response or {}).get("status_code") == 200:
-        misc.print_success(" ✔ Done")
-    else:
-        misc.print_error(f" ✖ Failed!")
\ No newline at end of file
+    for semantic_model_name, result in sorted(results.items()):
+        if result.get("status") == "bound":
+            misc.print_success(f"  • {semantic_model_name} ✔ Done")
+        elif result.get("status") == "unchanged":
+            misc.print_warning(f"  • {semantic_model_name} ⚠ Already bound")
+        else:
+            misc.print_error(f"  • {semantic_model_name} ✖ Failed!")
\ No newline at end of file
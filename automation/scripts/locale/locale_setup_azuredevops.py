@@ -81,12 +81,15 @@ organization = git_settings.get("organizationName") # Name of Azure DevOps organ
 project = git_settings.get("projectName") # Name of Azure DevOps project
 repository = git_settings.get("repositoryName") # Name of Azure DevOps repository
 
+# One client for all requests, reusing its connection, token and lookups
+ado = adofunc.AdoClient(organization, pat, tenant_id, client_id, client_secret)
+
 if action.lower() == "cleanup":
     misc.print_header(f"Deleting Azure DevOps Variable Groups and Pipelines")
 
     misc.print_info(f"Deleting Variable Group '{variable_group_name}'...", bold=True, end="")
     try:
-        adofunc.delete_variable_group(variable_group_name, organization, project, pat, tenant_id, client_id, client_secret)
+        ado.delete_variable_group(variable_group_name, project)
         misc.print_success(" ✔ Done")
     except Exception as e:
         error_msg = str(e)
@@ -95,19 +98,11 @@ if action.lower() == "cleanup":
         else:
             misc.print_error(f" ✖ Failed!")
 
-    # Delete all pipelines by distinct folders using adofunc.delete_definition_folder
+    # Delete all pipelines by distinct folders using ado.delete_definition_folder
     folders = sorted({p.get('folder') for p in pipelines if p.get('folder')})
     for folder in folders:
         misc.print_info(f"Deleting pipeline folder '{folder}'...", bold=True, end="")
-        response = adofunc.delete_definition_folder(
-                folder_path=folder,
-                organization=organization,
-                project=project,
-                pat=pat,
-                tenant_id=tenant_id,
-                client_id=client_id,
-                client_secret=client_secret
-            )
+        response = ado.delete_definition_folder(folder_path=folder, project=project)
         misc.print_success(" ✔ Done")
 
 elif action.lower() == "setup":
@@ -131,13 +126,13 @@ elif action.lower() == "setup":
     misc.print_info(f"Creating variable group '{variable_group_name}' and setting variables...", bold=True, end="")
     variable_group = None
     try:
-        variable_group = adofunc.create_variable_group(variable_group_name, variables, organization, project, pat, tenant_id, client_id, client_secret)
+        variable_group = ado.create_variable_group(variable_group_name, variables, project)
         misc.print_success(" ✔ Done")
     except Exception as e:
         error_msg = str(e)
         if "409" in error_msg or "already exists" in error_msg.lower():
             misc.print_warning(" ⚠ Already exists")
-            variable_group = adofunc.get_variable_group(variable_group_name, organization, project, pat, tenant_id, client_id, client_secret)
+            variable_group = ado.get_variable_group(variable_group_name, project)
         else:
             misc.print_error(f" ✖ Failed!")
 
@@ -148,17 +143,12 @@ elif action.lower() == "setup":
         misc.print_info(f"Creating pipeline '{pipeline.get('name')}'...", bold=True, end="")
         pipeline_def = None
         try:
-            pipeline_response = adofunc.create_azure_pipeline(
+            pipeline_response = ado.create_azure_pipeline(
                 name=pipeline.get('name'),
                 folder=pipeline.get('folder'),
                 pipeline_path=pipeline.get('pipeline_path'),
-                organization=organization,
                 project=project,
-                repository=repository,
-                pat=pat,
-                tenant_id=tenant_id,
-                client_id=client_id,    
-                client_secret=client_secret
+                repository=repository
             )
             
             status_code = pipeline_response.get("status_code") if isinstance(pipeline_response, dict) else getattr(pipeline_response, 'status_code', None)
@@ -168,7 +158,7 @@ elif action.lower() == "setup":
         except Exception as e:
             error_msg = str(e)
             if "409" in error_msg or "already exists" in error_msg.lower():
-                pipeline_response = adofunc.get_definition(pipeline.get('name'), organization, project, pat, tenant_id, client_id, client_secret)
+                pipeline_response = ado.get_definition(pipeline.get('name'), project)
                 misc.print_warning(" ⚠ Already exists")
             else:
                 misc.print_error(f" ✖ Failed!")
@@ -178,15 +168,10 @@ elif action.lower() == "setup":
         if variable_group and pipeline_response:
             try:
                 misc.print_info(f" - Setting variable group permissions for pipeline '{pipeline.get('name')}'...", bold=False, end="")
-                permission_repsonse = adofunc.set_variable_group_permissions(
-                    organization=organization, 
+                permission_repsonse = ado.set_variable_group_permissions(
                     project=project,
                     variable_group_id=variable_group.get("id"),
-                    pipeline_id=pipeline_response.get("id"),
-                    pat=pat,
-                    tenant_id=tenant_id,
-                    client_id=client_id,
-                    client_secret=client_secret
+                    pipeline_id=pipeline_response.get("id")
                 )
                 misc.print_success(" ✔ Done")
             except Exception as e:
@@ -195,16 +180,7 @@ elif action.lower() == "setup":
             if pipeline.get("set_queue_permission", False):
                 misc.print_info(f" - Setting queue permission for pipeline '{pipeline.get('name')}'...", bold=False, end="")
                 try:
-                    adofunc.set_queue_build_permission(
-                        organization,
-                        project,
-                        pipeline.get('folder'),
-                        pipeline.get('name'),
-                        pat=pat,
-                        tenant_id=tenant_id,
-                        client_id=client_id,    
-                        client_secret=client_secret
-                        )
+                    ado.set_queue_build_permission(project, pipeline.get('folder'), pipeline.get('name'))
                     misc.print_success(" ✔ Done")
                 except Exception as e:
                     misc.print_error(f" ✖ Failed!")
\ No newline at end of file
@@ -5,6 +5,7 @@
 #---------------------------------------------------------
 action = "setup"  # Action to perform: "setup" or "cleanup"
 dev_environment = "dev"  # Environment to use for credentials
+github_environment = None  # GitHub environment to scope the secrets to. None for repository secrets
 
 #---------------------------------------------------------
 # Main script
@@ -35,17 +36,19 @@ if action.lower() == "cleanup":
 
     secrets_to_delete = ["SPN_CLIENT_ID", "SPN_CLIENT_SECRET", "SPN_TENANT_ID", "GIT_PAT"]
     
-    for secret_name in secrets_to_delete:
+    try:
+        results = ghfunc.delete_secrets(owner, repository, secrets_to_delete, github_pat, github_environment)
+    except Exception as e:
+        results = {secret_name: f"failed: {e}" for secret_name in secrets_to_delete}
+
+    for secret_name, result in results.items():
         misc.print_info(f"Deleting secret '{secret_name}'...", bold=True, end="")
-        try:
-            ghfunc.delete_secret(owner, repository, secret_name, github_pat)
+        if result == "deleted":
             misc.print_success(" ✔ Done")
-        except Exception as e:
-            error_msg = str(e)
-            if "404" in error_msg or "not found" in error_msg.lower():
-                misc.print_warning(" ⚠ Not found")
-            else:
-                misc.print_error(f" ✖ Failed!")
+        elif result == "not_found":
+            misc.print_warning(" ⚠ Not found")
+        else:
+            misc.print_error(f" ✖ Failed! Error: {result.removeprefix('failed: ')}")
 
 elif action.lower() == "setup":
     ### Setup Repository Secrets
@@ -57,13 +60,14 @@ elif action.lower() == "setup":
         "GIT_PAT": github_pat
     }
 
-    for secret_name, secret_value in secrets.items():
+    try:
+        results = ghfunc.sync_secrets(owner, repository, secrets, github_pat, github_environment)
+    except Exception as e:
+        results = {secret_name: f"failed: {e}" for secret_name in secrets}
+
+    for secret_name, result in results.items():
         misc.print_info(f"Creating or updating secret '{secret_name}'...", bold=True, end="")
-        try:
-            if ghfunc.create_or_update_secret(owner, repository, secret_name, secret_value, github_pat):
-                misc.print_success(" ✔ Done")
-            else:
-                misc.print_error(" ✖ Failed!")
-        except Exception as e:
-            error_msg = str(e)
-            misc.print_error(f" ✖ Failed! Error: {error_msg}")
\ No newline at end of file
+        if result in ["created", "updated"]:
+            misc.print_success(f" ✔ Done ({result})")
+        else:
+            misc.print_error(f" ✖ Failed! Error: {result.removeprefix('failed: ')}")
\ No newline at end of file
@@ -45,7 +45,7 @@ credentials = authfunc.get_environment_credentials(None, os.path.join(os.path.di
 
 # Authenticate
 fabcli.run_command("config set encryption_fallback_enabled true")
-fabcli.run_command(f"auth login -u {credentials.get('client_id')} -p {credentials.get('client_secret')} --tenant {credentials.get('tenant_id')}")
+fabcli.login(credentials.get('tenant_id'), credentials.get('client_id'), credentials.get('client_secret'))
 
 # Load JSON environment files (main and development environment) and merge
 main_json = misc.load_json(os.path.join(os.path.dirname(__file__), f'../../resources/environments/infrastructure.json'))
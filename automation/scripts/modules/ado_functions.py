@@ -1,21 +1,13 @@
 import requests
 import base64
 from urllib.parse import quote
+import modules.auth_functions as authfunc
 
-def get_ado_access_token(tenant_id, client_id, client_secret):
-    token_url = f"https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
-
-    payload = {
-        "client_id": client_id,
-        "client_secret": client_secret,
-        "grant_type": "client_credentials",
-        "scope": "499b84ac-1321-427f-aa17-267ca6975798/.default"
-    }
-
-    response = requests.post(token_url, data=payload)
-    response.raise_for_status()
+ADO_SCOPE = "499b84ac-1321-427f-aa17-267ca6975798/.default"
 
-    return response.json()["access_token"]
+def get_ado_access_token(tenant_id, client_id, client_secret):
+    # Served from the shared token broker, so consecutive requests reuse the same token
+    return authfunc.get_access_token(tenant_id, client_id, client_secret, ADO_SCOPE)
 
 
 def build_headers(pat=None, tenant_id=None, client_id=None, client_secret=None):
@@ -34,231 +26,339 @@ def build_headers(pat=None, tenant_id=None, client_id=None, client_secret=None):
 
     return headers
 
-def get_repository(org, project, repo_name, pat=None, tenant_id=None, client_id=None, client_secret=None):
-    headers = build_headers(pat, tenant_id, client_id, client_secret)
-    
-    url = (f"https://dev.azure.com/{org}/{project}/_apis/git/repositories?api-version=7.1")
-
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
 
-    repos = response.json()["value"]
+class AdoClient:
+    """
+    Azure DevOps REST client for one organization.
+
+    Requests share a keep-alive session, the access token is cached by the token broker and
+    project, repository, definition, variable group and service principal lookups are memoized
+    for the lifetime of the client. Changes made through the client update the memoized lookups.
+    """
+
+    def __init__(self, organization, pat=None, tenant_id=None, client_id=None, client_secret=None):
+        self.organization = organization
+        self.pat = pat
+        self.tenant_id = tenant_id
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.session = requests.Session()
+        self._cache = {}
+
+    def request(self, method, url, **kwargs):
+        headers = build_headers(self.pat, self.tenant_id, self.client_id, self.client_secret)
+        return self.session.request(method, url, headers=headers, **kwargs)
+
+    def _memoize(self, key, loader):
+        if key not in self._cache:
+            self._cache[key] = loader()
+        return self._cache[key]
+
+    def _forget(self, *key_prefix):
+        for key in [key for key in self._cache if key[:len(key_prefix)] == key_prefix]:
+            del self._cache[key]
+
+    def get_repositories(self, project):
+        def load():
+            url = f"https://dev.azure.com/{self.organization}/{project}/_apis/git/repositories?api-version=7.1"
+            response = self.request("get", url)
+            response.raise_for_status()
+            return {repo["name"].lower(): repo for repo in response.json()["value"]}
+
+        return self._memoize(("repositories", project.lower()), load)
+
+    def get_repository(self, project, repo_name):
+        repo = self.get_repositories(project).get(repo_name.lower())
+
+        if not repo:
+            raise ValueError(f"Repository '{repo_name}' not found")
+
+        return repo
+
+    def get_project(self, project_name):
+        def load():
+            url = f"https://dev.azure.com/{self.organization}/_apis/projects/{project_name}?api-version=7.1"
+            response = self.request("get", url)
+            response.raise_for_status()
+            return response.json()
+
+        return self._memoize(("project", project_name.lower()), load)
+
+    def get_definition(self, name, project):
+        def load():
+            encoded_name = quote(name, safe="")
+            url = f"https://dev.azure.com/{self.organization}/{project}/_apis/build/definitions?name={encoded_name}&api-version=7.2-preview.7"
+            response = self.request("get", url)
+            response.raise_for_status()
+            return response.json()["value"][0]
+
+        return self._memoize(("definition", project.lower(), name.lower()), load)
+
+    def get_variable_group(self, name, project):
+        key = ("variablegroup", project.lower(), name.lower())
+        if self._cache.get(key):
+            return self._cache[key]
+
+        url = f"https://dev.azure.com/{self.organization}/{project}/_apis/distributedtask/variablegroups?groupName={name}&api-version=7.2-preview.2"
+        response = self.request("get", url)
+        response.raise_for_status()
+        if not response.json().get("value"):
+            return None
+
+        self._cache[key] = response.json()["value"][0]
+        return self._cache[key]
+
+    def get_service_principals(self):
+        def load():
+            url = f"https://vssps.dev.azure.com/{self.organization}/_apis/graph/serviceprincipals?api-version=7.1-preview.1"
+            response = self.request("get", url)
+            response.raise_for_status()
+            return response.json()
+
+        return self._memoize(("serviceprincipals",), load)
+
+    def find_service_principal(self, application_id):
+        # Pages through the graph with continuation tokens and stops at the first match
+        key = ("serviceprincipal", application_id)
+        if self._cache.get(key):
+            return self._cache[key]
+
+        continuation_token = None
+        while True:
+            url = f"https://vssps.dev.azure.com/{self.organization}/_apis/graph/serviceprincipals?api-version=7.1-preview.1"
+            if continuation_token:
+                url += f"&continuationToken={quote(continuation_token, safe='')}"
+
+            response = self.request("get", url)
+            response.raise_for_status()
+
+            service_principal = next((item for item in response.json().get("value", []) if item.get("applicationId") == application_id), None)
+            if service_principal:
+                self._cache[key] = service_principal
+                return service_principal
+
+            continuation_token = response.headers.get("X-MS-ContinuationToken")
+            if not continuation_token:
+                return None
+
+    def get_acl(self, token=None, recurse=True):
+        def load():
+            url = f"https://dev.azure.com/{self.organization}/_apis/accesscontrollists/2e9eb7ed-3c0a-47d4-87c1-0ffdd275fd87?api-version=7.1"
+            if token:
+                url += f"&token={quote(token, safe='')}&recurse={str(recurse).lower()}"
+            response = self.request("get", url)
+            response.raise_for_status()
+            return response.json()
+
+        return self._memoize(("acl", token, recurse), load)
+
+    def get_build_service_descriptor(self, project_id):
+        key = ("buildservice", project_id)
+        if self._cache.get(key):
+            return self._cache[key]
+
+        # The ACL below the project's repositories normally holds the project build service,
+        # the full namespace ACL is only downloaded when it does not
+        target_suffix = f":Build:{project_id}"
+        for load_acl in (lambda: self.get_acl(f"repoV2/{project_id}"), lambda: self.get_acl()):
+            for entry in load_acl().get("value", []):
+                for ace_key, ace in entry.get("acesDictionary", {}).items():
+                    if ace_key.endswith(target_suffix):
+                        self._cache[key] = ace.get("descriptor")
+                        return self._cache[key]
 
-    repo = next(
-        (r for r in repos if r["name"].lower() == repo_name.lower()),
-        None
-    )
+        return None
 
-    if not repo:
-        raise ValueError(f"Repository '{repo_name}' not found")
+    def create_azure_pipeline(self, name, folder, pipeline_path, project, repository):
+        url = f"https://dev.azure.com/{self.organization}/{project}/_apis/pipelines?api-version=7.1"
 
-    return repo
+        repo_id = self.get_repository(project, repository).get("id")
 
-def create_azure_pipeline(name, folder, pipeline_path, organization, project, repository, pat=None, tenant_id=None, client_id=None, client_secret=None):
-    
-    headers = build_headers(pat, tenant_id, client_id, client_secret)
-
-    url = f"https://dev.azure.com/{organization}/{project}/_apis/pipelines?api-version=7.1"
-
-    repo_id = get_repository(organization, project, repository, pat, tenant_id, client_id, client_secret).get("id")
-
-    payload = {
-        "name": name,
-        "folder": folder,
-        "configuration": {
-            "type": "yaml",
-            "path": pipeline_path,
-            "repository": {
-                "id": repo_id,   
-                "type": "azureReposGit"
+        payload = {
+            "name": name,
+            "folder": folder,
+            "configuration": {
+                "type": "yaml",
+                "path": pipeline_path,
+                "repository": {
+                    "id": repo_id,   
+                    "type": "azureReposGit"
+                }
             }
         }
-    }
 
-    response = requests.post(url, headers=headers, json=payload)
-    response.raise_for_status()
-    return response.json()
+        response = self.request("post", url, json=payload)
+        response.raise_for_status()
+        return response.json()
 
+    def delete_azure_pipeline(self, name, project):
+        definition_id = self.get_definition(name, project).get("id")
 
-def create_variable_group(name, variables, organization, project, pat=None, tenant_id=None, client_id=None, client_secret=None):
-    
-    headers = build_headers(pat, tenant_id, client_id, client_secret)
+        url = f"https://dev.azure.com/{self.organization}/{project}/_apis/build/definitions/{definition_id}?api-version=7.0"
 
-    url = f"https://dev.azure.com/{organization}/_apis/distributedtask/variablegroups?api-version=7.2-preview.2"
+        response = self.request("delete", url)
+        response.raise_for_status()
+        self._forget("definition", project.lower(), name.lower())
 
-    payload = {
-            "name": name,
-            "providerData": None,
-            "type": "Vsts",
-            "variables": variables, 
-            "variableGroupProjectReferences": [{
-                "name": name,
-                "projectReference": {
-                    "name": project
-                }
-            }]
-        }
+    def delete_definition_folder(self, folder_path, project):
+        url = f"https://dev.azure.com/{self.organization}/{project}/_apis/build/folders?path={folder_path}&api-version=7.2-preview.2"
 
-    response = requests.post(url, headers=headers, json=payload)
-    response.raise_for_status()
-    return response.json()
+        response = self.request("delete", url)
+        self._forget("definition", project.lower())
+        return response
 
+    def create_variable_group(self, name, variables, project):
+        url = f"https://dev.azure.com/{self.organization}/_apis/distributedtask/variablegroups?api-version=7.2-preview.2"
 
-def get_variable_group(name, organization, project, pat=None, tenant_id=None, client_id=None, client_secret=None):
-    headers = build_headers(pat, tenant_id, client_id, client_secret)
+        payload = {
+                "name": name,
+                "providerData": None,
+                "type": "Vsts",
+                "variables": variables, 
+                "variableGroupProjectReferences": [{
+                    "name": name,
+                    "projectReference": {
+                        "name": project
+                    }
+                }]
+            }
 
-    url = f"https://dev.azure.com/{organization}/{project}/_apis/distributedtask/variablegroups?groupName={name}&api-version=7.2-preview.2"
+        response = self.request("post", url, json=payload)
+        response.raise_for_status()
+        self._cache[("variablegroup", project.lower(), name.lower())] = response.json()
+        return response.json()
+
+    def delete_variable_group(self, name, project):
+        variable_group_response = self.get_variable_group(name, project)
+
+        if not variable_group_response:
+            raise ValueError(f"Variable Group '{name}' not found")
+        
+        project_response = self.get_project(project)
+
+        url = f"https://dev.azure.com/{self.organization}/_apis/distributedtask/variablegroups/{variable_group_response.get('id')}?projectIds={project_response.get('id')}&api-version=7.2-preview.2"
+        
+        response = self.request("delete", url)
+        response.raise_for_status()
+        self._forget("variablegroup", project.lower(), name.lower())
+
+    def set_variable_group_permissions(self, project, variable_group_id, pipeline_id):
+        url = f"https://dev.azure.com/{self.organization}/{project}/_apis/pipelines/pipelinePermissions/variablegroup/{variable_group_id}?api-version=7.1-preview.1"
+
+        payload = {
+            "resource":{},
+            "pipelines": [
+                {
+                "id": pipeline_id,
+                "authorized": True,
+                "authorizedBy":None,
+                "authorizedOn":None
+                }
+            ]
+        }
 
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    if not response.json().get("value"):
-        return None
-    else:
-        return response.json()["value"][0]
+        response = self.request("patch", url, json=payload)
+        response.raise_for_status()
+
+    def set_queue_build_permission(self, project_name, folder_path, pipeline_name):
+        project = self.get_project(project_name)
+        project_id= project.get('id')
+
+        pipeline = self.get_definition(pipeline_name, project_name)
+        pipeline_id = pipeline.get('id')
+
+        url = f"https://dev.azure.com/{self.organization}/_apis/AccessControlEntries/33344d9c-fc72-4d6f-aba5-fa317101a7e9?api-version=7.1"
+       
+        origin_id = (self.find_service_principal(self.client_id) or {}).get("originId")
+
+        if not origin_id:
+            raise ValueError("Service principal originId not found")
+        
+        build_service_descriptor = self.get_build_service_descriptor(project_id)
+
+        folder_name = "/"
+
+        if folder_path:
+            path = folder_path.strip("/")
+            folder_name = f"/{path}/"
+        
+        payload = {
+            "token": f"{project_id}{folder_name}{pipeline_id}",
+            "merge": True,
+            "accessControlEntries": [
+                {
+                    "descriptor": build_service_descriptor,
+                    "allow": 128,   # Queue builds
+                    "deny": 0,
+                    "extendedInfo":{"effectiveAllow":128,"effectiveDeny":0,"inheritedAllow":128,"inheritedDeny":0}
+                }
+            ]
+        }
 
+        response = self.request("post", url, json=payload)
+        response.raise_for_status()
 
-def get_project(organization, project_name, pat=None, tenant_id=None, client_id=None, client_secret=None):
-    headers = build_headers(pat, tenant_id, client_id, client_secret)
 
-    url = f"https://dev.azure.com/{organization}/_apis/projects/{project_name}?api-version=7.1"
+_clients = {}
 
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
 
-    return response.json()
+def get_client(organization, pat=None, tenant_id=None, client_id=None, client_secret=None) -> AdoClient:
+    # Module level functions share one client per organization and identity
+    key = (organization.lower(), pat, tenant_id, client_id)
+    if key not in _clients:
+        _clients[key] = AdoClient(organization, pat, tenant_id, client_id, client_secret)
+    return _clients[key]
 
 
-def delete_variable_group(name, organization, project, pat=None, tenant_id=None, client_id=None, client_secret=None):
-    headers = build_headers(pat, tenant_id, client_id, client_secret)
+def get_repository(org, project, repo_name, pat=None, tenant_id=None, client_id=None, client_secret=None):
+    return get_client(org, pat, tenant_id, client_id, client_secret).get_repository(project, repo_name)
 
-    variable_group_response = get_variable_group(name, organization, project, pat, tenant_id, client_id, client_secret)
+def create_azure_pipeline(name, folder, pipeline_path, organization, project, repository, pat=None, tenant_id=None, client_id=None, client_secret=None):
+    return get_client(organization, pat, tenant_id, client_id, client_secret).create_azure_pipeline(name, folder, pipeline_path, project, repository)
 
-    if not variable_group_response:
-        raise ValueError(f"Variable Group '{name}' not found")
-    
-    project_response = get_project(organization, project, pat, tenant_id, client_id, client_secret)
 
-    url = f"https://dev.azure.com/{organization}/_apis/distributedtask/variablegroups/{variable_group_response.get('id')}?projectIds={project_response.get('id')}&api-version=7.2-preview.2"
-    
-    response = requests.delete(url, headers=headers)
-    response.raise_for_status()
+def create_variable_group(name, variables, organization, project, pat=None, tenant_id=None, client_id=None, client_secret=None):
+    return get_client(organization, pat, tenant_id, client_id, client_secret).create_variable_group(name, variables, project)
 
-def get_definition(name, organization, project, pat=None, tenant_id=None, client_id=None, client_secret=None):
-    headers = build_headers(pat, tenant_id, client_id, client_secret)
 
-    encoded_name = quote(name, safe="")
-    url = f"https://dev.azure.com/{organization}/{project}/_apis/build/definitions?name={encoded_name}&api-version=7.2-preview.7"
+def get_variable_group(name, organization, project, pat=None, tenant_id=None, client_id=None, client_secret=None):
+    return get_client(organization, pat, tenant_id, client_id, client_secret).get_variable_group(name, project)
 
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
 
-    return response.json()["value"][0]
+def get_project(organization, project_name, pat=None, tenant_id=None, client_id=None, client_secret=None):
+    return get_client(organization, pat, tenant_id, client_id, client_secret).get_project(project_name)
 
 
-def delete_azure_pipeline(name, organization, project, pat=None, tenant_id=None, client_id=None, client_secret=None):
-    headers = build_headers(pat, tenant_id, client_id, client_secret)
+def delete_variable_group(name, organization, project, pat=None, tenant_id=None, client_id=None, client_secret=None):
+    get_client(organization, pat, tenant_id, client_id, client_secret).delete_variable_group(name, project)
 
-    definition_id = get_definition(name, organization, project, pat, tenant_id, client_id, client_secret).get("id")
+def get_definition(name, organization, project, pat=None, tenant_id=None, client_id=None, client_secret=None):
+    return get_client(organization, pat, tenant_id, client_id, client_secret).get_definition(name, project)
 
-    url = f"https://dev.azure.com/{organization}/{project}/_apis/build/definitions/{definition_id}?api-version=7.0"
 
-    response = requests.delete(url, headers=headers)
-    response.raise_for_status()
+def delete_azure_pipeline(name, organization, project, pat=None, tenant_id=None, client_id=None, client_secret=None):
+    get_client(organization, pat, tenant_id, client_id, client_secret).delete_azure_pipeline(name, project)
 
 
 def delete_definition_folder(folder_path, organization, project, pat=None, tenant_id=None, client_id=None, client_secret=None):
-    headers = build_headers(pat, tenant_id, client_id, client_secret)
-
-    url = f"https://dev.azure.com/{organization}/{project}/_apis/build/folders?path={folder_path}&api-version=7.2-preview.2"
-
-    return requests.delete(url, headers=headers)
+    return get_client(organization, pat, tenant_id, client_id, client_secret).delete_definition_folder(folder_path, project)
 
 
 def set_variable_group_permissions(organization, project, variable_group_id, pipeline_id, pat=None, tenant_id=None, client_id=None, client_secret=None):
-    headers = build_headers(pat, tenant_id, client_id, client_secret)
-
-    url = f"https://dev.azure.com/{organization}/{project}/_apis/pipelines/pipelinePermissions/variablegroup/{variable_group_id}?api-version=7.1-preview.1"
-
-    payload = {
-        "resource":{},
-        "pipelines": [
-            {
-            "id": pipeline_id,
-            "authorized": True,
-            "authorizedBy":None,
-            "authorizedOn":None
-            }
-        ]
-    }
-
-    response = requests.patch(url, headers=headers, json=payload)
-    response.raise_for_status()
+    get_client(organization, pat, tenant_id, client_id, client_secret).set_variable_group_permissions(project, variable_group_id, pipeline_id)
 
 
 def set_queue_build_permission(organization, project_name, folder_path, pipeline_name, pat=None, tenant_id=None, client_id=None, client_secret=None):
-    headers = build_headers(pat, tenant_id, client_id, client_secret)
-
-    project = get_project(organization, project_name, pat, tenant_id, client_id, client_secret)
-    project_id= project.get('id')
-
-    pipeline = get_definition(pipeline_name, organization, project_name, pat, tenant_id, client_id, client_secret)
-    pipeline_id = pipeline.get('id')
-
-    url = f"https://dev.azure.com/{organization}/_apis/AccessControlEntries/33344d9c-fc72-4d6f-aba5-fa317101a7e9?api-version=7.1"
-   
-    sp_list = get_service_principals(organization, pat, tenant_id, client_id, client_secret)
-    origin_id = next(( item.get("originId") for item in sp_list.get("value", []) if item.get("applicationId") == client_id), None)
-
-    if not origin_id:
-        raise ValueError("Service principal originId not found")
-    
-    acl = get_acl(organization, pat, tenant_id, client_id, client_secret)
-    target_suffix = f":Build:{project_id}"
-    build_service_descriptor = None
-    for entry in acl.get("value", []):
-        aces = entry.get("acesDictionary", {})
-        for key, ace in aces.items():
-            if key.endswith(target_suffix):
-                build_service_descriptor = ace.get("descriptor")
-
-    folder_name = "/"
-
-    if folder_path:
-        path = folder_path.strip("/")
-        folder_name = f"/{path}/"
-    
-    payload = {
-        "token": f"{project_id}{folder_name}{pipeline_id}",
-        "merge": True,
-        "accessControlEntries": [
-            {
-                "descriptor": build_service_descriptor,
-                "allow": 128,   # Queue builds
-                "deny": 0,
-                "extendedInfo":{"effectiveAllow":128,"effectiveDeny":0,"inheritedAllow":128,"inheritedDeny":0}
-            }
-        ]
-    }
-
-    response = requests.post(url, headers=headers, json=payload)
-    response.raise_for_status()
+    get_client(organization, pat, tenant_id, client_id, client_secret).set_queue_build_permission(project_name, folder_path, pipeline_name)
 
 
 def get_service_principals(organization, pat=None, tenant_id=None, client_id=None, client_secret=None):
-    headers = build_headers(pat, tenant_id, client_id, client_secret)
-
-    url= f"https://vssps.dev.azure.com/{organization}/_apis/graph/serviceprincipals?api-version=7.1-preview.1"
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
+    return get_client(organization, pat, tenant_id, client_id, client_secret).get_service_principals()
 
-    return response.json()
 
+def find_service_principal(organization, application_id, pat=None, tenant_id=None, client_id=None, client_secret=None):
+    return get_client(organization, pat, tenant_id, client_id, client_secret).find_service_principal(application_id)
 
-def get_acl(organization, pat=None, tenant_id=None, client_id=None, client_secret=None):
-    headers = build_headers(pat, tenant_id, client_id, client_secret)
 
-    url= f"https://dev.azure.com/{organization}/_apis/accesscontrollists/2e9eb7ed-3c0a-47d4-87c1-0ffdd275fd87?api-version=7.1"
-   
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()
\ No newline at end of file
+def get_acl(organization, pat=None, tenant_id=None, client_id=None, client_secret=None, token=None):
+    return get_client(organization, pat, tenant_id, client_id, client_secret).get_acl(token)
@@ -1,6 +1,9 @@
 from azure.identity import InteractiveBrowserCredential
 from azure.core.credentials import AccessToken, TokenCredential
-import requests, time, json, os, jwt
+import requests, time, json, os, jwt, threading
+import modules.misc_functions as misc
+
+TOKEN_REFRESH_MARGIN = 300 # Seconds before expiry a cached token is renewed
 
 def get_credentials_from_file(file_name):
     """
@@ -62,9 +65,9 @@ def get_access_token_from_credentials(credential : InteractiveBrowserCredential,
     return credential.get_token(resource).token
 
 
-def get_access_token(tenant_id, client_id, client_secret, resource):
+def request_access_token(tenant_id, client_id, client_secret, resource):
     """
-    Obtains an OAuth 2.0 access token for authenticating with Azure, Power BI, or Fabric services.
+    Requests a new OAuth 2.0 access token using the client credentials flow, bypassing the token broker.
 
     Args:
         tenant_id (str): The Azure AD tenant ID where the application is registered.
@@ -89,6 +92,23 @@ def get_access_token(tenant_id, client_id, client_secret, resource):
     return response.json().get('access_token')
 
 
+def get_access_token(tenant_id, client_id, client_secret, resource):
+    """
+    Obtains an OAuth 2.0 access token for authenticating with Azure, Power BI, or Fabric services.
+    Tokens are served from the shared token broker and only requested again shortly before they expire.
+
+    Args:
+        tenant_id (str): The Azure AD tenant ID where the application is registered.
+        client_id (str): The client (application) ID of the registered Azure AD application.
+        client_secret (str): The client secret of the registered Azure AD application.
+        resource (str): The URI of the resource, or a scope ending with "/.default", for which the access token is requested.
+
+    Returns:
+        str: The access token string used to authenticate requests to the specified resource.
+    """
+    return get_token_broker().get_token(tenant_id, client_id, client_secret, resource).token
+
+
 def is_service_principal(token):
     """
     Determines whether the given token belongs to a service principal.
@@ -114,7 +134,97 @@ def is_service_principal(token):
 class StaticTokenCredential(TokenCredential):
     def __init__(self, access_token: str, expires_on: int = None):
         self.aad_token = access_token
-        self.aad_token_expiration = expires_on or int(time.time()) + 3600
+        if expires_on is None:
+            try:
+                expires_on = get_token_expiration(access_token)
+            except jwt.PyJWTError:
+                expires_on = int(time.time()) + 3600
+        self.aad_token_expiration = expires_on
 
     def get_token(self, *scopes) -> AccessToken:
-        return AccessToken(self.aad_token, self.aad_token_expiration)
\ No newline at end of file
+        return AccessToken(self.aad_token, self.aad_token_expiration)
+
+def get_token_object_id(token):
+    """
+    Object id of the principal (user or service principal) a token was issued to, read from its "oid" claim without verifying the signature.
+    """
+    return jwt.decode(token, options={"verify_signature": False}).get("oid")
+
+def get_token_expiration(token):
+    """
+    Returns the expiration time of a JWT access token.
+
+    Args:
+        token (str): The JWT token to inspect.
+
+    Returns:
+        int: The "exp" claim as a unix timestamp, or one hour from now if the claim is missing.
+    """
+    decoded = jwt.decode(token, options={"verify_signature": False})
+    return int(decoded.get("exp", time.time() + 3600))
+
+
+class TokenBroker:
+    """
+    Thread-safe cache of client credential tokens per (tenant, client, resource).
+
+    Tokens are renewed TOKEN_REFRESH_MARGIN seconds before the expiry in their "exp" claim.
+    Concurrent requests for the same token wait for a single token request.
+    """
+    def __init__(self, refresh_margin: int = TOKEN_REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self.stats = {"requests": 0, "hits": 0}
+        self._tokens = {}
+        self._token_locks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def to_resource(resource_or_scope: str) -> str:
+        # The v1 token endpoint takes the resource a "<resource>/.default" scope refers to
+        return resource_or_scope[:-len("/.default")] if resource_or_scope.endswith("/.default") else resource_or_scope
+
+    def get_token(self, tenant_id, client_id, client_secret, resource) -> AccessToken:
+        key = (tenant_id, client_id, self.to_resource(resource))
+        with self._lock:
+            token_lock = self._token_locks.setdefault(key, threading.Lock())
+
+        with token_lock:
+            with self._lock:
+                token = self._tokens.get(key)
+                if token and token.expires_on - self.refresh_margin > time.time():
+                    self.stats["hits"] += 1
+                    return token
+
+            with misc.trace_span("token", "auth", resource=key[2]):
+                access_token = request_access_token(tenant_id, client_id, client_secret, key[2])
+            token = AccessToken(access_token, get_token_expiration(access_token))
+            with self._lock:
+                self._tokens[key] = token
+                self.stats["requests"] += 1
+            return token
+
+    def invalidate(self, tenant_id=None, client_id=None):
+        with self._lock:
+            for key in [key for key in self._tokens if tenant_id in (None, key[0]) and client_id in (None, key[1])]:
+                del self._tokens[key]
+
+
+_token_broker = TokenBroker()
+
+
+def get_token_broker() -> TokenBroker:
+    return _token_broker
+
+
+class BrokerTokenCredential(TokenCredential):
+    """
+    TokenCredential serving client credential tokens from the token broker, e.g. for fabric_cicd or Azure SDK clients.
+    """
+    def __init__(self, tenant_id: str, client_id: str, client_secret: str, broker: TokenBroker = None):
+        self.tenant_id = tenant_id
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.broker = broker or get_token_broker()
+
+    def get_token(self, *scopes, **kwargs) -> AccessToken:
+        return self.broker.get_token(self.tenant_id, self.client_id, self.client_secret, scopes[0])
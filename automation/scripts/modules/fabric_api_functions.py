@@ -0,0 +1,65 @@
+import requests, os
+from requests.adapters import HTTPAdapter
+import modules.auth_functions as authfunc
+
+# Base URL and token resource per API audience (matches the audiences of 'fab api -A')
+API_AUDIENCES = {
+    "fabric": ("https://api.fabric.microsoft.com/v1", "https://api.fabric.microsoft.com"),
+    "powerbi": ("https://api.powerbi.com/v1.0/myorg", "https://analysis.windows.net/powerbi/api")
+}
+
+# Seconds to wait for a connection and for the response. A timed out request is retried as a transient connection failure
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("FAB_HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.environ.get("FAB_HTTP_READ_TIMEOUT", "120"))
+
+
+class FabricRestClient:
+    """
+    Fabric REST client reusing pooled keep-alive connections across calls.
+
+    Responses are returned in the same shape as the output of 'fab api':
+    {"status_code": int, "text": parsed body, "headers": dict with lower-cased keys}.
+    Transient failures are retried by the given retry policy (see fabric_cli_functions.RetryPolicy).
+    """
+
+    def __init__(self, tenant_id, client_id, client_secret, pool_size: int = 16, retry_policy=None):
+        self.tenant_id = tenant_id
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.retry_policy = retry_policy
+
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=len(API_AUDIENCES), pool_maxsize=pool_size))
+
+    def get_token(self, resource):
+        # Cached and renewed ahead of expiry by the shared token broker
+        return authfunc.get_access_token(self.tenant_id, self.client_id, self.client_secret, resource)
+
+    def request(self, method, endpoint, body=None, audience="fabric"):
+        base_url, resource = API_AUDIENCES[audience or "fabric"]
+        url = endpoint if endpoint.startswith("https://") else f"{base_url}/{endpoint.strip().lstrip('/')}"
+
+        def send():
+            headers = {"Authorization": f"Bearer {self.get_token(resource)}"}
+            return self.session.request(method.upper(), url, headers=headers, json=body, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+
+        def classify(response):
+            failure = self.retry_policy.classify_status(response.status_code)
+            return failure, self.retry_policy.parse_retry_after(response.headers.get("Retry-After"))
+
+        if self.retry_policy:
+            idempotent = method.lower() in ["get", "head", "put", "delete"]
+            response = self.retry_policy.call(send, classify, idempotent, retry_on=(requests.ConnectionError, requests.Timeout))
+        else:
+            response = send()
+
+        try:
+            text = response.json() if response.content else ""
+        except ValueError:
+            text = response.text
+
+        return {
+            "status_code": response.status_code,
+            "text": text,
+            "headers": {key.lower(): value for key, value in response.headers.items()}
+        }
@@ -1,6 +1,57 @@
-import subprocess, json, time, uuid
+import subprocess, json, time, uuid, os, sys, re, threading, atexit, asyncio, weakref, random, email.utils, functools
+from urllib.parse import quote
+from concurrent.futures import Future, ThreadPoolExecutor
+import modules.misc_functions as misc
 
 EXIT_ON_ERROR = False
+EXECUTION_MODE = os.environ.get("FAB_EXECUTION_MODE", "session").lower() # Options: session/subprocess
+SESSION_POOL_SIZE = int(os.environ.get("FAB_SESSION_POOL_SIZE", "4"))
+API_BACKEND = os.environ.get("FAB_API_BACKEND", "cli").lower() # Options: cli/http
+ASYNC_CONCURRENCY = int(os.environ.get("FAB_ASYNC_CONCURRENCY", "8"))
+
+# Commands changing CLI state are always run in a separate process and reset the session pool
+SESSION_RESET_COMMANDS = {"auth", "config"}
+WORKER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fabric_cli_worker.py")
+
+# Read-through cache of get/exists lookups within a run. TTL in seconds per resource type
+CACHE_ENABLED = os.environ.get("FAB_CACHE_ENABLED", "true").lower() in ["true", "1", "yes"]
+CACHE_TTL = {
+    "workspace": 600,
+    "connection": 300,
+    "item": 300
+}
+# Commands modifying the path they target. The cached entries of that path (and below) are invalidated
+CACHE_INVALIDATING_COMMANDS = {"create", "mkdir", "rm", "del", "set", "acl", "mv", "cp", "import", "assign", "unassign", "ln"}
+# Workspace REST endpoints (first segment below workspaces/{id}/) whose changes affect the workspace inventory
+INVENTORY_ENDPOINTS = {
+    "items", "folders", "lakehouses", "warehouses", "sqldatabases", "semanticmodels", "reports", "notebooks",
+    "datapipelines", "environments", "eventhouses", "kqldatabases", "mirroreddatabases", "managedprivateendpoints",
+    "provisionidentity", "deprovisionidentity"
+}
+
+# Retries of transient failures (throttling, server errors, dropped connections). Delays in seconds, budget per run
+RETRY_MAX_ATTEMPTS = int(os.environ.get("FAB_RETRY_MAX_ATTEMPTS", "5"))
+RETRY_BASE_DELAY = float(os.environ.get("FAB_RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.environ.get("FAB_RETRY_MAX_DELAY", "60"))
+RETRY_BUDGET = int(os.environ.get("FAB_RETRY_BUDGET", "100"))
+# Error codes and messages in the CLI output identifying a transient failure
+THROTTLED_PATTERN = re.compile(r"TooManyRequests|RequestBlocked|MaxRetriesExceeded|Rate limit exceeded|status code: 429", re.IGNORECASE)
+SERVER_ERROR_PATTERN = re.compile(r"InternalServerError|ServiceUnavailable|BadGateway|GatewayTimeout|status code: 5\d\d", re.IGNORECASE)
+CONNECTION_ERROR_PATTERN = re.compile(r"Connection (reset|aborted|refused)|ConnectionError|RemoteDisconnected|Read timed out", re.IGNORECASE)
+# Commands safe to repeat after a failure that may have reached the service. Others are only retried when throttled
+IDEMPOTENT_COMMANDS = {"get", "exists", "ls", "dir", "desc", "pwd"}
+
+# Polling of long running operations. Delays in seconds, doubled after each poll unless the service sends Retry-After
+LRO_TIMEOUT = int(os.environ.get("FAB_LRO_TIMEOUT", "1800"))
+LRO_INITIAL_DELAY = float(os.environ.get("FAB_LRO_INITIAL_DELAY", "1"))
+LRO_MAX_DELAY = float(os.environ.get("FAB_LRO_MAX_DELAY", "30"))
+LRO_BACKOFF_FACTOR = 2
+# Number of role assignment changes written at the same time when reconciling workspace and connection permissions
+ROLE_ASSIGNMENT_CONCURRENCY = int(os.environ.get("FAB_ROLE_ASSIGNMENT_CONCURRENCY", "8"))
+# Seconds to wait for the SQL endpoint of a new Lakehouse to be provisioned
+SQL_ENDPOINT_TIMEOUT = int(os.environ.get("FAB_SQL_ENDPOINT_TIMEOUT", "300"))
+# Number of semantic models bound to their SQL endpoint connection at the same time
+BINDING_CONCURRENCY = int(os.environ.get("FAB_BINDING_CONCURRENCY", "8"))
 
 def is_guid(value: str) -> bool:
     try:
@@ -9,15 +60,307 @@ def is_guid(value: str) -> bool:
     except (ValueError, AttributeError, TypeError):
         return False
 
-def run_command(command: str) -> str:
+
+class CliSession:
+    """A long-lived Fabric CLI worker process executing commands one at a time."""
+
+    def __init__(self, generation: int = 0):
+        self.generation = generation
+        self.process = subprocess.Popen(
+            [sys.executable, "-u", WORKER_PATH],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding="utf-8",
+            env={**os.environ, "PYTHONIOENCODING": "utf-8"}
+        )
+
+        ready = self._read()
+        if not ready or not ready.get("ready"):
+            self.close()
+            raise RuntimeError((ready or {}).get("error", "Fabric CLI session failed to start"))
+
+    def _read(self):
+        line = self.process.stdout.readline()
+        return json.loads(line) if line else None
+
+    def execute(self, command: str):
+        self.process.stdin.write(json.dumps({"command": command}) + "\n")
+        self.process.stdin.flush()
+
+        response = self._read()
+        if response is None:
+            raise RuntimeError("Fabric CLI session terminated unexpectedly")
+
+        return response.get("returncode", 1), response.get("stdout", ""), response.get("stderr", "")
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except Exception:
+            self.process.kill()
+
+
+class CliSessionPool:
+    """Multiplexes commands onto a bounded set of CliSession workers, started on demand."""
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self.generation = 0
+        self._idle = []
+        self._created = 0
+        # Signalled whenever a session is returned or a slot is freed, so a waiting caller can take or create one
+        self._available = threading.Condition()
+
+    def execute(self, command: str):
+        session = self._acquire()
+        try:
+            result = session.execute(command)
+        except Exception:
+            self._discard(session)
+            raise
+
+        if session.generation == self.generation:
+            self._release(session)
+        else:
+            self._discard(session)
+        return result
+
+    def warm_up(self):
+        self._release(self._acquire())
+
+    def _acquire(self):
+        with self._available:
+            while not self._idle and self._created >= self.size:
+                self._available.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+
+        try:
+            return CliSession(self.generation)
+        except Exception:
+            with self._available:
+                self._created -= 1
+                self._available.notify()
+            raise
+
+    def _release(self, session):
+        with self._available:
+            self._idle.append(session)
+            self._available.notify()
+
+    def _discard(self, session):
+        session.close()
+        with self._available:
+            self._created -= 1
+            self._available.notify()
+
+    def reset(self):
+        # Running sessions are discarded when returned, idle sessions are closed right away
+        with self._available:
+            self.generation += 1
+            idle_sessions, self._idle = self._idle, []
+        for session in idle_sessions:
+            self._discard(session)
+
+
+_session_pool = None
+_session_pool_lock = threading.Lock()
+
+
+def _get_session_pool():
+    global _session_pool, EXECUTION_MODE
+    with _session_pool_lock:
+        if _session_pool is None:
+            try:
+                _session_pool = CliSessionPool(SESSION_POOL_SIZE)
+                _session_pool.warm_up()
+            except Exception as e:
+                print(f"Fabric CLI session mode not available, falling back to subprocess mode: {e}")
+                EXECUTION_MODE = "subprocess"
+                _session_pool = None
+        return _session_pool
+
+
+def close_sessions():
+    if _session_pool:
+        _session_pool.reset()
+
+atexit.register(close_sessions)
+
+
+class RetryPolicy:
+    """
+    Retries transient failures with decorrelated jitter, honoring Retry-After.
+
+    Throttled calls are always retried, as the service did not process them. Server
+    and connection errors are only retried for idempotent calls. All retries of a run
+    draw from one budget, so a struggling tenant slows the run down instead of
+    multiplying the load on it.
+    """
+    def __init__(self, max_attempts: int = RETRY_MAX_ATTEMPTS, base_delay: float = RETRY_BASE_DELAY, max_delay: float = RETRY_MAX_DELAY, budget: int = RETRY_BUDGET):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.stats = {"calls": 0, "retries": 0, "throttled": 0, "server_error": 0, "connection": 0, "gave_up": 0, "budget_exhausted": 0, "delay_seconds": 0.0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def parse_retry_after(value, default: float = None):
+        if value is None:
+            return default
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            try:
+                return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0)
+            except (TypeError, ValueError):
+                return default
+
+    @staticmethod
+    def classify_status(status_code) -> str:
+        if status_code == 429:
+            return "throttled"
+        if status_code in [500, 502, 503, 504]:
+            return "server_error"
+        return None
+
+    def next_delay(self, previous_delay: float, retry_after: float = None) -> float:
+        # Decorrelated jitter; a delay requested by the service is a lower bound
+        delay = min(self.max_delay, random.uniform(self.base_delay, previous_delay * 3))
+        return max(delay, retry_after or 0)
+
+    def _consume_budget(self) -> bool:
+        with self._lock:
+            if self.stats["retries"] >= self.budget:
+                if not self.stats["budget_exhausted"]:
+                    misc.print_warning(f"Retry budget of {self.budget} exhausted, transient failures are no longer retried.")
+                self.stats["budget_exhausted"] += 1
+                return False
+            self.stats["retries"] += 1
+            return True
+
+    def call(self, function, classify, idempotent: bool = True, retry_on: tuple = (ConnectionError, TimeoutError)):
+        """
+        Calls function until classify(result) reports no transient failure or the attempts are used up.
+        classify returns a tuple (failure, retry_after), failure being "throttled", "server_error", "connection" or None.
+        """
+        with self._lock:
+            self.stats["calls"] += 1
+
+        delay = self.base_delay
+        for attempt in range(1, self.max_attempts + 1):
+            error = None
+            try:
+                result = function()
+                failure, retry_after = classify(result)
+            except retry_on as e:
+                error, failure, retry_after = e, "connection", None
+
+            if failure is None:
+                return result
+            if failure != "throttled" and not idempotent:
+                break
+            if attempt == self.max_attempts or not self._consume_budget():
+                with self._lock:
+                    self.stats["gave_up"] += 1
+                break
+
+            delay = self.next_delay(delay, retry_after)
+            with self._lock:
+                self.stats[failure] += 1
+                self.stats["delay_seconds"] += delay
+            time.sleep(delay)
+
+        if error is not None:
+            raise error
+        return result
+
+
+_retry_policy = RetryPolicy()
+
+
+def get_retry_policy() -> RetryPolicy:
+    return _retry_policy
+
+
+def get_retry_stats() -> dict:
+    with _retry_policy._lock:
+        return dict(_retry_policy.stats)
+
+
+def is_idempotent_command(command: str) -> bool:
+    tokens = command.strip().split()
+    verb = tokens[0].lower() if tokens else ""
+    if verb == "api":
+        method = re.search(r"\s-X\s+(\w+)", command)
+        return method is None or method.group(1).lower() in ["get", "head"]
+    if verb == "acl":
+        return len(tokens) > 1 and tokens[1].lower() in ["ls", "get"]
+    return verb in IDEMPOTENT_COMMANDS
+
+
+def classify_cli_result(result) -> tuple:
+    returncode, stdout, stderr = result
+
+    # 'fab api' reports the HTTP status in its JSON output, including Retry-After with --show_headers
     try:
+        response = json.loads(stdout)
+    except (json.JSONDecodeError, TypeError):
+        response = None
+    if isinstance(response, dict) and "status_code" in response:
+        return RetryPolicy.classify_status(response.get("status_code")), get_retry_after(response)
+
+    if returncode == 0:
+        return None, None
+
+    output = f"{stdout}\n{stderr}"
+    if THROTTLED_PATTERN.search(output):
+        return "throttled", None
+    if SERVER_ERROR_PATTERN.search(output):
+        return "server_error", None
+    if CONNECTION_ERROR_PATTERN.search(output):
+        return "connection", None
+    return None, None
+
+
+def _execute(command: str):
+    verb = command.strip().split(" ", 1)[0].lower()
+
+    with misc.trace_span(f"fab {verb}", "cli", command=command if len(command) <= 500 else f"{command[:500]}...") as span:
+        if verb in SESSION_RESET_COMMANDS:
+            close_sessions()
+        elif EXECUTION_MODE == "session":
+            pool = _get_session_pool()
+            if pool:
+                try:
+                    returncode, stdout, stderr = pool.execute(command)
+                    span.update(mode="session", returncode=returncode, bytes=len(stdout or ""))
+                    return returncode, stdout, stderr
+                except Exception as e:
+                    print(f"Fabric CLI session failed, running command in a new process: {e}")
+
         result = subprocess.run(
             ["fab", "-c", command],
             capture_output=True,
-            text=True,
-            check=EXIT_ON_ERROR
+            text=True
         )
-        output = result.stdout.strip()
+        span.update(mode="process", returncode=result.returncode, bytes=len(result.stdout or ""))
+        return result.returncode, result.stdout, result.stderr
+
+
+def run_command(command: str) -> str:
+    try:
+        returncode, stdout, stderr = _retry_policy.call(lambda: _execute(command), classify_cli_result, is_idempotent_command(command))
+        invalidate_cache_for_command(command)
+        if returncode != 0 and EXIT_ON_ERROR:
+            raise subprocess.CalledProcessError(returncode, ["fab", "-c", command], stdout, stderr)
+
+        output = stdout.strip()
 
         # Remove lines starting with ! (debug etc.)
         filtered_lines = [line for line in output.splitlines() if not line.strip().startswith("&#x27") and not line.strip().startswith("!")]
@@ -31,96 +374,410 @@ def run_command(command: str) -> str:
         return e.stderr.strip()
 
 
-def get_item(item_path: str, retry_count: int = 0):
-    for attempt in range(retry_count + 1):
-        try:
-            cli_response = run_command(f"get {item_path} -q . -f")
-            return json.loads(cli_response)
-        except Exception as e:
-            if attempt < retry_count:
-                time.sleep(2)
+_cache = {}
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def normalize_path(path: str) -> str:
+    path = path.strip().strip("'\"").strip().lstrip("/").rstrip("/")
+    return re.sub(r"/+", "/", path).lower()
+
+
+def get_resource_type(path: str) -> str:
+    if path.startswith(".connections/") or path.endswith(".connection"):
+        return "connection"
+    elif path.endswith(".workspace"):
+        return "workspace"
+    else:
+        return "item"
+
+
+def cached_lookup(kind: str, path: str, loader, use_cache: bool = True, cache_when=lambda value: value is not None):
+    key = (kind, normalize_path(path))
+
+    if CACHE_ENABLED and use_cache:
+        with _cache_lock:
+            entry = _cache.get(key)
+            if entry and entry[0] > time.time():
+                _cache_stats["hits"] += 1
+                return entry[1]
+            _cache_stats["misses"] += 1
+
+    value = loader()
+
+    if CACHE_ENABLED and cache_when(value):
+        ttl = CACHE_TTL.get(get_resource_type(key[1]), CACHE_TTL["item"])
+        with _cache_lock:
+            _cache[key] = (time.time() + ttl, value)
+
+    return value
+
+
+def peek_cache(kind: str, path: str):
+    with _cache_lock:
+        entry = _cache.get((kind, normalize_path(path)))
+        return entry[1] if entry and entry[0] > time.time() else None
+
+
+def invalidate_cache(path: str = None):
+    with _cache_lock:
+        if path is None:
+            keys = list(_cache.keys())
+        else:
+            path = normalize_path(path)
+            if get_resource_type(path) == "connection":
+                # Connections are also cached by id, so the whole namespace is dropped
+                keys = [key for key in _cache if get_resource_type(key[1]) == "connection"]
             else:
-                return None
+                keys = [key for key in _cache if key[1] == path or key[1].startswith(f"{path}/")]
+
+        for key in keys:
+            del _cache[key]
+        _cache_stats["invalidations"] += len(keys)
+
+
+def invalidate_cache_for_command(command: str):
+    parts = command.strip().split(" ", 1)
+    verb = parts[0].lower()
+
+    if verb in SESSION_RESET_COMMANDS:
+        invalidate_cache()
+    elif verb in CACHE_INVALIDATING_COMMANDS and len(parts) > 1:
+        target = parts[1]
+        if verb == "acl":
+            target = target.strip().split(" ", 1)[-1] # Skip the acl sub command
+        # The target path runs until the first option (e.g. -P, -f, --tenant)
+        target = re.split(r"\s-{1,2}[A-Za-z]", f" {target.strip()}", maxsplit=1)[0]
+        if target.strip():
+            invalidate_cache(target)
+            target_path = normalize_path(target)
+            if verb in {"create", "mkdir", "rm", "del", "mv"} and get_resource_type(target_path) == "workspace":
+                remove_from_workspace_index(target_path.removesuffix(".workspace"))
+            elif get_resource_type(target_path) == "connection" and _connection_catalog:
+                _connection_catalog.mark_stale(target_path.removeprefix(".connections/").removesuffix(".connection"))
+
+
+def get_cache_stats() -> dict:
+    with _cache_lock:
+        return {**_cache_stats, "entries": len(_cache)}
+
+
+_rest_client = None
+
+
+def login(tenant_id, client_id, client_secret):
+    global _rest_client
+    run_command(f"auth login -u {client_id} -p {client_secret} --tenant {tenant_id}")
+
+    if API_BACKEND == "http":
+        import modules.fabric_api_functions as fabapi
+        _rest_client = fabapi.FabricRestClient(tenant_id, client_id, client_secret, retry_policy=_retry_policy)
+
+
+def invoke_api(endpoint: str, method: str = "get", body: dict = None, audience: str = None, show_headers: bool = False) -> dict:
+    with misc.trace_span(f"{method.upper()} {endpoint.split('?')[0]}", "http", endpoint=endpoint, audience=audience or "fabric", backend=API_BACKEND) as span:
+        if API_BACKEND == "http" and _rest_client:
+            response = _rest_client.request(method, endpoint, body, audience)
+            span["bytes"] = int(get_response_header(response, "content-length") or 0)
+        else:
+            command = f"api -A {audience} -X {method} {endpoint}" if audience else f"api -X {method} {endpoint}"
+            if body is not None:
+                command += f" -i {json.dumps(body)}"
+            if show_headers:
+                command += " --show_headers"
+
+            cli_response = run_command(command)
+            span["bytes"] = len(cli_response)
+            try:
+                response = json.loads(cli_response)
+            except json.JSONDecodeError:
+                response = {"status_code": None, "text": cli_response, "headers": {}}
+        span["status_code"] = response.get("status_code")
+
+    # Changes made through the REST API cannot be mapped to cached paths, so the affected resource type is dropped
+    if method.lower() != "get":
+        # Only item changes affect the inventory, role assignments or git settings do not
+        workspace_match = re.match(r"/?workspaces/([0-9a-fA-F-]{36})/([^/?]+)", endpoint.strip())
+        if workspace_match and workspace_match.group(2).lower() in INVENTORY_ENDPOINTS:
+            invalidate_workspace_inventory(workspace_match.group(1))
+
+        # Sub resources of a connection (e.g. roleAssignments) do not change the connection itself
+        if re.fullmatch(r"connections(/[^/?]+)?/?", endpoint.strip().lstrip("/").split("?")[0]):
+            resource_type = "connection"
+            invalidate_connection_catalog()
+        elif endpoint.strip().lstrip("/").startswith("connections"):
+            resource_type = None
+        else:
+            resource_type = "item"
+
+        with _cache_lock:
+            keys = [key for key in _cache if get_resource_type(key[1]) == resource_type]
+            for key in keys:
+                del _cache[key]
+            _cache_stats["invalidations"] += len(keys)
+
+    return response
+
+
+def get_response_header(response: dict, header_name: str):
+    headers = response.get("headers") or {}
+    return next((value for key, value in headers.items() if key.lower() == header_name.lower()), None)
+
+
+def get_item(item_path: str, retry_count: int = 0, use_cache: bool = True):
+    def load():
+        for attempt in range(retry_count + 1):
+            try:
+                cli_response = run_command(f"get {item_path} -q . -f")
+                return json.loads(cli_response)
+            except Exception as e:
+                if attempt < retry_count:
+                    time.sleep(2)
+                else:
+                    return None
+
+    return cached_lookup("get", item_path, load, use_cache)
 
 
 def get_item_id(item_path: str, retry_count: int = 0):
-    for attempt in range(retry_count + 1):
-        try:
-            cli_response = run_command(f"get {item_path} -q id -f")
-            return cli_response.strip()
-        except Exception as e:
-            if attempt < retry_count:
-                time.sleep(2)
-            else:
-                return None
+    def load():
+        item = peek_cache("get", item_path)
+        if item and item.get("id"):
+            return item.get("id")
+
+        for attempt in range(retry_count + 1):
+            try:
+                cli_response = run_command(f"get {item_path} -q id -f")
+                return cli_response.strip()
+            except Exception as e:
+                if attempt < retry_count:
+                    time.sleep(2)
+                else:
+                    return None
+
+    return cached_lookup("id", item_path, load, cache_when=is_guid)
+
+
+_workspace_index = None
+_workspace_index_lock = threading.Lock()
+
+
+def get_workspace_index(refresh: bool = False) -> dict:
+    global _workspace_index
+    with _workspace_index_lock:
+        if _workspace_index is None or refresh:
+            _workspace_index = {
+                workspace.get("displayName").lower(): workspace.get("id")
+                for workspace in list_all_pages("workspaces")
+                if workspace.get("displayName")
+            }
+        return _workspace_index
+
+
+def remove_from_workspace_index(workspace_name: str):
+    with _workspace_index_lock:
+        if _workspace_index is not None:
+            _workspace_index.pop(workspace_name.replace("\\/", "/").lower(), None)
+
+
+def get_workspace_id(workspace_name: str):
+    # Accepts both plain and escaped (\/) workspace names
+    workspace_name = workspace_name.replace("\\/", "/")
+    workspace_index = get_workspace_index()
+
+    workspace_id = workspace_index.get(workspace_name.lower())
+    if workspace_id:
+        return workspace_id
+
+    # Not in the listing (e.g. created after it was loaded), fall back to a targeted lookup
+    workspace_name_escaped = workspace_name.replace("/", "\\/")
+    workspace_id = get_item_id(f"'{workspace_name_escaped}.Workspace'")
+    if not is_guid(workspace_id):
+        return None
+
+    with _workspace_index_lock:
+        workspace_index[workspace_name.lower()] = workspace_id
+    return workspace_id
+
+
+def workspace_exists(workspace_name: str) -> bool:
+    workspace_name = workspace_name.replace("\\/", "/")
+    if get_workspace_index().get(workspace_name.lower()):
+        return True
+    workspace_name_escaped = workspace_name.replace("/", "\\/")
+    return item_exists(f"{workspace_name_escaped}.Workspace")
             
 
+class ConnectionCatalog:
+    """
+    Index of the connections visible to the principal, built from one paginated
+    listing of the connections endpoint. Connections are indexed by displayName
+    and id, with connectionDetails.path parsed up front (see misc.parse_fabric_connection).
+    Names touched by a command since the listing are marked stale and looked up again.
+    """
+
+    def __init__(self):
+        self._by_name = {}
+        self._by_id = {}
+        self._details = {}
+        self._stale = set()
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        connections = list_all_pages("connections")
+        with self._lock:
+            self._by_name = {}
+            self._by_id = {}
+            self._details = {}
+            self._stale = set()
+            for connection in connections:
+                self._index(connection)
+
+    def _index(self, connection: dict):
+        if connection.get("displayName"):
+            self._by_name[connection.get("displayName").lower()] = connection
+        if connection.get("id"):
+            self._by_id[connection.get("id").lower()] = connection
+            self._details[connection.get("id").lower()] = misc.parse_fabric_connection(connection)
+
+    def add(self, connection: dict):
+        if connection and (connection.get("id") or connection.get("displayName")):
+            with self._lock:
+                self._index(connection)
+                self._stale.discard((connection.get("displayName") or "").lower())
+
+    def remove(self, connection_identifier: str):
+        with self._lock:
+            connection = self._by_id.get(connection_identifier.lower()) or self._by_name.get(connection_identifier.lower())
+            if connection:
+                self._by_name.pop((connection.get("displayName") or "").lower(), None)
+                self._by_id.pop((connection.get("id") or "").lower(), None)
+                self._details.pop((connection.get("id") or "").lower(), None)
+
+    def mark_stale(self, connection_name: str):
+        self.remove(connection_name)
+        with self._lock:
+            self._stale.add(connection_name.lower())
+
+    def is_stale(self, connection_name: str) -> bool:
+        with self._lock:
+            return connection_name.lower() in self._stale
+
+    def get(self, connection_identifier: str):
+        with self._lock:
+            if is_guid(connection_identifier):
+                return self._by_id.get(connection_identifier.lower())
+            return self._by_name.get(connection_identifier.lower())
+
+    def get_details(self, connection_identifier: str) -> dict:
+        connection = self.get(connection_identifier)
+        with self._lock:
+            return self._details.get((connection or {}).get("id", "").lower(), {})
+
+
+_connection_catalog = None
+_connection_catalog_lock = threading.Lock()
+
+
+def get_connection_catalog(refresh: bool = False) -> ConnectionCatalog:
+    global _connection_catalog
+    with _connection_catalog_lock:
+        if _connection_catalog is None:
+            _connection_catalog = ConnectionCatalog()
+        elif refresh:
+            _connection_catalog.refresh()
+        return _connection_catalog
+
+
+def invalidate_connection_catalog():
+    global _connection_catalog
+    with _connection_catalog_lock:
+        _connection_catalog = None
+
+
 def get_connection(connection_identifier):
+    catalog = get_connection_catalog()
+    connection = catalog.get(connection_identifier)
+    if connection:
+        return connection
+
     if is_guid(connection_identifier): 
-        connection_url = f"connections/{connection_identifier}"
-        response = run_command(f"api -X get {connection_url} ")
-        return json.loads(response)
-    else:
-        return json.loads(run_command(f"get .connections/{connection_identifier}.Connection -q . -f"))
+        # Connections shared with the principal by id may not be part of the listing
+        def load():
+            response = invoke_api(f"connections/{connection_identifier}")
+            return response.get("text") if response.get("status_code") == 200 else None
+        connection = cached_lookup("get", f".connections/{connection_identifier}", load)
+    elif catalog.is_stale(connection_identifier):
+        connection = get_item(f".connections/{connection_identifier}.Connection")
+
+    catalog.add(connection)
+    return connection
 
 
 def connection_exists(connection_identifier):
-    if is_guid(connection_identifier): 
-        connection_url = f"connections/{connection_identifier}"
-        response = run_command(f"api -X get {connection_url}")
-        return json.loads(response).get("status_code", 404) == 200
-    else:
-        return True if run_command(f"exists .connections/{connection_identifier}.Connection").replace("*", "").strip().lower() == "true" else False
+    return get_connection(connection_identifier) is not None
+
+
+def get_connection_details(connection_identifier) -> dict:
+    if get_connection(connection_identifier):
+        return get_connection_catalog().get_details(connection_identifier)
+    return {}
 
 
 def item_exists(item_path):
-    return True if run_command(f"exists {item_path}").replace("*", "").strip().lower() == "true" else False
+    def load():
+        if peek_cache("get", item_path):
+            return True
+        return True if run_command(f"exists {item_path}").replace("*", "").strip().lower() == "true" else False
 
+    return cached_lookup("exists", item_path, load)
 
-def get_git_connection(workspace_id):
+
+def get_git_connection(workspace_id, timeout: float = 60):
     git_url = f"workspaces/{workspace_id}/git/connection"
-    
-    retry_count = 0
-    max_retries = 5
-    while retry_count < max_retries:
-        response = run_command(f"api -X get {git_url}")
-        git_connectionstate = json.loads(response).get("text").get("gitConnectionState")
-        if git_connectionstate == "NotConnected":
-            # Connection not ready yet, wait and retry
-            time.sleep(2)
-            retry_count += 1
-        else:
-            return json.loads(response).get("text")
-    
-    return None  # Operation timed out or failed
+
+    def is_connected(git_connection):
+        return (git_connection or {}).get("gitConnectionState") != "NotConnected"
+
+    # Connection may not be ready right after connecting, wait with backoff
+    git_connection = poll_until(lambda: invoke_api(git_url).get("text"), is_connected, timeout)
+    return git_connection if is_connected(git_connection) else None  # Operation timed out or failed
+
+
+def get_git_connection_state(workspace_id):
+    # Current state without waiting, e.g. for a snapshot of the environment
+    response = invoke_api(f"workspaces/{workspace_id}/git/connection")
+    return response.get("text") if response.get("status_code") == 200 else None
 
 
 def connect_workspace_to_git(workspace_id, git_settings):
     connect_url = f"workspaces/{workspace_id}/git/connect"
-    run_command(f"api -X post {connect_url} -i {json.dumps(git_settings)}")
+    invoke_api(connect_url, "post", git_settings)
     git_connection = get_git_connection(workspace_id)
     return git_connection
 
 
 def initialize_git_connection(workspace_id):
     initialize_url = f"workspaces/{workspace_id}/git/initializeConnection"
-    response = run_command(f"api -X post {initialize_url}")
-    if json.loads(response).get("status_code") == 200:
-        return json.loads(response).get("text")
+    response = invoke_api(initialize_url, "post")
+    if response.get("status_code") == 200:
+        return response.get("text")
 
 
 def disconnect_git_connection(workspace_id):
     disconnect_url = f"workspaces/{workspace_id}/git/disconnect"
-    response = run_command(f"api -X post {disconnect_url}")
-    if json.loads(response).get("status_code") == 200:
-        return json.loads(response).get("text")
+    response = invoke_api(disconnect_url, "post")
+    if response.get("status_code") == 200:
+        return response.get("text")
     
 
 def get_git_status(workspace_id):
     status_url = f"workspaces/{workspace_id}/git/status"
-    response = run_command(f"api -X get {status_url}")
-    if json.loads(response).get("status_code") == 200:
-        return json.loads(response).get("text")
+    response = invoke_api(status_url)
+    if response.get("status_code") == 200:
+        return response.get("text")
     
 
 def create_sql_connection(connection_name, server, database, tenant_id, client_id, client_secret):
@@ -172,36 +829,33 @@ def create_fabric_connection(connection_name, connection_type, credential_type,
 
     timestamp_str = str(int(time.time()))
     if creation_method:
-        max_retries = 3
-        for attempt in range(1, max_retries + 1):
-            try:
-                cmd = (f"create .connections/{connection_name}.Connection -P "
-                    f"privacyLevel=Organizational,connectionDetails.type={connection_type},connectionDetails.creationMethod={creation_method},"
-                    f"connectionDetails.parameters.options={timestamp_str},"
-                    f"credentialDetails.connectionEncryption=NotEncrypted,"
-                    f"credentialDetails.type={credential_type}")
-                
-                if credential_type == "ServicePrincipal":
-                    cmd += (f",credentialDetails.tenantId={tenant_id}," 
-                    f"credentialDetails.servicePrincipalClientId={client_id}," 
-                    f"credentialDetails.servicePrincipalSecret={client_secret}")
-                
-                creation_response = run_command(cmd)
-
-                fabric_connection = get_connection(connection_name)
-
-                if not fabric_connection:
-                    raise Exception("Connection lookup returned no result.")
-
+        cmd = (f"create .connections/{connection_name}.Connection -P "
+            f"privacyLevel=Organizational,connectionDetails.type={connection_type},connectionDetails.creationMethod={creation_method},"
+            f"connectionDetails.parameters.options={timestamp_str},"
+            f"credentialDetails.connectionEncryption=NotEncrypted,"
+            f"credentialDetails.type={credential_type}")
+        
+        if credential_type == "ServicePrincipal":
+            cmd += (f",credentialDetails.tenantId={tenant_id}," 
+            f"credentialDetails.servicePrincipalClientId={client_id}," 
+            f"credentialDetails.servicePrincipalSecret={client_secret}")
+        
+        def create_connection():
+            # Checking for the connection first makes the attempt safe to repeat: a create which failed
+            # with a server error may still have been processed
+            fabric_connection = get_connection(connection_name)
+            if fabric_connection:
                 return fabric_connection
+            run_command(cmd)
+            return poll_until(lambda: get_connection(connection_name), lambda connection: connection is not None, timeout=10)
 
-            except Exception as e:
-                print(f"...", end="")
-                print(f"Attempt {attempt} to create Fabric connection '{connection_name}' failed: {str(e)}")
-                if attempt == max_retries:
-                    return None
-                time.sleep(2) # Wait before retrying 
-        return 
+        # run_command only retries throttling of a create, as it is not idempotent. Server errors and
+        # a connection not becoming visible are retried here, drawing from the same retry budget
+        fabric_connection = _retry_policy.call(create_connection, lambda connection: (None if connection else "server_error", None))
+
+        if not fabric_connection:
+            print(f"Fabric connection '{connection_name}' could not be found after creation.")
+        return fabric_connection
     else:
         print(f"Connection type '{connection_type}' not supported!.")
         return None
@@ -218,8 +872,117 @@ def add_connection_roleassignment(connection_id, identity_id, identity_type, rol
         "role": role
     }
 
-    response = run_command(f"api -X post connections/{connection_id}/roleAssignments -i {json.dumps(body)}")
-    return json.loads(response)
+    return invoke_api(f"connections/{connection_id}/roleAssignments", "post", body)
+
+
+def list_connection_role_assignments(connection_id):
+    return list_all_pages(f"connections/{connection_id}/roleAssignments")
+
+
+def update_connection_roleassignment(connection_id, role_assignment_id, role):
+    return invoke_api(f"connections/{connection_id}/roleAssignments/{role_assignment_id}", "patch", {"role": role})
+
+
+def delete_connection_roleassignment(connection_id, role_assignment_id):
+    return invoke_api(f"connections/{connection_id}/roleAssignments/{role_assignment_id}", "delete")
+
+
+def reconcile_role_assignments(current_assignments: list, role_assignments: dict, add, update, delete, prune: bool = False, keep: list = None, max_workers: int = None) -> dict:
+    """
+    Compare the current role assignments of a workspace or connection with the desired ones
+    (see misc.get_workspace_role_assignments) and write only the missing or changed assignments, concurrently.
+    With prune, assignments of principals not in role_assignments (or keep) are removed as well.
+
+    Args:
+        current_assignments (list): Role assignments as listed by the roleAssignments endpoint.
+        role_assignments (dict): Principal id mapped to the desired {"id", "type", "role"}.
+        add, update, delete (callable): Write a single change: add(desired), update(assignment, desired), delete(assignment).
+        prune (bool): Remove assignments of principals not in role_assignments.
+        keep (list): Principal ids never removed, e.g. the principal running the setup.
+        max_workers (int): Number of changes written at the same time. Defaults to ROLE_ASSIGNMENT_CONCURRENCY.
+
+    Returns:
+        dict: Number of assignments "added", "updated", "removed", "unchanged" and "failed".
+    """
+    current = {assignment.get("principal", {}).get("id", "").lower(): assignment for assignment in current_assignments}
+
+    changes = []
+    for principal_id, desired in role_assignments.items():
+        assignment = current.get(principal_id.lower())
+        if assignment is None:
+            changes.append(("added", functools.partial(add, desired)))
+        elif assignment.get("role", "").lower() != desired["role"].lower():
+            changes.append(("updated", functools.partial(update, assignment, desired)))
+
+    if prune:
+        desired_principals = {principal_id.lower() for principal_id in list(role_assignments) + [principal_id for principal_id in (keep or []) if principal_id]}
+        for principal_id, assignment in current.items():
+            if principal_id not in desired_principals:
+                changes.append(("removed", functools.partial(delete, assignment)))
+
+    summary = {"added": 0, "updated": 0, "removed": 0, "unchanged": len(role_assignments) - sum(1 for outcome, _ in changes if outcome != "removed"), "failed": 0}
+    if changes:
+        with ThreadPoolExecutor(max_workers=max_workers or ROLE_ASSIGNMENT_CONCURRENCY) as executor:
+            futures = [(outcome, executor.submit(change)) for outcome, change in changes]
+        for outcome, future in futures:
+            response = None if future.exception() else future.result()
+            if isinstance(response, dict) and 200 <= (response.get("status_code") or 0) < 300:
+                summary[outcome] += 1
+            else:
+                summary["failed"] += 1
+
+    return summary
+
+
+def reconcile_connection_roleassignments(connection_id, role_assignments: dict, prune: bool = False, keep: list = None, max_workers: int = None) -> dict:
+    return reconcile_role_assignments(
+        list_connection_role_assignments(connection_id),
+        role_assignments,
+        add=lambda desired: add_connection_roleassignment(connection_id, desired["id"], desired["type"], desired["role"]),
+        update=lambda assignment, desired: update_connection_roleassignment(connection_id, assignment.get("id"), desired["role"]),
+        delete=lambda assignment: delete_connection_roleassignment(connection_id, assignment.get("id")),
+        prune=prune,
+        keep=keep,
+        max_workers=max_workers
+    )
+
+
+def list_workspace_role_assignments(workspace_id):
+    return list_all_pages(f"workspaces/{workspace_id}/roleAssignments")
+
+
+def add_workspace_roleassignment(workspace_id, identity_id, identity_type, role):
+    body = {
+        "principal": {
+            "id": identity_id,
+            "type": identity_type
+        },
+        "role": role
+    }
+
+    return invoke_api(f"workspaces/{workspace_id}/roleAssignments", "post", body)
+
+
+def update_workspace_roleassignment(workspace_id, role_assignment_id, role):
+    return invoke_api(f"workspaces/{workspace_id}/roleAssignments/{role_assignment_id}", "patch", {"role": role})
+
+
+def delete_workspace_roleassignment(workspace_id, role_assignment_id):
+    return invoke_api(f"workspaces/{workspace_id}/roleAssignments/{role_assignment_id}", "delete")
+
+
+def reconcile_workspace_roleassignments(workspace_id, role_assignments: dict, prune: bool = False, keep: list = None, max_workers: int = None) -> dict:
+    # Replaces one "acl set" per identity by one listing plus the changes through the roleAssignments endpoint
+    return reconcile_role_assignments(
+        list_workspace_role_assignments(workspace_id),
+        role_assignments,
+        add=lambda desired: add_workspace_roleassignment(workspace_id, desired["id"], desired["type"], desired["role"]),
+        update=lambda assignment, desired: update_workspace_roleassignment(workspace_id, assignment.get("id"), desired["role"]),
+        delete=lambda assignment: delete_workspace_roleassignment(workspace_id, assignment.get("id")),
+        prune=prune,
+        keep=keep,
+        max_workers=max_workers
+    )
 
 
 def bind_semanticmodel_sqlendpoint(workspace_id, item_id, connection_id, sqlendpoint, database_name):
@@ -235,31 +998,321 @@ def bind_semanticmodel_sqlendpoint(workspace_id, item_id, connection_id, sqlendp
     }
 
     endpoint = f"workspaces/{workspace_id}/semanticModels/{item_id}/bindConnection"
-    response = run_command(f"api -X post {endpoint} -i {json.dumps(body)}")
-    return json.loads(response)
+    return invoke_api(endpoint, "post", body)
 
 
-def list_all_workspace_items(workspace_id):
-    all_items = []
+def list_item_connections(workspace_id, item_id):
+    return list_all_pages(f"workspaces/{workspace_id}/items/{item_id}/connections")
+
+
+def is_semanticmodel_bound(workspace_id, item_id, connection_id, sqlendpoint, database_name) -> bool:
+    path = f"{sqlendpoint};{database_name}".lower()
+    return any(
+        (connection.get("id") or "").lower() == connection_id.lower()
+        and ((connection.get("connectionDetails") or {}).get("path") or "").lower() == path
+        for connection in list_item_connections(workspace_id, item_id)
+    )
+
+
+def bind_semanticmodels_sqlendpoint(workspace_id, semantic_models: dict, connection_id, sqlendpoint, database_name, takeover: bool = False, max_workers: int = None) -> dict:
+    """
+    Bind semantic models to a SQL endpoint connection, concurrently. Models already bound to the connection
+    and path are left as they are.
+
+    Args:
+        semantic_models (dict): Semantic model name mapped to its id.
+        takeover (bool): Take over the models before binding them, so the principal owns their data sources.
+        max_workers (int): Number of models bound at the same time. Defaults to BINDING_CONCURRENCY.
+
+    Returns:
+        dict: Semantic model name mapped to {"status": "bound" | "unchanged" | "failed", "response": dict}.
+    """
+    def bind(item_id):
+        if is_semanticmodel_bound(workspace_id, item_id, connection_id, sqlendpoint, database_name):
+            return {"status": "unchanged", "response": None}
+
+        if takeover:
+            response = takeover_semantic_model(workspace_id, item_id)
+            if (response or {}).get("status_code") != 200:
+                return {"status": "failed", "response": response}
+
+        response = bind_semanticmodel_sqlendpoint(workspace_id, item_id, connection_id, sqlendpoint, database_name)
+        return {"status": "bound" if (response or {}).get("status_code") == 200 else "failed", "response": response}
+
+    results = {}
+    if semantic_models:
+        with ThreadPoolExecutor(max_workers=max_workers or BINDING_CONCURRENCY) as executor:
+            futures = {name: executor.submit(bind, item_id) for name, item_id in semantic_models.items()}
+        for name, future in futures.items():
+            results[name] = future.result() if not future.exception() else {"status": "failed", "response": {"text": str(future.exception())}}
+    return results
+
+
+def list_all_pages(endpoint: str, audience: str = None):
+    all_values = []
     continuation_token = None
 
+    while True:
+        page_endpoint = endpoint
+        if continuation_token:
+            separator = "&" if "?" in endpoint else "?"
+            page_endpoint += f"{separator}continuationToken={quote(continuation_token, safe='')}"
+
+        data = invoke_api(page_endpoint, audience=audience).get("text") or {}
+        if not isinstance(data, dict):
+            break
+
+        all_values.extend(data.get("value", []))
+        continuation_token = data.get("continuationToken")
+        if not continuation_token:
+            break
+
+    return all_values
+
+
+def list_all_workspace_items(workspace_id):
+    if is_guid(workspace_id):
+        return list_all_pages(f"workspaces/{workspace_id}/items")
+    return []
+
+
+def list_managed_private_endpoints(workspace_id):
     if is_guid(workspace_id):
+        return list_all_pages(f"workspaces/{workspace_id}/managedPrivateEndpoints")
+    return []
+
+
+class WorkspaceInventory:
+    """
+    In-memory index of a workspace built from one paginated item listing, covering
+    items, managed private endpoints and the workspace identity. Items are indexed
+    by (type, displayName) and by id.
+    """
+
+    def __init__(self, workspace_id: str):
+        self.workspace_id = workspace_id
+        self._by_name = {}
+        self._by_id = {}
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        items = list_all_workspace_items(self.workspace_id)
+
+        for endpoint in list_managed_private_endpoints(self.workspace_id):
+            items.append({**endpoint, "type": "ManagedPrivateEndpoint", "displayName": endpoint.get("name")})
+
+        identity = get_workspace_identity(self.workspace_id)
+        if identity:
+            items.append(identity)
+
+        with self._lock:
+            self._by_name = {}
+            self._by_id = {}
+            for item in items:
+                self._index(item)
+
+    def _index(self, item: dict):
+        self._by_name[(item.get("type", "").lower(), item.get("displayName", "").lower())] = item
+        if item.get("id"):
+            self._by_id[item.get("id").lower()] = item
+
+    def add(self, item: dict):
+        if item and item.get("type") and item.get("displayName"):
+            with self._lock:
+                self._index(item)
+
+    def remove(self, item_type: str, display_name: str):
+        with self._lock:
+            item = self._by_name.pop((item_type.lower(), display_name.lower()), None)
+            if item and item.get("id"):
+                self._by_id.pop(item.get("id").lower(), None)
+
+    def get(self, item_type: str, display_name: str):
+        with self._lock:
+            return self._by_name.get((item_type.lower(), display_name.lower()))
+
+    def get_by_id(self, item_id: str):
+        with self._lock:
+            return self._by_id.get((item_id or "").lower())
+
+    def exists(self, item_type: str, display_name: str) -> bool:
+        return self.get(item_type, display_name) is not None
+
+    def items(self, item_type: str = None) -> list:
+        with self._lock:
+            return [item for (type_name, _), item in self._by_name.items() if item_type is None or type_name == item_type.lower()]
+
+
+def get_workspace_identity(workspace_id: str, workspace_name: str = None):
+    # The workspace identity as an inventory item, its id being the service principal id. None if the workspace has none
+    workspace = invoke_api(f"workspaces/{workspace_id}").get("text") or {}
+    identity = workspace.get("workspaceIdentity") if isinstance(workspace, dict) else None
+    if not identity:
+        return None
+    return {
+        "id": identity.get("servicePrincipalId"),
+        "type": "ManagedIdentity",
+        "displayName": workspace.get("displayName") or workspace_name,
+        "applicationId": identity.get("applicationId")
+    }
+
+
+_inventories = {}
+_inventories_lock = threading.Lock()
+
+
+def get_workspace_inventory(workspace_id: str, refresh: bool = False) -> WorkspaceInventory:
+    with _inventories_lock:
+        inventory = _inventories.get(workspace_id)
+
+    if inventory is None:
+        inventory = WorkspaceInventory(workspace_id)
+        with _inventories_lock:
+            _inventories[workspace_id] = inventory
+    elif refresh:
+        inventory.refresh()
+
+    return inventory
+
+
+def invalidate_workspace_inventory(workspace_id: str = None):
+    with _inventories_lock:
+        if workspace_id is None:
+            _inventories.clear()
+        else:
+            _inventories.pop(workspace_id, None)
+
+
+#---------------------------------------------------------
+# Long running operations. A 202 response is tracked as a
+# LongRunningOperation, polled at the pace the service asks
+# for through Retry-After and otherwise with exponential
+# backoff until its deadline. OperationTracker polls many
+# operations from a single loop, so callers can start all
+# work first and wait for the slowest operation only once.
+#---------------------------------------------------------
+def get_retry_after(response: dict, default: float = None):
+    return RetryPolicy.parse_retry_after(get_response_header(response, "Retry-After"), default)
+
+
+def to_api_endpoint(url: str) -> str:
+    # Location headers hold absolute URLs, whereas invoke_api expects the path below the API version
+    match = re.match(r"https?://[^/]+/v1(?:\.0/myorg)?/(.*)", url or "")
+    return match.group(1) if match else url
+
+
+def poll_until(load, condition, timeout: float = None, initial_delay: float = None, max_delay: float = None):
+    deadline = time.time() + (timeout or LRO_TIMEOUT)
+    delay = initial_delay or LRO_INITIAL_DELAY
+
+    while True:
+        value = load()
+        remaining = deadline - time.time()
+        if condition(value) or remaining <= 0:
+            return value
+        time.sleep(min(delay, remaining))
+        delay = min(delay * LRO_BACKOFF_FACTOR, max_delay or LRO_MAX_DELAY)
+
+
+class LongRunningOperation:
+    """
+    State of a single long running operation, polled through its Location header or operations/{id}.
+    """
+    TERMINAL_STATES = {"Succeeded", "Failed", "Cancelled", "TimedOut"}
+
+    def __init__(self, operation_id: str = None, location: str = None, retry_after: float = None, timeout: float = None):
+        self.operation_id = operation_id
+        self.location = to_api_endpoint(location) if location else f"operations/{operation_id}"
+        self.deadline = time.time() + (timeout or LRO_TIMEOUT)
+        self.delay = LRO_INITIAL_DELAY
+        self.next_poll = time.time() + (retry_after if retry_after is not None else self.delay)
+        self.status = "NotStarted"
+        self.state = None
+        self.result = None
+
+    @classmethod
+    def from_response(cls, response: dict, timeout: float = None):
+        if response.get("status_code") != 202:
+            return None
+        return cls(
+            get_response_header(response, "x-ms-operation-id"),
+            get_response_header(response, "Location"),
+            get_retry_after(response),
+            timeout
+        )
+
+    @property
+    def done(self) -> bool:
+        return self.status in self.TERMINAL_STATES
+
+    @property
+    def succeeded(self) -> bool:
+        return self.status == "Succeeded"
+
+    def poll(self):
+        response = invoke_api(self.location, show_headers=True)
+        state = response.get("text")
+        if isinstance(state, dict):
+            self.state = state
+            self.status = state.get("status") or self.status
+
+        if self.status == "Succeeded":
+            # Operations with a result point to operations/{id}/result through the Location header
+            result_location = get_response_header(response, "Location")
+            if result_location and to_api_endpoint(result_location) != self.location:
+                self.result = invoke_api(to_api_endpoint(result_location)).get("text")
+            else:
+                self.result = self.state
+        elif not self.done:
+            now = time.time()
+            if now >= self.deadline:
+                self.status = "TimedOut"
+            else:
+                self.next_poll = min(now + get_retry_after(response, self.delay), self.deadline)
+                self.delay = min(self.delay * LRO_BACKOFF_FACTOR, LRO_MAX_DELAY)
+
+        return self.status
+
+    def wait(self):
+        tracker = OperationTracker()
+        tracker.add(self.operation_id, self)
+        tracker.wait()
+        return self.result if self.succeeded else None
+
+
+class OperationTracker:
+    """
+    Polls any number of long running operations from one loop, each at its own pace.
+    """
+    def __init__(self):
+        self.operations = {}
+
+    def add(self, key, operation: LongRunningOperation):
+        if operation is not None:
+            self.operations[key] = operation
+        return operation
+
+    def pending(self) -> list:
+        return [operation for operation in self.operations.values() if not operation.done]
+
+    def wait(self, on_complete=None) -> dict:
         while True:
-            command = f"workspaces/{workspace_id}/items"
-            if continuation_token:
-                command += f"?continuationToken={continuation_token}"
-
-            response = run_command(f"api -X get {command}")
-            data = json.loads(response)
-            all_items.extend(data.get("text").get("value", []))
-            continuation_token = data.get("continuationToken")
-            if not continuation_token:
-                break
+            pending = {key: operation for key, operation in self.operations.items() if not operation.done}
+            if not pending:
+                return self.operations
+
+            due = {key: operation for key, operation in pending.items() if operation.next_poll <= time.time()}
+            for key, operation in due.items():
+                operation.poll()
+                if operation.done and on_complete:
+                    on_complete(key, operation)
 
-    return all_items
+            if not due:
+                time.sleep(max(min(operation.next_poll for operation in pending.values()) - time.time(), 0))
 
 
-def update_workspace_from_git(workspace_id, remote_commit_hash):
+def update_workspace_from_git(workspace_id, remote_commit_hash, wait: bool = True, timeout: float = None):
     update_url = f"workspaces/{workspace_id}/git/updateFromGit"
 
     post_data = {
@@ -273,39 +1326,119 @@ def update_workspace_from_git(workspace_id, remote_commit_hash):
         }
     }
 
-    response = json.loads(run_command(f"api -X post {update_url} -i {json.dumps(post_data)} --show_headers"))
+    response = invoke_api(update_url, "post", post_data, show_headers=True)
 
-    if response.get("status_code") == 202: #LRO
-        operation_id = response.get("headers").get("x-ms-operation-id")
-        poll_operation_status(operation_id)
-    else:
+    operation = LongRunningOperation.from_response(response, timeout)
+    if operation is None:
         return response.get("text")
+    if not wait:
+        return operation # Add to an OperationTracker to wait for several updates at once
+    return operation.wait()
 
 
-def poll_operation_status(operation_id):
-    # Poll the operation status until it's done or failed
-    retry_count = 0
-    max_retries = 5
-    while retry_count < max_retries:
-        operation_url = f"operations/{operation_id}"
-        operation_state = json.loads(run_command(f"api -X get {operation_url}"))
-        state_status = operation_state.get("text").get("status")
-
-        if state_status in ["NotStarted", "Running"]:
-            time.sleep(2)
-            retry_count += 1
-        elif state_status == "Succeeded":
-            return operation_state.get("text")
-        else:
-            return None
-    
-    return None  # Operation timed out or failed
+def poll_operation_status(operation_id, timeout: float = None):
+    # Poll the operation status until it's done, failed or the deadline passed
+    return LongRunningOperation(operation_id, timeout=timeout).wait()
+
+
+#---------------------------------------------------------
+# SQL endpoint provisioning of new Lakehouses. Creation
+# registers the Lakehouse with the SqlEndpointWatcher and
+# moves on; a single background loop lists the Lakehouses
+# of each workspace with pending endpoints per round, and
+# only the consumers of the endpoint wait on its future.
+#---------------------------------------------------------
+def is_sql_endpoint_ready(lakehouse: dict) -> bool:
+    sql_endpoint = ((lakehouse or {}).get("properties") or {}).get("sqlEndpointProperties") or {}
+    return sql_endpoint.get("provisioningStatus") not in [None, "InProgress"]
+
+
+class SqlEndpointWatcher:
+    """
+    Tracks Lakehouses waiting for SQL endpoint provisioning and resolves their futures from one loop.
+    """
+    def __init__(self):
+        self._pending = {} # (workspace_id, lakehouse_id) -> (future, deadline)
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def watch(self, workspace_id: str, lakehouse_id: str, timeout: float = None) -> Future:
+        key = (workspace_id, lakehouse_id)
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None and (not future.done() or future.result() is not None):
+                return future
+
+            future = Future()
+            self._futures[key] = future
+            self._pending[key] = (future, time.time() + (timeout or SQL_ENDPOINT_TIMEOUT))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sql-endpoint-watcher", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return future
+
+    def _poll(self):
+        with self._lock:
+            pending = dict(self._pending)
+
+        # One list call per workspace covers all of its pending Lakehouses
+        for workspace_id in {key[0] for key in pending}:
+            try:
+                lakehouses = {lakehouse.get("id"): lakehouse for lakehouse in list_all_pages(f"workspaces/{workspace_id}/lakehouses")}
+            except Exception:
+                lakehouses = {}
+
+            for key, (future, deadline) in pending.items():
+                if key[0] != workspace_id:
+                    continue
+                lakehouse = lakehouses.get(key[1])
+                if is_sql_endpoint_ready(lakehouse):
+                    result = lakehouse
+                elif time.time() >= deadline:
+                    result = None
+                else:
+                    continue
+
+                with self._lock:
+                    self._pending.pop(key, None)
+                future.set_result(result)
+
+    def _run(self):
+        delay = LRO_INITIAL_DELAY
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._thread = None
+                    return
+
+            self._wakeup.clear()
+            self._poll()
+
+            # Newly registered Lakehouses restart the backoff
+            if self._wakeup.wait(delay):
+                delay = LRO_INITIAL_DELAY
+            else:
+                delay = min(delay * LRO_BACKOFF_FACTOR, LRO_MAX_DELAY)
+
+
+_sql_endpoint_watcher = SqlEndpointWatcher()
+
+
+def watch_sql_endpoint(workspace_id: str, lakehouse_id: str, timeout: float = None) -> Future:
+    # The future resolves to the Lakehouse definition once its SQL endpoint is provisioned, or None after the timeout
+    return _sql_endpoint_watcher.watch(workspace_id, lakehouse_id, timeout)
+
+
+def wait_for_sql_endpoint(workspace_id: str, lakehouse_id: str, timeout: float = None):
+    return watch_sql_endpoint(workspace_id, lakehouse_id, timeout).result()
 
 
 def takeover_semantic_model(workspace_id, semantic_model_id):
     takeover_url = f"groups/{workspace_id}/datasets/{semantic_model_id}/Default.TakeOver"
-    response = run_command(f"api -A powerbi -X post {takeover_url}")
-    return json.loads(response)
+    return invoke_api(takeover_url, "post", audience="powerbi")
 
 
 def generate_connection_string(workspace_name, item_type, database, client_id, client_secret):
@@ -331,4 +1464,63 @@ def generate_connection_string(workspace_name, item_type, database, client_id, c
         f"Connection Timeout=60;"
     )
 
-    return connection_string
\ No newline at end of file
+    return connection_string
+
+
+#---------------------------------------------------------
+# Async variants for fan-out workloads. The CLI and HTTP
+# transports are blocking, so calls run on worker threads
+# bounded by ASYNC_CONCURRENCY per event loop.
+#---------------------------------------------------------
+_async_semaphores = weakref.WeakKeyDictionary()
+
+
+def _get_async_semaphore():
+    loop = asyncio.get_running_loop()
+    semaphore = _async_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _async_semaphores[loop] = asyncio.Semaphore(ASYNC_CONCURRENCY)
+    return semaphore
+
+
+async def run_bounded(function, *args, **kwargs):
+    async with _get_async_semaphore():
+        return await asyncio.to_thread(function, *args, **kwargs)
+
+
+def run_concurrently(*coroutines, return_exceptions: bool = False):
+    async def gather_all():
+        return await asyncio.gather(*coroutines, return_exceptions=return_exceptions)
+    return asyncio.run(gather_all())
+
+
+async def get_item_async(item_path: str, retry_count: int = 0):
+    return await run_bounded(get_item, item_path, retry_count)
+
+
+async def item_exists_async(item_path):
+    return await run_bounded(item_exists, item_path)
+
+
+async def connection_exists_async(connection_identifier):
+    return await run_bounded(connection_exists, connection_identifier)
+
+
+async def get_connection_async(connection_identifier):
+    return await run_bounded(get_connection, connection_identifier)
+
+
+async def list_all_workspace_items_async(workspace_id):
+    return await run_bounded(list_all_workspace_items, workspace_id)
+
+
+async def add_connection_roleassignment_async(connection_id, identity_id, identity_type, role):
+    return await run_bounded(add_connection_roleassignment, connection_id, identity_id, identity_type, role)
+
+
+async def update_workspace_from_git_async(workspace_id, remote_commit_hash, timeout: float = None):
+    return await run_bounded(update_workspace_from_git, workspace_id, remote_commit_hash, timeout=timeout)
+
+
+async def poll_operation_status_async(operation_id, timeout: float = None):
+    return await run_bounded(poll_operation_status, operation_id, timeout)
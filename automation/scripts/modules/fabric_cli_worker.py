@@ -0,0 +1,79 @@
+#---------------------------------------------------------
+# Long-lived Fabric CLI worker used by the session pool in
+# fabric_cli_functions. Imports the CLI once and executes
+# the commands received on stdin in-process. Each request
+# and response is a single JSON line.
+#---------------------------------------------------------
+import sys, os, json, tempfile
+
+
+def invoke(main, command):
+    sys.argv = ["fab", "-c", command]
+    try:
+        returncode = main()
+        return returncode if isinstance(returncode, int) else 0
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        return e.code if isinstance(e.code, int) else 1
+    except Exception as e:
+        print(str(e), file=sys.stderr)
+        return 1
+
+
+def serve():
+    # Responses are written to a private copy of stdout, so the CLI output can be captured on fd 1/2
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8")
+    saved_stdout = os.dup(1)
+    saved_stderr = os.dup(2)
+
+    try:
+        from fabric_cli.main import main
+    except Exception as e:
+        protocol.write(json.dumps({"ready": False, "error": str(e)}) + "\n")
+        protocol.flush()
+        return
+
+    # Requests are read from a private copy of stdin. The CLI itself reads from os.devnull, so a prompt
+    # (e.g. a command without -f) gets end of input instead of consuming the next request
+    requests = os.fdopen(os.dup(sys.stdin.fileno()), "r", encoding="utf-8")
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    sys.stdin = open(os.devnull, "r", encoding="utf-8")
+
+    protocol.write(json.dumps({"ready": True}) + "\n")
+    protocol.flush()
+
+    for line in requests:
+        if not line.strip():
+            continue
+
+        request = json.loads(line)
+        with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(out.fileno(), 1)
+            os.dup2(err.fileno(), 2)
+            try:
+                returncode = invoke(main, request.get("command", ""))
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os.dup2(saved_stdout, 1)
+                os.dup2(saved_stderr, 2)
+
+            out.seek(0)
+            err.seek(0)
+            response = {
+                "returncode": returncode,
+                "stdout": out.read().decode("utf-8", errors="replace"),
+                "stderr": err.read().decode("utf-8", errors="replace")
+            }
+
+        protocol.write(json.dumps(response) + "\n")
+        protocol.flush()
+
+
+if __name__ == "__main__":
+    serve()
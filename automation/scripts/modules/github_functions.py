@@ -1,5 +1,13 @@
 import requests
 import base64
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+SECRET_SYNC_CONCURRENCY = 8 # Parallel secret requests in sync_secrets and delete_secrets
+
+# Keep-alive connections shared by all GitHub requests
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_maxsize=SECRET_SYNC_CONCURRENCY))
 
 def build_headers(pat):
     """Build authorization headers for GitHub API using PAT."""
@@ -23,12 +31,19 @@ def get_repository(owner, repo_name, pat):
     return response.json()
 
 
-def get_public_key(owner, repo_name, pat):
-    """Get the repository's public key for encrypting secrets."""
+def get_secrets_url(owner, repo_name, environment=None):
+    """Get the secrets endpoint of a repository, or of one of its environments."""
+    if environment:
+        return f"https://api.github.com/repos/{owner}/{repo_name}/environments/{environment}/secrets"
+    return f"https://api.github.com/repos/{owner}/{repo_name}/actions/secrets"
+
+
+def get_public_key(owner, repo_name, pat, environment=None):
+    """Get the repository's (or environment's) public key for encrypting secrets."""
     headers = build_headers(pat)
-    url = f"https://api.github.com/repos/{owner}/{repo_name}/actions/secrets/public-key"
+    url = f"{get_secrets_url(owner, repo_name, environment)}/public-key"
     
-    response = requests.get(url, headers=headers)
+    response = _session.get(url, headers=headers)
     response.raise_for_status()
     
     return response.json()
@@ -49,12 +64,23 @@ def encrypt_secret(public_key_str, secret_value):
     return base64.b64encode(encrypted).decode('utf-8')
 
 
-def create_or_update_secret(owner, repo_name, secret_name, secret_value, pat):
-    """Create or update a repository secret."""
+def encrypt_secrets(public_key_str, secret_values):
+    """Encrypt several secrets with one sealed box of the repository's public key."""
+    from nacl import public, encoding
+
+    sealed_box = public.SealedBox(public.PublicKey(public_key_str.encode('utf-8'), encoder=encoding.Base64Encoder))
+    return {
+        secret_name: base64.b64encode(sealed_box.encrypt(secret_value.encode('utf-8'))).decode('utf-8')
+        for secret_name, secret_value in secret_values.items()
+    }
+
+
+def create_or_update_secret(owner, repo_name, secret_name, secret_value, pat, environment=None):
+    """Create or update a repository secret. Use sync_secrets when setting several secrets."""
     headers = build_headers(pat)
     
     # Get the public key for encryption
-    public_key_response = get_public_key(owner, repo_name, pat)
+    public_key_response = get_public_key(owner, repo_name, pat, environment)
     public_key_id = public_key_response.get('key_id')
     public_key = public_key_response.get('key')
     
@@ -62,44 +88,125 @@ def create_or_update_secret(owner, repo_name, secret_name, secret_value, pat):
     encrypted_value = encrypt_secret(public_key, secret_value)
     
     # Create or update the secret
-    url = f"https://api.github.com/repos/{owner}/{repo_name}/actions/secrets/{secret_name}"
+    url = f"{get_secrets_url(owner, repo_name, environment)}/{secret_name}"
     
     payload = {
         "encrypted_value": encrypted_value,
         "key_id": public_key_id
     }
     
-    response = requests.put(url, headers=headers, json=payload)
+    response = _session.put(url, headers=headers, json=payload)
     response.raise_for_status()
     
     return response.status_code in [201, 204]
 
 
-def delete_secret(owner, repo_name, secret_name, pat):
+def delete_secret(owner, repo_name, secret_name, pat, environment=None):
     """Delete a repository secret."""
     headers = build_headers(pat)
-    url = f"https://api.github.com/repos/{owner}/{repo_name}/actions/secrets/{secret_name}"
+    url = f"{get_secrets_url(owner, repo_name, environment)}/{secret_name}"
     
-    response = requests.delete(url, headers=headers)
+    response = _session.delete(url, headers=headers)
     response.raise_for_status()
 
 
-def list_secrets(owner, repo_name, pat):
-    """List all secrets in a repository."""
+def list_secrets(owner, repo_name, pat, environment=None):
+    """List all secrets in a repository, following all result pages."""
     headers = build_headers(pat)
-    url = f"https://api.github.com/repos/{owner}/{repo_name}/actions/secrets"
+    url = get_secrets_url(owner, repo_name, environment)
     
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    
-    return response.json()
+    secrets = []
+    page = 1
+    while True:
+        response = _session.get(url, headers=headers, params={"per_page": 100, "page": page})
+        response.raise_for_status()
 
+        result = response.json()
+        secrets.extend(result.get("secrets", []))
+        if len(secrets) >= result.get("total_count", 0) or not result.get("secrets"):
+            return {"total_count": result.get("total_count", len(secrets)), "secrets": secrets}
+        page += 1
 
-def secret_exists(owner, repo_name, secret_name, pat):
-    """Check if a secret exists in the repository."""
+
+def secret_exists(owner, repo_name, secret_name, pat, environment=None):
+    """Check if a secret exists in the repository. Use list_secrets when checking several secrets."""
     headers = build_headers(pat)
-    url = f"https://api.github.com/repos/{owner}/{repo_name}/actions/secrets/{secret_name}"
+    url = f"{get_secrets_url(owner, repo_name, environment)}/{secret_name}"
     
-    response = requests.get(url, headers=headers)
+    response = _session.get(url, headers=headers)
     
     return response.status_code == 200
+
+
+def sync_secrets(owner, repo_name, secrets, pat, environment=None, delete_missing=False):
+    """
+    Create or update several secrets at once.
+
+    The public key is fetched once, all values are encrypted in one batch and the secrets are written
+    concurrently. Existing secrets are listed once to report created and updated secrets and, with
+    delete_missing, to delete secrets not in the given dictionary.
+
+    Returns:
+        dict: The outcome per secret name: "created", "updated", "deleted" or "failed: <error>".
+        Secrets without a value are not written and reported as "failed: missing value".
+    """
+    headers = build_headers(pat)
+    url = get_secrets_url(owner, repo_name, environment)
+
+    # A missing credential (None or empty) must not be uploaded as a value
+    missing_secrets = [secret_name for secret_name, secret_value in secrets.items() if secret_value is None or secret_value == ""]
+
+    existing_secrets = {secret.get("name") for secret in list_secrets(owner, repo_name, pat, environment).get("secrets", [])}
+    public_key_response = get_public_key(owner, repo_name, pat, environment)
+    encrypted_values = encrypt_secrets(public_key_response.get('key'), {secret_name: secret_value for secret_name, secret_value in secrets.items() if secret_name not in missing_secrets})
+
+    def put_secret(secret_name):
+        payload = {
+            "encrypted_value": encrypted_values[secret_name],
+            "key_id": public_key_response.get('key_id')
+        }
+        try:
+            response = _session.put(f"{url}/{secret_name}", headers=headers, json=payload)
+            response.raise_for_status()
+            return secret_name, "updated" if secret_name.upper() in {name.upper() for name in existing_secrets} else "created"
+        except Exception as e:
+            return secret_name, f"failed: {e}"
+
+    with ThreadPoolExecutor(max_workers=SECRET_SYNC_CONCURRENCY) as executor:
+        results = dict(executor.map(put_secret, encrypted_values))
+    results.update({secret_name: "failed: missing value" for secret_name in missing_secrets})
+
+    if delete_missing:
+        # GitHub stores secret names upper-cased
+        obsolete_secrets = [name for name in existing_secrets if name.upper() not in {secret_name.upper() for secret_name in secrets}]
+        results.update(delete_secrets(owner, repo_name, obsolete_secrets, pat, environment, existing_secrets))
+
+    return results
+
+
+def delete_secrets(owner, repo_name, secret_names, pat, environment=None, existing_secrets=None):
+    """
+    Delete several secrets concurrently. Secrets that do not exist are reported as "not_found" without a request.
+
+    Returns:
+        dict: The outcome per secret name: "deleted", "not_found" or "failed: <error>".
+    """
+    headers = build_headers(pat)
+    url = get_secrets_url(owner, repo_name, environment)
+
+    if existing_secrets is None:
+        existing_secrets = {secret.get("name") for secret in list_secrets(owner, repo_name, pat, environment).get("secrets", [])}
+    existing_secrets = {name.upper() for name in existing_secrets}
+
+    def remove_secret(secret_name):
+        if secret_name.upper() not in existing_secrets:
+            return secret_name, "not_found"
+        try:
+            response = _session.delete(f"{url}/{secret_name}", headers=headers)
+            response.raise_for_status()
+            return secret_name, "deleted"
+        except Exception as e:
+            return secret_name, f"failed: {e}"
+
+    with ThreadPoolExecutor(max_workers=SECRET_SYNC_CONCURRENCY) as executor:
+        return dict(executor.map(remove_secret, secret_names))
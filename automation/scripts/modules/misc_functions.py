@@ -1,4 +1,5 @@
-import json, os, uuid, re, copy
+import json, os, uuid, re, copy, io, sys, threading, hashlib, time, atexit, contextlib, contextvars, itertools, logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from ruamel.yaml import YAML
 from ruamel.yaml.comments import CommentedMap, CommentedSeq
 
@@ -16,6 +17,9 @@ cgreen = '\033[32m'
 cgreen_bold = '\033[1;32m'
 cblue_bold = '\033[1;34m'
 
+# Workspace roles from highest to lowest. An identity listed under several roles gets the highest one
+WORKSPACE_ROLES = ["Admin", "Member", "Contributor", "Viewer"]
+
 
 def print_error(value, bold:bool = False):
     if bold:
@@ -57,6 +61,281 @@ def print_subheader(value):
     print(f"{cyellow_bold}##################################################################################################################{cdefault}")
     
 
+class TaskOutput(io.TextIOBase):
+    """
+    Stdout proxy used by run_task_graph. Output of a task is buffered per thread and written as
+    one block when the task finishes, so the output of concurrent tasks does not interleave.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is not None:
+            return buffer.write(text)
+        with self._lock:
+            return self.stream.write(text)
+
+    def flush(self):
+        with self._lock:
+            self.stream.flush()
+
+    def start_task(self):
+        self._local.buffer = io.StringIO()
+
+    def end_task(self):
+        buffer, self._local.buffer = self._local.buffer, None
+        with self._lock:
+            self.stream.write(buffer.getvalue())
+            self.stream.flush()
+
+    def current_buffer(self):
+        return getattr(self._local, "buffer", None)
+
+    @contextlib.contextmanager
+    def use_buffer(self, buffer):
+        # Lets a thread started by a task write into the output of that task
+        previous = self.current_buffer()
+        self._local.buffer = buffer
+        try:
+            yield
+        finally:
+            self._local.buffer = previous
+
+
+def get_task_output():
+    # Output buffer of the running task, None outside run_task_graph. See task_output
+    return sys.stdout.current_buffer() if isinstance(sys.stdout, TaskOutput) else None
+
+
+@contextlib.contextmanager
+def task_output(buffer):
+    """
+    Write the output of the current thread into the output of a task (see get_task_output),
+    e.g. in the worker threads of a library called by the task.
+    """
+    if buffer is None or not isinstance(sys.stdout, TaskOutput):
+        yield
+        return
+    with sys.stdout.use_buffer(buffer):
+        yield
+
+
+class StdoutLogHandler(logging.StreamHandler):
+    """
+    StreamHandler writing to the sys.stdout of the moment a record is emitted instead of the stream
+    it was created with, so log records of a task in run_task_graph are part of the output of that task.
+    """
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+def route_logger_to_stdout(logger_name: str):
+    # Replaces the console (stream) handlers of a logger by a StdoutLogHandler with the same level and format
+    logger = logging.getLogger(logger_name)
+    for handler in list(logger.handlers):
+        if type(handler) is logging.StreamHandler:
+            stdout_handler = StdoutLogHandler()
+            stdout_handler.setLevel(handler.level)
+            stdout_handler.setFormatter(handler.formatter)
+            for log_filter in handler.filters:
+                stdout_handler.addFilter(log_filter)
+            logger.removeHandler(handler)
+            logger.addHandler(stdout_handler)
+
+
+def run_task_graph(tasks: dict, max_workers: int = 8) -> dict:
+    """
+    Run tasks on a thread pool, each as soon as the tasks it depends on have succeeded.
+    Tasks depending on a failed or skipped task are skipped.
+
+    Args:
+        tasks (dict): Task name mapped to a tuple (function, list of task names it depends on). Functions take no arguments.
+        max_workers (int): Maximum number of tasks running at the same time.
+
+    Returns:
+        dict: Task name mapped to {"status": "succeeded"/"failed"/"skipped", "result": ..., "error": ...}.
+    """
+    for name, (_, dependencies) in tasks.items():
+        unknown = [dependency for dependency in dependencies if dependency not in tasks]
+        if unknown:
+            raise ValueError(f"Task '{name}' depends on unknown tasks: {', '.join(unknown)}")
+
+    output = TaskOutput(sys.stdout)
+
+    def run_task(name, function):
+        output.start_task()
+        try:
+            with trace_span(name, "task"):
+                return {"status": "succeeded", "result": function(), "error": None}
+        except Exception as e:
+            print_error(f" ✖ Failed! {e}")
+            return {"status": "failed", "result": None, "error": e}
+        finally:
+            output.end_task()
+
+    results = {}
+    pending = dict(tasks)
+    running = {}
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or running:
+                progress = True
+                while progress:
+                    progress = False
+                    for name, (function, dependencies) in list(pending.items()):
+                        states = [results.get(dependency, {}).get("status") for dependency in dependencies]
+                        if any(state in ["failed", "skipped"] for state in states):
+                            results[name] = {"status": "skipped", "result": None, "error": None}
+                        elif all(state == "succeeded" for state in states):
+                            # Tasks run in a copy of the current context, so their spans are nested under the current span
+                            running[executor.submit(contextvars.copy_context().run, run_task, name, function)] = name
+                        else:
+                            continue
+                        del pending[name]
+                        progress = True
+
+                if not running:
+                    if pending:
+                        raise ValueError(f"Circular task dependencies between: {', '.join(pending)}")
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+    finally:
+        sys.stdout = output.stream
+
+    return results
+
+
+#---------------------------------------------------------
+# Tracing. Spans are recorded as Chrome trace events, which
+# can be opened in https://ui.perfetto.dev or chrome://tracing
+#---------------------------------------------------------
+# Values of these keys, CLI options and headers are replaced before they are written to the trace
+SECRET_PATTERNS = [
+    re.compile(r"(\s(?:-p|--password)\s+)(\S+)"),
+    re.compile(r"(?i)(\"?[\w.]*(?:secret|password|pwd|token|key|pat)\"?\s*[=:]\s*\"?)([^\",;&\s}]+)"),
+    re.compile(r"(?i)(bearer\s+)(\S+)")
+]
+
+
+def redact(value):
+    if not isinstance(value, str):
+        return value
+    for pattern in SECRET_PATTERNS:
+        value = pattern.sub(lambda match: f"{match.group(1)}***", value)
+    return value
+
+
+class Tracer:
+    """
+    Records nested spans (run → layer → phase → item → CLI/HTTP call) as complete events of the Chrome trace event format.
+    The current span is kept in a context variable, so spans started on worker threads are nested under the span
+    the work was handed over from (see run_task_graph; asyncio.to_thread copies the context as well).
+    """
+    def __init__(self):
+        self.enabled = False
+        self.run_name = None
+        self._events = []
+        self._threads = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._current = contextvars.ContextVar("trace_span", default=None)
+        self._start = time.perf_counter()
+
+    def _now(self) -> int:
+        return int((time.perf_counter() - self._start) * 1_000_000)
+
+    def enable(self, run_name: str):
+        self.enabled = True
+        self.run_name = run_name
+        self._start = time.perf_counter()
+        self._current.set({"id": 0, "name": run_name})
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str = "", **attributes):
+        """
+        Record a span around the enclosed block. The yielded dict takes attributes set while the span is open,
+        e.g. a status code. Exceptions raised in the block are recorded as the "error" attribute.
+        """
+        if not self.enabled:
+            yield attributes
+            return
+
+        parent = self._current.get()
+        span_id = next(self._ids)
+        token = self._current.set({"id": span_id, "name": name})
+        start = self._now()
+        try:
+            yield attributes
+        except BaseException as e:
+            attributes["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self._current.reset(token)
+            self._record(name, category, start, self._now() - start, {
+                **{key: redact(value) if isinstance(value, str) else value for key, value in attributes.items()},
+                "span_id": span_id,
+                "parent_id": (parent or {}).get("id"),
+                "parent": (parent or {}).get("name")
+            })
+
+    def _record(self, name: str, category: str, start: int, duration: int, args: dict, thread: threading.Thread = None):
+        thread = thread or threading.current_thread()
+        event = {"name": name, "cat": category, "ph": "X", "ts": start, "dur": duration, "pid": os.getpid(), "tid": thread.ident, "args": args}
+        with self._lock:
+            if thread.ident not in self._threads:
+                self._threads.add(thread.ident)
+                self._events.append({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread.ident, "args": {"name": thread.name}})
+            self._events.append(event)
+
+    def save(self, file_path: str):
+        """Write the recorded spans, with the run span covering the time since tracing was enabled, as Chrome trace JSON."""
+        if not self.enabled:
+            return
+        self._record(self.run_name, "run", 0, self._now(), {"span_id": 0}, threading.main_thread())
+        with self._lock:
+            trace = {"traceEvents": list(self._events), "displayTimeUnit": "ms"}
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump(trace, f, default=str)
+        print_info(f"Trace written to {file_path}")
+
+
+_tracer = Tracer()
+
+
+def enable_tracing(file_path: str, run_name: str = None):
+    """
+    Start recording spans and write them to file_path when the script exits. Does nothing without a file path.
+    """
+    if not file_path or _tracer.enabled:
+        return
+    _tracer.enable(run_name or os.path.basename(sys.argv[0]))
+    atexit.register(_tracer.save, file_path)
+
+
+def trace_span(name: str, category: str = "", **attributes):
+    return _tracer.span(name, category, **attributes)
+
+
+def is_tracing_enabled() -> bool:
+    return _tracer.enabled
+
+
 def flatten_dict(d, parent_key=''):
     items = []
     for k, v in d.items():
@@ -405,6 +684,140 @@ def load_environments_as_dict(env_file_map):
     return all_environments
 
 
+GUID_PATTERN = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+DEFAULT_LOGICAL_ID = "00000000-0000-0000-0000-000000000000"
+DEFAULT_GUID = DEFAULT_LOGICAL_ID
+
+
+def get_repository_items(repository_directory: str, item_types: list = None) -> list:
+    """
+    Items in a repository directory, read from their .platform files.
+
+    Args:
+        repository_directory (str): Directory holding the item folders (e.g. a layer of the solution).
+        item_types (list): Item types to include. Defaults to all types.
+
+    Returns:
+        list: One {"name", "type", "logical_id", "path"} per item.
+    """
+    items = []
+    for root, _, files in os.walk(repository_directory):
+        if ".platform" in files:
+            try:
+                with open(os.path.join(root, ".platform"), "r", encoding="utf-8") as f:
+                    platform = json.load(f)
+            except (OSError, ValueError):
+                continue
+
+            metadata = platform.get("metadata") or {}
+            if item_types is None or metadata.get("type") in item_types:
+                items.append({
+                    "name": metadata.get("displayName"),
+                    "type": metadata.get("type"),
+                    "logical_id": (platform.get("config") or {}).get("logicalId"),
+                    "path": root
+                })
+    return items
+
+
+def get_repository_logical_ids(repository_directory: str) -> dict:
+    """
+    Logical ids of the items in a repository directory, read from their .platform files.
+
+    Returns:
+        dict: Logical id (lower case) mapped to the item directory.
+    """
+    return {
+        item["logical_id"].lower(): item["path"]
+        for item in get_repository_items(repository_directory)
+        if item["logical_id"] and item["logical_id"] != DEFAULT_LOGICAL_ID
+    }
+
+
+def get_content_hash(directory: str, *salts) -> str:
+    """
+    SHA-256 hash of the files below a directory (relative paths and contents) and any additional values,
+    e.g. the parameters applied to the files on deployment.
+    """
+    content_hash = hashlib.sha256()
+    for salt in salts:
+        content_hash.update(json.dumps(salt, sort_keys=True, default=str).encode("utf-8"))
+
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file_name in sorted(files):
+            file_path = os.path.join(root, file_name)
+            content_hash.update(os.path.relpath(file_path, directory).replace(os.sep, "/").encode("utf-8"))
+            with open(file_path, "rb") as f:
+                content_hash.update(f.read())
+    return content_hash.hexdigest()
+
+
+def get_salted_hash(content_hash: str, *salts) -> str:
+    # Combines a hash (see get_content_hash) with values only known later, e.g. the guids of the items it references
+    salted_hash = hashlib.sha256(content_hash.encode("utf-8"))
+    for salt in salts:
+        salted_hash.update(json.dumps(salt, sort_keys=True, default=str).encode("utf-8"))
+    return salted_hash.hexdigest()
+
+
+def get_referenced_guids(repository_directory: str) -> set:
+    # All guids referenced in the item files of a repository directory, except the .platform files
+    guids = set()
+    for root, _, files in os.walk(repository_directory):
+        for file_name in files:
+            if file_name == ".platform":
+                continue
+            try:
+                with open(os.path.join(root, file_name), "r", encoding="utf-8", errors="ignore") as f:
+                    guids.update(guid.lower() for guid in GUID_PATTERN.findall(f.read()))
+            except OSError:
+                continue
+    return guids
+
+
+def get_layer_dependencies(layer_directories: dict) -> dict:
+    """
+    Cross-layer dependencies of a repository: a layer depends on another layer when
+    its items reference logical ids of items defined in that other layer.
+
+    Args:
+        layer_directories (dict): Layer name mapped to its repository directory.
+
+    Returns:
+        dict: Layer name mapped to the sorted list of layers it references.
+    """
+    owners = {}
+    for layer, directory in layer_directories.items():
+        for logical_id in get_repository_logical_ids(directory):
+            owners[logical_id] = layer
+
+    return {
+        layer: sorted({owners[guid] for guid in get_referenced_guids(directory) if guid in owners and owners[guid] != layer})
+        for layer, directory in layer_directories.items()
+    }
+
+
+def replace_all(text: str, replacements: dict, pattern: re.Pattern = None) -> str:
+    """
+    Applies all replacements to a text in a single pass, instead of one pass per value to find.
+    Values are matched case-insensitively.
+
+    Args:
+        text (str): Text to replace the values in.
+        replacements (dict): Values to find mapped to their replacements.
+        pattern (re.Pattern): Pattern matching the candidates to look up, e.g. GUID_PATTERN. Defaults to an
+            alternation of the values to find.
+    """
+    if not text or not replacements:
+        return text
+
+    lookup = {find_value.lower(): replace_value for find_value, replace_value in replacements.items()}
+    if pattern is None:
+        pattern = re.compile("|".join(re.escape(find_value) for find_value in sorted(lookup, key=len, reverse=True)), re.IGNORECASE)
+    return pattern.sub(lambda match: lookup.get(match.group(0).lower(), match.group(0)), text)
+
+
 def get_semantic_model_bindings(yml_path: str, target_layer: str) -> list:
     """
     Parse sqlendpoint_model_binding.yml and return binding entries for the given semantic model layer.
@@ -725,6 +1138,73 @@ def merge_permissions(layer_permissions, generic_permissions):
     return merged
 
 
+def get_connection_role(permission: str) -> str:
+    """
+    Connection role granted for a workspace permission level. Admin maps to Owner, other levels to User.
+    """
+    return "Owner" if (permission or "").lower() == "admin" else "User"
+
+
+def get_role_rank(role: str) -> int:
+    # Position in WORKSPACE_ROLES, lower is higher. Unknown roles rank last
+    roles = [workspace_role.lower() for workspace_role in WORKSPACE_ROLES]
+    return roles.index(role.lower()) if role and role.lower() in roles else len(roles)
+
+
+def get_workspace_role_assignments(permissions: dict, resolve_identity=None) -> dict:
+    """
+    Desired workspace role assignments for a permissions definition, one per identity with its highest role.
+
+    Args:
+        permissions (dict): Permission level mapped to identity definitions, e.g. the result of merge_permissions.
+        resolve_identity (callable): Returns the service principal id of a workspace identity by its name.
+            Workspace identities which cannot be resolved (yet) are left out.
+
+    Returns:
+        dict: Principal id (lower case) mapped to {"id", "type", "role"}.
+    """
+    role_assignments = {}
+    for permission, definitions in (permissions or {}).items():
+        for definition in definitions:
+            if definition.get("type", "").lower() == "workspaceidentity":
+                principal_id = resolve_identity(definition.get("name")) if resolve_identity else None
+                principal_type = "ServicePrincipal"
+            else:
+                principal_id = definition.get("id")
+                principal_type = definition.get("type")
+
+            if not principal_id:
+                continue
+
+            role = next((workspace_role for workspace_role in WORKSPACE_ROLES if workspace_role.lower() == permission.lower()), permission)
+            current = role_assignments.get(principal_id.lower())
+            if current is None or get_role_rank(role) < get_role_rank(current["role"]):
+                role_assignments[principal_id.lower()] = {"id": principal_id, "type": principal_type, "role": role}
+
+    return role_assignments
+
+
+def get_connection_role_assignments(permissions: dict, resolve_identity=None) -> dict:
+    """
+    Desired connection role assignments for a permissions definition. See get_workspace_role_assignments,
+    with the highest workspace role of each identity mapped through get_connection_role.
+    """
+    return {
+        principal_id: {**role_assignment, "role": get_connection_role(role_assignment["role"])}
+        for principal_id, role_assignment in get_workspace_role_assignments(permissions, resolve_identity).items()
+    }
+
+
+def print_role_assignment_result(result: dict):
+    # Completes a progress line with the outcome of a role assignment reconciliation
+    if result["failed"]:
+        print_error(f" ✖ {result['failed']} failed!")
+    elif result["added"] or result["updated"] or result["removed"]:
+        print_success(f" ✔ {result['added']} added, {result['updated']} updated" + (f", {result['removed']} removed" if result["removed"] else ""))
+    else:
+        print_warning(" ⚠ Already assigned")
+
+
 def update_expression_tmsl(
     expression: str,
     config: dict,
@@ -0,0 +1,353 @@
+#---------------------------------------------------------
+# Plan/apply support for fabric_setup. The desired state is
+# derived from the merged infrastructure definition and the
+# actual state from one snapshot of bulk listings. Their
+# difference is a plan of create/update changes, written
+# as JSON and applied by fabric_setup as a task graph.
+#---------------------------------------------------------
+import os, time
+import modules.fabric_cli_functions as fabcli
+import modules.misc_functions as misc
+
+SQL_CONNECTION_ITEM_TYPES = {"Lakehouse", "SQLDatabase", "Warehouse"}
+
+
+def get_default_plan_file(environment: str) -> str:
+    return os.path.join(os.getcwd(), f"setup_plan.{environment}.json")
+
+
+def get_principals(permissions: dict, layer: str, environment: str) -> dict:
+    """
+    Identities of a permissions definition with their highest workspace role (see misc.get_workspace_role_assignments).
+    Workspace identities are keyed by the name of their workspace, as their id is only known once it exists.
+    """
+    identity_prefix = "identity:"
+    role_assignments = misc.get_workspace_role_assignments(permissions, lambda name: f"{identity_prefix}{name.format(layer=layer, environment=environment)}")
+
+    principals = {}
+    for role_assignment in role_assignments.values():
+        key = role_assignment["id"]
+        if key.startswith(identity_prefix):
+            principal = {"principal_id": None, "principal_type": "ServicePrincipal", "identity_workspace": key[len(identity_prefix):]}
+        else:
+            principal = {"principal_id": key, "principal_type": role_assignment["type"], "identity_workspace": None}
+        principals[key] = {**principal, "role": role_assignment["role"]}
+    return principals
+
+
+def get_git_repo_url(git_settings: dict) -> str:
+    provider_details = git_settings.get("gitProviderDetails")
+    if provider_details.get("gitProviderType").lower() == "github":
+        return f"https://github.com/{provider_details.get('ownerName')}/{provider_details.get('repositoryName')}"
+    return f"https://dev.azure.com/{provider_details.get('organizationName')}/{provider_details.get('projectName')}/_git/{provider_details.get('repositoryName')}"
+
+
+def get_desired_state(env_definition: dict, environment: str) -> dict:
+    """
+    Resources described by the merged environment definition, keyed by address.
+
+    Args:
+        env_definition (dict): The merged infrastructure definition.
+        environment (str): The environment being set up.
+
+    Returns:
+        dict: Address mapped to {"type", "address", "attributes", "depends_on"}.
+    """
+    resources = {}
+
+    def add(resource_type, address, attributes, depends_on=None):
+        resources[address] = {"type": resource_type, "address": address, "attributes": attributes, "depends_on": depends_on or []}
+
+    generic = env_definition.get("generic") or {}
+    solution_name = env_definition.get("name")
+    layers = env_definition.get("layers") or {}
+    workspace_names = {layer: solution_name.format(layer=layer, environment=environment) for layer in layers}
+    identity_workspaces = {workspace_names[layer] for layer, layer_definition in layers.items() if layer_definition.get("create_workspace_identity", False)}
+
+    def identity_dependencies(principal):
+        if principal["identity_workspace"] in identity_workspaces:
+            return [f"workspace_identity:{principal['identity_workspace']}"]
+        return []
+
+    def add_connection_roles(connection_name, permissions, layer=None):
+        for key, principal in get_principals(permissions, layer, environment).items():
+            add("connection_role", f"connection_role:{connection_name}/{key}", {
+                "connection": connection_name,
+                **principal,
+                "role": misc.get_connection_role(principal["role"])
+            }, [f"connection:{connection_name}"] + identity_dependencies(principal))
+
+    if generic.get("fabric_connections") and generic.get("is_primary"):
+        for connection in generic.get("fabric_connections"):
+            add("connection", f"connection:{connection.get('name')}", {
+                "name": connection.get("name"),
+                "kind": "fabric",
+                "connection_type": connection.get("type"),
+                "credential_type": connection.get("auth_type")
+            })
+            add_connection_roles(connection.get("name"), generic.get("permissions"))
+
+    git_settings = generic.get("git_settings")
+    git_connection_name = (git_settings or {}).get("myGitCredentials", {}).get("connection_name")
+    if git_connection_name:
+        add("connection", f"connection:{git_connection_name}", {
+            "name": git_connection_name,
+            "kind": "git",
+            "provider": git_settings.get("gitProviderDetails").get("gitProviderType"),
+            "repo_url": get_git_repo_url(git_settings)
+        })
+        add_connection_roles(git_connection_name, generic.get("permissions"))
+
+    for layer, layer_definition in layers.items():
+        workspace_name = workspace_names[layer]
+        workspace_address = f"workspace:{workspace_name}"
+        permissions = misc.merge_permissions(layer_definition.get("permissions"), generic.get("permissions"))
+
+        add("workspace", workspace_address, {
+            "name": workspace_name,
+            "layer": layer,
+            "capacity_name": layer_definition.get("capacity_name", generic.get("capacity_name"))
+        })
+
+        for key, principal in get_principals(permissions, layer, environment).items():
+            add("workspace_role", f"workspace_role:{workspace_name}/{key}", {
+                "workspace": workspace_name,
+                **principal
+            }, [workspace_address] + identity_dependencies(principal))
+
+        if layer_definition.get("create_workspace_identity", False):
+            add("workspace_identity", f"workspace_identity:{workspace_name}", {"workspace": workspace_name}, [workspace_address])
+
+        item_addresses = {}
+        for item_type, items in (layer_definition.get("items") or {}).items():
+            for item in items:
+                if not item.get("skip_item_creation", False):
+                    item_address = f"item:{workspace_name}/{item.get('item_name')}.{item_type}"
+                    item_addresses[(item_type, item.get("item_name"))] = item_address
+                    add("item", item_address, {
+                        "workspace": workspace_name,
+                        "item_type": item_type,
+                        "item_name": item.get("item_name"),
+                        "item_folder": item.get("item_folder")
+                    }, [workspace_address])
+
+        for private_endpoint in layer_definition.get("private_endpoints") or []:
+            add("private_endpoint", f"private_endpoint:{workspace_name}/{private_endpoint.get('name')}", {
+                "workspace": workspace_name,
+                "name": private_endpoint.get("name"),
+                "target_id": private_endpoint.get("id"),
+                "auto_approve": bool(private_endpoint.get("auto_approve"))
+            }, [workspace_address])
+
+        if git_settings and layer_definition.get("git_directoryName"):
+            git_connection_identifier = git_connection_name or git_settings.get("myGitCredentials").get("connectionId")
+            add("git", f"git:{workspace_name}", {
+                "workspace": workspace_name,
+                "directory_name": layer_definition.get("git_directoryName"),
+                "connection": git_connection_identifier
+            }, [workspace_address] + list(item_addresses.values()) + ([f"connection:{git_connection_name}"] if git_connection_name else []))
+
+        for item_type, items in (layer_definition.get("items") or {}).items():
+            for item in items:
+                if item.get("connection_name") and item_type in SQL_CONNECTION_ITEM_TYPES:
+                    connection_name = item.get("connection_name").format(layer=layer, environment=environment)
+                    add("connection", f"connection:{connection_name}", {
+                        "name": connection_name,
+                        "kind": "sql",
+                        "workspace": workspace_name,
+                        "item_type": item_type,
+                        "item_name": item.get("item_name"),
+                        "item_folder": item.get("item_folder")
+                    }, [item_addresses.get((item_type, item.get("item_name")), workspace_address)])
+                    add_connection_roles(connection_name, permissions, layer)
+
+    return resources
+
+
+def get_actual_state(resources: dict) -> dict:
+    """
+    Snapshot of the parts of the environment covered by the desired resources, taken with
+    one workspace and one connection listing plus a few listings per existing workspace and connection.
+
+    Returns:
+        dict: {"workspaces": {name: {...}}, "connections": {name: {...}}}
+    """
+    workspace_index = fabcli.get_workspace_index(refresh=True)
+    git_workspaces = {resource["attributes"]["workspace"] for resource in resources.values() if resource["type"] == "git"}
+    workspace_names = {resource["attributes"]["name"] for resource in resources.values() if resource["type"] == "workspace"}
+    workspace_names |= {resource["attributes"]["identity_workspace"] for resource in resources.values() if resource["attributes"].get("identity_workspace")}
+
+    def load_workspace(workspace_name, workspace_id):
+        role_assignments = fabcli.list_workspace_role_assignments(workspace_id)
+        return workspace_name, {
+            "id": workspace_id,
+            "inventory": fabcli.get_workspace_inventory(workspace_id, refresh=True),
+            "role_assignments": {assignment.get("principal", {}).get("id", "").lower(): assignment for assignment in role_assignments},
+            "git": fabcli.get_git_connection_state(workspace_id) if workspace_name in git_workspaces else None
+        }
+
+    catalog = fabcli.get_connection_catalog(refresh=True)
+    role_connections = {resource["attributes"]["connection"] for resource in resources.values() if resource["type"] == "connection_role"}
+
+    def load_connection(connection_name, connection):
+        role_assignments = fabcli.list_connection_role_assignments(connection.get("id")) if connection_name in role_connections else []
+        return connection_name, {
+            "id": connection.get("id"),
+            "role_assignments": {assignment.get("principal", {}).get("id", "").lower(): assignment for assignment in role_assignments}
+        }
+
+    existing_workspaces = {name: workspace_index.get(name.lower()) for name in workspace_names if workspace_index.get(name.lower())}
+    existing_connections = {
+        resource["attributes"]["name"]: catalog.get(resource["attributes"]["name"])
+        for resource in resources.values()
+        if resource["type"] == "connection" and catalog.get(resource["attributes"]["name"])
+    }
+
+    results = fabcli.run_concurrently(
+        *[fabcli.run_bounded(load_workspace, name, workspace_id) for name, workspace_id in existing_workspaces.items()],
+        *[fabcli.run_bounded(load_connection, name, connection) for name, connection in existing_connections.items()]
+    )
+
+    workspace_results = results[:len(existing_workspaces)]
+    connection_results = results[len(existing_workspaces):]
+    return {"workspaces": dict(workspace_results), "connections": dict(connection_results)}
+
+
+def get_identity_principal_id(actual: dict, workspace_name: str):
+    workspace = actual["workspaces"].get(workspace_name)
+    identity = workspace["inventory"].get("ManagedIdentity", workspace_name) if workspace else None
+    return identity.get("id") if identity else None
+
+
+def diff_resource(resource: dict, actual: dict):
+    """
+    Compare one desired resource with the snapshot. Returns the action ("create"/"update"/"error"/None)
+    and the attributes extended with the ids known from the snapshot, or with the "error" message.
+    """
+    attributes = dict(resource["attributes"])
+    resource_type = resource["type"]
+    workspace = actual["workspaces"].get(attributes.get("workspace") or attributes.get("name"))
+
+    if resource_type in ["workspace_role", "connection_role"] and attributes.get("identity_workspace"):
+        attributes["principal_id"] = get_identity_principal_id(actual, attributes["identity_workspace"])
+        # Only identities created by this definition can be resolved once the plan is applied
+        if not attributes["principal_id"] and f"workspace_identity:{attributes['identity_workspace']}" not in resource["depends_on"]:
+            attributes["error"] = f"Workspace identity of '{attributes['identity_workspace']}' does not exist and is not created by this definition"
+            return "error", attributes
+
+    if resource_type == "workspace":
+        if workspace is None:
+            return "create", attributes
+        attributes["workspace_id"] = workspace["id"]
+        return None, attributes
+
+    if resource_type == "connection":
+        connection = actual["connections"].get(attributes["name"])
+        if connection is None:
+            return "create", attributes
+        attributes["connection_id"] = connection["id"]
+        return None, attributes
+
+    if resource_type == "connection_role":
+        connection = actual["connections"].get(attributes["connection"])
+        if connection is None or not attributes["principal_id"]:
+            return "create", attributes
+        attributes["connection_id"] = connection["id"]
+        assignment = connection["role_assignments"].get(attributes["principal_id"].lower())
+        if assignment is None:
+            return "create", attributes
+        if assignment.get("role", "").lower() != attributes["role"].lower():
+            attributes.update({"role_assignment_id": assignment.get("id"), "current_role": assignment.get("role")})
+            return "update", attributes
+        return None, attributes
+
+    if workspace is None:
+        return "create", attributes
+    inventory = workspace["inventory"]
+
+    if resource_type == "workspace_role":
+        assignment = workspace["role_assignments"].get((attributes["principal_id"] or "").lower())
+        if assignment is None:
+            return "create", attributes
+        if assignment.get("role", "").lower() != attributes["role"].lower():
+            attributes.update({"role_assignment_id": assignment.get("id"), "current_role": assignment.get("role")})
+            return "update", attributes
+        return None, attributes
+
+    if resource_type == "workspace_identity":
+        return (None if inventory.exists("ManagedIdentity", attributes["workspace"]) else "create"), attributes
+    if resource_type == "item":
+        return (None if inventory.exists(attributes["item_type"], attributes["item_name"]) else "create"), attributes
+    if resource_type == "private_endpoint":
+        return (None if inventory.exists("ManagedPrivateEndpoint", attributes["name"]) else "create"), attributes
+    if resource_type == "git":
+        connected = (workspace["git"] or {}).get("gitConnectionState") not in [None, "NotConnected"]
+        return (None if connected else "create"), attributes
+
+    raise ValueError(f"Unknown resource type '{resource_type}'")
+
+
+def build_plan(env_definition: dict, environment: str) -> dict:
+    """
+    Compare the desired state of the environment with its actual state.
+
+    Returns:
+        dict: The plan, holding the create/update changes in dependency order, the resources which
+            cannot be planned (errors) and a summary.
+    """
+    resources = get_desired_state(env_definition, environment)
+    actual = get_actual_state(resources)
+
+    changes = []
+    errors = []
+    for resource in resources.values():
+        change_action, attributes = diff_resource(resource, actual)
+        if change_action == "error":
+            errors.append({"address": resource["address"], "error": attributes["error"]})
+        elif change_action:
+            changes.append({**resource, "action": change_action, "attributes": attributes})
+
+    # Dependencies already in place are not part of the plan
+    addresses = {change["address"] for change in changes}
+    for change in changes:
+        change["depends_on"] = [dependency for dependency in change["depends_on"] if dependency in addresses]
+
+    return {
+        "environment": environment,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "summary": {
+            "create": sum(1 for change in changes if change["action"] == "create"),
+            "update": sum(1 for change in changes if change["action"] == "update"),
+            "unchanged": len(resources) - len(changes) - len(errors),
+            "errors": len(errors)
+        },
+        "changes": changes,
+        "errors": errors
+    }
+
+
+def save_plan(plan: dict, plan_file: str):
+    misc.save_json_to_file(plan, plan_file)
+
+
+def load_plan(plan_file: str) -> dict:
+    return misc.read_json_from_file(plan_file)
+
+
+def print_plan(plan: dict):
+    for change in plan["changes"]:
+        if change["action"] == "create":
+            misc.print_success(f"  + {change['address']}")
+        else:
+            misc.print_warning(f"  ~ {change['address']} ({change['attributes'].get('current_role')} → {change['attributes'].get('role')})")
+
+    for error in plan.get("errors", []):
+        misc.print_error(f"  ! {error['address']}: {error['error']}")
+
+    summary = plan["summary"]
+    if plan.get("errors"):
+        misc.print_error(f"Plan: {summary['create']} to create, {summary['update']} to update, {summary['unchanged']} unchanged, {summary['errors']} error(s).", True)
+    elif plan["changes"]:
+        misc.print_info(f"Plan: {summary['create']} to create, {summary['update']} to update, {summary['unchanged']} unchanged.", bold=True)
+    else:
+        misc.print_success(f"No changes. {summary['unchanged']} resources are up to date.", bold=True)
@@ -31,7 +31,7 @@ build_parameter_file = args.build_parameter_file
 
 # Authenticate
 fabcli.run_command("config set encryption_fallback_enabled true")
-fabcli.run_command(f"auth login -u {client_id} -p {client_secret} --tenant {tenant_id}")
+fabcli.login(tenant_id, client_id, client_secret)
 
 dev_environment_data = {
     "name": "dev",
@@ -60,7 +60,7 @@ if build_parameter_file:
             workspace_name_escaped = workspace_name.replace("/", "\\/")
             
             misc.print_info(f"  Scanning workspace: {workspace_name}...", bold=False, end="")
-            workspace_id = fabcli.run_command(f"get '{workspace_name_escaped}.Workspace' -q id -f").strip()
+            workspace_id = fabcli.get_workspace_id(workspace_name)
             
             if misc.is_guid(workspace_id):
                 print(" ✔")
@@ -84,6 +84,9 @@ if build_parameter_file:
 
                     if item.get("type") in {"Lakehouse", "SQLDatabase"}:
                         item_details = fabcli.get_item(f"/{workspace_name_escaped}.Workspace/{item.get('displayName')}.{item.get('type')}", retry_count=1)
+                        if item.get("type") == "Lakehouse" and item_details and not fabcli.is_sql_endpoint_ready(item_details):
+                            # Lakehouse created recently, wait until its SQL endpoint is provisioned
+                            item_details = fabcli.wait_for_sql_endpoint(workspace_id, item.get("id")) or item_details
                         if item_details:
                             fabric_item.update({
                                 "connectionString": item_details.get("properties").get("connectionString") if item.get("type") == "SQLDatabase" else item_details.get("properties").get("sqlEndpointProperties").get("connectionString"),
@@ -104,7 +107,7 @@ if build_parameter_file:
                             if item.get("connection_name") and item_type in {"Lakehouse", "SQLDatabase"}:
                                 connection_name = item.get("connection_name").format(layer=layer_name, environment=environment)
                                 if fabcli.connection_exists(connection_name):
-                                    connection = fabcli.get_item(f".connections/{connection_name}.Connection")
+                                    connection = fabcli.get_connection(connection_name)
                                     upd_item = next((i for i in layer["items"] if i.get('unique_name') == f"{item.get('item_name')}.{item_type}"), None)
                                     if upd_item:
                                         upd_item['connectionId'] = connection.get("id")